@@ -0,0 +1,54 @@
+"""Static analysis results stored under the digest of the analyzed artifact"""
+
+import hashlib
+import json
+import os
+
+from http_cache import atomic_write
+
+# Directory holding one JSON file of results per artifact and analyzer set
+ANALYSIS_CACHE_DIR = os.environ.get(
+    "PKGSCAN_ANALYSIS_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "pkgscan-analysis"),
+)
+enabled = True
+
+
+def analyzer_fingerprint(analyzers):
+    """Short hash of the analyzer versions and settings results depend on
+
+    analyzers is a JSON-serializable dict, e.g. tool versions, options
+    and pkgscan's own ruleset version. Changing any of them gives a new
+    fingerprint, so results from older analyzers are not reused.
+    """
+    encoded = json.dumps(analyzers, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()[:16]
+
+
+def result_path(sha256_digest, fingerprint):
+    """Path of the stored results for an artifact digest and fingerprint"""
+    return os.path.join(
+        ANALYSIS_CACHE_DIR,
+        sha256_digest[:2],
+        sha256_digest + "-" + fingerprint + ".json",
+    )
+
+
+def load_results(sha256_digest, fingerprint):
+    """Return stored results for an artifact, or None if never analyzed"""
+    if not enabled:
+        return None
+    try:
+        with open(result_path(sha256_digest, fingerprint), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def store_results(sha256_digest, fingerprint, results):
+    """Store the results of analyzing an artifact"""
+    if not enabled:
+        return
+    path = result_path(sha256_digest, fingerprint)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    atomic_write(path, json.dumps(results), "w")
@@ -0,0 +1,123 @@
+"""Read files out of wheels and sdists in memory without extracting them"""
+
+import os
+import tarfile
+import zipfile
+
+# Limits on what one archive may expand to, so a decompression bomb
+# can't stall a worker or fill its memory
+MAX_TOTAL_BYTES = 256 * 1024 * 1024
+MAX_MEMBERS = 50000
+
+# Archive types pip may download for a package
+ARCHIVE_SUFFIXES = (".whl", ".zip", ".tar.gz", ".tgz", ".tar.bz2")
+
+# Bytes read at a time, so the byte limit is checked while decompressing
+CHUNK_SIZE = 1024 * 1024
+
+
+class ArchiveLimitError(ValueError):
+    """An archive expands to more members or bytes than allowed"""
+
+
+def is_archive(path):
+    """Check whether a file is an archive type this module can read"""
+    return path.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+class ByteBudget:
+    """Bytes an archive may still expand to, charged as members are read
+
+    Sizes declared in archive headers can lie, so the decompressed bytes
+    are counted as they are read.
+    """
+
+    def __init__(self, limit=None):
+        self.remaining = MAX_TOTAL_BYTES if limit is None else limit
+
+    def charge(self, size):
+        """Take size bytes from the budget, raising once it runs out"""
+        self.remaining -= size
+        if self.remaining < 0:
+            raise ArchiveLimitError("archive expands past byte limit")
+
+    def read_chunks(self, member_file):
+        """Yield a member's chunks, charging each one"""
+        for chunk in iter(lambda: member_file.read(CHUNK_SIZE), b""):
+            self.charge(len(chunk))
+            yield chunk
+
+
+def iter_zip_member_chunks(path, wanted):
+    """Yield (name, chunks) for wanted members of a wheel or zip"""
+    with zipfile.ZipFile(path) as archive:
+        infos = archive.infolist()
+        if len(infos) > MAX_MEMBERS:
+            raise ArchiveLimitError("archive has too many members")
+        budget = ByteBudget()
+        for info in infos:
+            if info.is_dir() or not wanted(info.filename):
+                continue
+            with archive.open(info) as member_file:
+                yield info.filename, budget.read_chunks(member_file)
+
+
+def iter_tar_member_chunks(path, wanted):
+    """Yield (name, chunks) for wanted members of a tarball, in one pass"""
+    # "r|*" reads the compressed stream sequentially without seeking
+    with tarfile.open(path, mode="r|*") as archive:
+        budget = ByteBudget()
+        for count, member in enumerate(archive, 1):
+            if count > MAX_MEMBERS:
+                raise ArchiveLimitError("archive has too many members")
+            # Links and devices are skipped, only regular files are read
+            if not member.isfile():
+                continue
+            if not wanted(member.name):
+                # Skipping a member still decompresses it in stream mode
+                budget.charge(member.size)
+                continue
+            yield member.name, budget.read_chunks(archive.extractfile(member))
+
+
+def iter_member_chunks(path, wanted=None):
+    """Yield (name, chunks) for the files of an archive, without extracting
+
+    chunks is an iterator over the member's decompressed bytes, which
+    must be read before the next member is asked for. wanted, if given,
+    is called with each member name and only members it accepts are
+    decompressed. ArchiveLimitError is raised once the archive goes past
+    MAX_MEMBERS or MAX_TOTAL_BYTES.
+    """
+    if wanted is None:
+        wanted = is_any_member
+    if path.lower().endswith((".whl", ".zip")):
+        return iter_zip_member_chunks(path, wanted)
+    return iter_tar_member_chunks(path, wanted)
+
+
+def iter_members(path, wanted=None):
+    """Yield (name, data) for the files of an archive, entirely in memory
+
+    Members are read as iter_member_chunks() reads them.
+    """
+    for name, chunks in iter_member_chunks(path, wanted):
+        yield name, b"".join(chunks)
+
+
+def is_any_member(name):  # pylint: disable=unused-argument
+    """Accept every archive member"""
+    return True
+
+
+def is_python_source(name):
+    """Check whether an archive member is a Python source file"""
+    return name.endswith(".py")
+
+
+def safe_member_path(name):
+    """Return a relative path for a member, or None if it escapes the root"""
+    path = os.path.normpath(name.replace("\\", "/"))
+    if os.path.isabs(path) or path == ".." or path.startswith(".." + os.sep):
+        return None
+    return path
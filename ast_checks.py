@@ -0,0 +1,593 @@
+"""Checks for obfuscated and risky code in one pass over each file's AST
+
+Each Python source is parsed once and its tree walked once. Every node
+is handed to the detectors registered for its type, and the McCabe
+complexity of each function is counted along the way, so adding a
+detector adds no parsing or walking. Files are spread over a pool of
+worker processes.
+
+A detector subclasses Detector, names the node types it looks at and
+reports findings through the walker, which tracks import aliases,
+whether code runs at import time and which file is being read:
+
+    @register
+    class PickleLoads(Detector):
+        name = "pickle_loads"
+        node_types = (ast.Call,)
+
+        def check(self, node, walker):
+            if walker.call_name(node) == "pickle.loads":
+                walker.report(self, node, "MEDIUM", "pickle.loads() call")
+"""
+
+import ast
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import math
+import multiprocessing
+import os
+import sys
+
+# Functions with at least this complexity are listed in the results, as
+# mccabe's own default --max-complexity
+MCCABE_THRESHOLD = 10
+
+# String literals at least this long, without white space, and with at
+# least this many bits of entropy per character are reported. Prose and
+# identifiers stay under 5 bits, base64 payloads are near 6.
+MIN_ENTROPY_LENGTH = 64
+ENTROPY_THRESHOLD = 5.0
+
+# Literals at least this long passed to a decoder are reported as payloads
+MIN_PAYLOAD_LENGTH = 64
+
+# Files are analyzed in this process below this many, since starting
+# worker processes costs more than it saves
+MIN_POOL_FILES = 32
+
+# Functions decoding or decompressing data, as imported module.function
+DECODE_FUNCTIONS = {
+    "base64.b64decode",
+    "base64.b32decode",
+    "base64.b16decode",
+    "base64.b85decode",
+    "base64.a85decode",
+    "base64.decodebytes",
+    "base64.decodestring",
+    "base64.urlsafe_b64decode",
+    "binascii.a2b_base64",
+    "binascii.unhexlify",
+    "bytes.fromhex",
+    "codecs.decode",
+    "zlib.decompress",
+    "gzip.decompress",
+    "bz2.decompress",
+    "lzma.decompress",
+    "marshal.loads",
+}
+# Built-ins that run code given as a string or code object
+EXEC_FUNCTIONS = {"exec", "eval", "compile", "execfile"}
+# Calls that open network connections
+NETWORK_FUNCTIONS = {
+    "socket.socket",
+    "socket.create_connection",
+    "urllib.request.urlopen",
+    "urllib.request.urlretrieve",
+    "urllib.urlopen",
+    "urllib.urlretrieve",
+    "urllib2.urlopen",
+    "requests.get",
+    "requests.post",
+    "requests.put",
+    "requests.request",
+    "http.client.HTTPConnection",
+    "http.client.HTTPSConnection",
+    "httplib.HTTPConnection",
+    "httplib.HTTPSConnection",
+    "ftplib.FTP",
+    "smtplib.SMTP",
+}
+# Calls that start other processes, besides everything in subprocess
+PROCESS_FUNCTIONS = {
+    "os.system",
+    "os.popen",
+    "os.spawnl",
+    "os.spawnv",
+    "os.execl",
+    "os.execv",
+    "os.execvp",
+    "os.startfile",
+    "pty.spawn",
+    "commands.getoutput",
+}
+
+# Nodes adding one path through a function, as counted by mccabe
+BRANCH_TYPES = {ast.If, ast.For, ast.AsyncFor, ast.While, ast.ExceptHandler}
+if hasattr(ast, "match_case"):
+    BRANCH_TYPES.add(ast.match_case)
+
+# Fields of each node type holding child nodes, filled in as types are met
+CHILD_FIELDS = {}
+
+# Registered detector classes, in the order they run on a node
+DETECTORS = []
+
+# Nodes holding a string or bytes literal. Before Python 3.8, ast.parse
+# emits Str and Bytes instead of Constant.
+if sys.version_info < (3, 8):
+    LITERAL_TYPES = (ast.Constant, ast.Str, ast.Bytes)
+else:
+    LITERAL_TYPES = (ast.Constant,)
+
+
+def register(detector_class):
+    """Decorate a Detector subclass to run it on every file"""
+    DETECTORS.append(detector_class)
+    return detector_class
+
+
+def shannon_entropy(text):
+    """Bits of entropy per character of a string"""
+    counts = Counter(text)
+    return -sum(
+        count / len(text) * math.log2(count / len(text)) for count in counts.values()
+    )
+
+
+def literal_value(node):
+    """The str or bytes value of a literal node, or None for other nodes"""
+    if not isinstance(node, LITERAL_TYPES):
+        return None
+    value = node.value if isinstance(node, ast.Constant) else node.s
+    return value if isinstance(value, (str, bytes)) else None
+
+
+def is_network_call(name):
+    """Check whether a resolved call name opens a network connection"""
+    return name in NETWORK_FUNCTIONS
+
+
+def is_process_call(name):
+    """Check whether a resolved call name starts a process"""
+    return name in PROCESS_FUNCTIONS or name.startswith("subprocess.")
+
+
+def is_main_guard(node):
+    """Check for if __name__ == "__main__":, which doesn't run on import"""
+    test = getattr(node, "test", None)
+    return (
+        isinstance(node, ast.If)
+        and isinstance(test, ast.Compare)
+        and isinstance(test.left, ast.Name)
+        and test.left.id == "__name__"
+        and len(test.comparators) == 1
+        and literal_value(test.comparators[0]) == "__main__"
+    )
+
+
+class Detector:
+    """A check run on nodes of some types as the walker reaches them
+
+    name identifies the findings it reports. check() is called with each
+    node of one of node_types, in source order.
+    """
+
+    name = "detector"
+    node_types = ()
+
+    def check(self, node, walker):
+        """Report findings about one node through walker.report()"""
+        raise NotImplementedError
+
+
+@register
+class ExecDecoded(Detector):
+    """exec() or eval() of code that is decoded or decompressed first"""
+
+    name = "exec_decoded"
+    node_types = (ast.Call,)
+
+    def check(self, node, walker):
+        if walker.call_name(node) not in EXEC_FUNCTIONS or not node.args:
+            return
+        for child in ast.walk(node.args[0]):
+            if isinstance(child, ast.Call) and walker.is_decode_call(child):
+                walker.report(
+                    self,
+                    node,
+                    "HIGH",
+                    walker.call_name(node) + "() of decoded data",
+                )
+                return
+
+
+@register
+class EncodedPayload(Detector):
+    """Long literals fed to base64, zlib or similar, and marshal.loads()"""
+
+    name = "encoded_payload"
+    node_types = (ast.Call,)
+
+    def check(self, node, walker):
+        name = walker.call_name(node)
+        if name == "marshal.loads":
+            walker.report(self, node, "HIGH", "marshal.loads() of code")
+        elif walker.is_decode_call(node) and node.args:
+            value = literal_value(node.args[0])
+            if value is not None and len(value) >= MIN_PAYLOAD_LENGTH:
+                walker.report(
+                    self,
+                    node,
+                    "MEDIUM",
+                    "{}() of a {}-character literal".format(name, len(value)),
+                )
+
+
+@register
+class HighEntropyString(Detector):
+    """Long string literals that look random, such as packed payloads"""
+
+    name = "high_entropy_string"
+    node_types = LITERAL_TYPES
+
+    def check(self, node, walker):
+        value = literal_value(node)
+        if isinstance(value, bytes):
+            value = value.decode("latin-1")
+        if not isinstance(value, str) or len(value) < MIN_ENTROPY_LENGTH:
+            return
+        # Encoded payloads are ASCII without white space
+        if not value.isascii() or any(char.isspace() for char in value):
+            return
+        if node in walker.docstrings:
+            return
+        entropy = shannon_entropy(value)
+        if entropy >= ENTROPY_THRESHOLD:
+            walker.report(
+                self,
+                node,
+                "LOW",
+                "{}-character literal with {:.1f} bits of entropy per "
+                "character".format(len(value), entropy),
+            )
+
+
+@register
+class SetupPyRisk(Detector):
+    """Network connections or processes started from setup.py"""
+
+    name = "setup_py_risk"
+    node_types = (ast.Call,)
+
+    def check(self, node, walker):
+        if not walker.is_setup_py:
+            return
+        name = walker.call_name(node)
+        if is_network_call(name):
+            walker.report(self, node, "HIGH", "setup.py calls " + name + "()")
+        elif is_process_call(name):
+            walker.report(self, node, "MEDIUM", "setup.py calls " + name + "()")
+
+
+@register
+class ImportTimeSideEffect(Detector):
+    """Network, process or exec calls that run when a module is imported"""
+
+    name = "import_time_side_effect"
+    node_types = (ast.Call,)
+
+    def check(self, node, walker):
+        # setup.py always runs top to bottom, so SetupPyRisk covers it
+        if walker.is_setup_py or not walker.runs_on_import():
+            return
+        name = walker.call_name(node)
+        if is_network_call(name) or is_process_call(name) or name in EXEC_FUNCTIONS:
+            walker.report(
+                self, node, "MEDIUM", name + "() runs when the module is imported"
+            )
+
+
+class SourceWalker:
+    """Walk one file's AST once, running detectors and counting complexity"""
+
+    def __init__(self, path, detectors):
+        self.path = path
+        self.is_setup_py = os.path.basename(path) == "setup.py"
+        self.detectors_by_type = {}
+        for detector in detectors:
+            for node_type in detector.node_types:
+                self.detectors_by_type.setdefault(node_type, []).append(detector)
+        self.findings = []
+        self.functions = []
+        # Local name -> module or module.attribute it was imported as
+        self.aliases = {}
+        self.docstrings = set()
+        # Names of the enclosing classes and functions, and the running
+        # complexity of each enclosing function
+        self.scope = []
+        self.complexities = []
+        self.function_depth = 0
+        self.main_guard_depth = 0
+        self.last_call = None
+        self.last_call_name = ""
+
+    def report(self, detector, node, severity, message):
+        """Record a finding of a detector at a node"""
+        self.findings.append(
+            {
+                "detector": detector.name,
+                "severity": severity,
+                "file": self.path,
+                "line": getattr(node, "lineno", 0),
+                "message": message,
+            }
+        )
+
+    def runs_on_import(self):
+        """Check whether the node being visited runs at import time"""
+        return self.function_depth == 0 and self.main_guard_depth == 0
+
+    def resolve(self, name):
+        """Replace an imported alias at the start of a dotted name"""
+        head, _, rest = name.partition(".")
+        head = self.aliases.get(head, head)
+        return head + "." + rest if rest else head
+
+    def call_name(self, node):
+        """Dotted name a call resolves to, e.g. base64.b64decode, or "" """
+        # Several detectors ask about the same call in a row
+        if node is self.last_call:
+            return self.last_call_name
+        self.last_call = node
+        self.last_call_name = self.find_call_name(node)
+        return self.last_call_name
+
+    def find_call_name(self, node):
+        """Resolve the dotted name of a call's function"""
+        parts = []
+        func = node.func
+        while isinstance(func, ast.Attribute):
+            parts.append(func.attr)
+            func = func.value
+        if not isinstance(func, ast.Name):
+            return ""
+        parts.append(func.id)
+        return self.resolve(".".join(reversed(parts)))
+
+    def is_decode_call(self, node):
+        """Check whether a call decodes or decompresses its argument"""
+        name = self.call_name(node)
+        if name in DECODE_FUNCTIONS:
+            return True
+        # "...".decode("rot13") and similar on any expression
+        return isinstance(node.func, ast.Attribute) and node.func.attr in (
+            "decode",
+            "decompress",
+            "fromhex",
+        )
+
+    def walk(self, tree):
+        """Run every detector over a parsed module"""
+        self.visit(tree)
+
+    def visit(self, node):
+        """Visit a node and its children in source order"""
+        node_type = type(node)
+        for detector in self.detectors_by_type.get(node_type, ()):
+            detector.check(node, self)
+        if node_type in BRANCH_TYPES and self.complexities:
+            self.complexities[-1] += 1
+        if node_type in (ast.Import, ast.ImportFrom):
+            self.add_aliases(node)
+        elif node_type in (ast.FunctionDef, ast.AsyncFunctionDef):
+            self.mark_docstring(node)
+            self.visit_function(node)
+            return
+        elif node_type is ast.ClassDef:
+            self.mark_docstring(node)
+            self.scope.append(node.name)
+            self.visit_children(node)
+            self.scope.pop()
+            return
+        elif node_type is ast.Module:
+            self.mark_docstring(node)
+        elif node_type is ast.If and is_main_guard(node):
+            self.visit(node.test)
+            self.main_guard_depth += 1
+            for child in node.body:
+                self.visit(child)
+            self.main_guard_depth -= 1
+            for child in node.orelse:
+                self.visit(child)
+            return
+        self.visit_children(node)
+
+    def visit_children(self, node):
+        """Visit every child of a node, except Load and Store markers"""
+        node_type = type(node)
+        fields = CHILD_FIELDS.get(node_type)
+        if fields is None:
+            fields = CHILD_FIELDS[node_type] = tuple(
+                field for field in node_type._fields if field != "ctx"
+            )
+        for field in fields:
+            value = getattr(node, field, None)
+            if isinstance(value, list):
+                for item in value:
+                    if isinstance(item, ast.AST):
+                        self.visit(item)
+            elif isinstance(value, ast.AST):
+                self.visit(value)
+
+    def visit_function(self, node):
+        """Visit a function body, counting its complexity separately"""
+        # Decorators and defaults run where the function is defined
+        for child in node.decorator_list + [node.args]:
+            self.visit(child)
+        if node.returns is not None:
+            self.visit(node.returns)
+        self.scope.append(node.name)
+        self.complexities.append(1)
+        self.function_depth += 1
+        for child in node.body:
+            self.visit(child)
+        self.function_depth -= 1
+        self.functions.append(
+            {
+                "file": self.path,
+                "function": ".".join(self.scope),
+                "line": node.lineno,
+                "complexity": self.complexities.pop(),
+            }
+        )
+        self.scope.pop()
+
+    def add_aliases(self, node):
+        """Remember what names an import statement binds"""
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                if alias.asname:
+                    self.aliases[alias.asname] = alias.name
+        elif node.module and not node.level:
+            for alias in node.names:
+                self.aliases[alias.asname or alias.name] = (
+                    node.module + "." + alias.name
+                )
+
+    def mark_docstring(self, node):
+        """Remember the docstring node of a module, class or function"""
+        if node.body and isinstance(node.body[0], ast.Expr):
+            value = node.body[0].value
+            if isinstance(literal_value(value), str):
+                self.docstrings.add(value)
+
+
+def analyze_source(path, data, detectors=None):
+    """Parse and check one file, returning (findings, functions, error)"""
+    if detectors is None:
+        detectors = [detector_class() for detector_class in DETECTORS]
+    walker = SourceWalker(path, detectors)
+    try:
+        walker.walk(ast.parse(data, filename=path))
+    # Python 2 sources, or trees too deeply nested to walk
+    except (SyntaxError, ValueError, RecursionError) as error:
+        return [], [], type(error).__name__ + ": " + str(error)
+    return walker.findings, walker.functions, None
+
+
+def analyze_chunk(files, detector_classes=None):
+    """Check a list of (path, bytes) files in one worker
+
+    Detector classes are passed to workers by reference, so ones
+    registered from other modules run there too.
+    """
+    detectors = [detector_class() for detector_class in detector_classes or DETECTORS]
+    return [analyze_source(path, data, detectors) for path, data in files]
+
+
+def analyze_sources(sources, processes=None):
+    """Check every source file, spread across worker processes
+
+    sources maps archive paths to bytes, as read by
+    static.fetch_and_read_artifact(). Returns a list of
+    (findings, functions, error) per file.
+    """
+    files = sorted(sources.items())
+    processes = processes or os.cpu_count() or 1
+    # Daemonic workers, such as those static.analysis_pool() uses on
+    # older Pythons, may not start processes of their own
+    if (
+        processes == 1
+        or len(files) < MIN_POOL_FILES
+        or multiprocessing.current_process().daemon
+    ):
+        return analyze_chunk(files)
+    chunk_size = max(1, len(files) // (processes * 4))
+    chunks = [files[i : i + chunk_size] for i in range(0, len(files), chunk_size)]
+    # Spawn rather than fork, because scans run from worker threads
+    context = multiprocessing.get_context("spawn")
+    results = []
+    with ProcessPoolExecutor(
+        max_workers=min(processes, len(chunks)), mp_context=context
+    ) as executor:
+        for chunk_results in executor.map(
+            analyze_chunk, chunks, [list(DETECTORS)] * len(chunks)
+        ):
+            results.extend(chunk_results)
+    return results
+
+
+def generate_ast_dict(sources, processes=None):
+    """Run every detector on a package's sources and summarize the results
+
+    Counts use bandit's severities. findings lists each finding, high
+    severity first, and mccabe summarizes function complexity, listing
+    the functions at or above MCCABE_THRESHOLD.
+    """
+    findings = []
+    functions = []
+    unparsed = 0
+    for file_findings, file_functions, error in analyze_sources(sources, processes):
+        findings.extend(file_findings)
+        functions.extend(file_functions)
+        if error is not None:
+            unparsed += 1
+    severity_order = {"HIGH": 0, "MEDIUM": 1, "LOW": 2}
+    findings.sort(key=lambda f: (severity_order[f["severity"]], f["file"], f["line"]))
+    severities = Counter(finding["severity"] for finding in findings)
+    complexities = [function["complexity"] for function in functions]
+    return {
+        "files": len(sources),
+        "files_unparsed": unparsed,
+        "count_all": len(findings),
+        "count_low": severities["LOW"],
+        "count_medium": severities["MEDIUM"],
+        "count_high": severities["HIGH"],
+        "by_detector": dict(Counter(finding["detector"] for finding in findings)),
+        "findings": findings,
+        "mccabe": {
+            "functions": len(functions),
+            "average": (
+                round(sum(complexities) / len(complexities), 2)
+                if complexities
+                else None
+            ),
+            "max": max(complexities, default=None),
+            "complex_functions": sorted(
+                (
+                    function
+                    for function in functions
+                    if function["complexity"] >= MCCABE_THRESHOLD
+                ),
+                key=lambda function: -function["complexity"],
+            ),
+        },
+    }
+
+
+if __name__ == "__main__":
+    # Check files or directories given on the command line
+    paths = {}
+    for argument in sys.argv[1:]:
+        if os.path.isdir(argument):
+            for root, _, filenames in os.walk(argument):
+                for filename in filenames:
+                    if filename.endswith(".py"):
+                        paths[os.path.join(root, filename)] = None
+        else:
+            paths[argument] = None
+    for source_path in paths:
+        with open(source_path, "rb") as source_file:
+            paths[source_path] = source_file.read()
+    results = generate_ast_dict(paths)
+    for result_finding in results["findings"]:
+        print(
+            "{file}:{line}: {severity} {detector}: {message}".format(**result_finding)
+        )
+    print(
+        "{} functions, average complexity {}, max {}".format(
+            results["mccabe"]["functions"],
+            results["mccabe"]["average"],
+            results["mccabe"]["max"],
+        )
+    )
@@ -0,0 +1,362 @@
+"""Where pkgscan fetches PyPI, pypistats and github documents from
+
+Modules ask the current backend for a document, e.g. a package's PyPI
+JSON, rather than building URLs themselves. The default backend fetches
+from the live sites. A mirror backend fetches the PyPI documents from
+another base URL, and a snapshot backend reads documents saved under a
+local directory, so scans can run with no network at all. A snapshot
+server backend reads them from a local HTTP server of such a directory.
+
+A snapshot directory holds one file per URL at <host>/<path>/#<name>,
+<name> being the path's last segment, e.g.
+snapshot/pypi.org/pypi/requests/json/#json. RecordingBackend writes one
+while scanning with another backend.
+"""
+
+from contextlib import contextmanager
+import io
+import json
+import mmap
+import os
+import shutil
+from urllib.parse import urlsplit
+
+from artifact import safe_member_path
+from http_cache import atomic_write
+import http_client
+import profiling
+
+# Bytes written at a time when streaming a download to a file
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+class Backend:
+    """Base URLs of each site, and the documents pkgscan reads from them
+
+    Every method returns a response with status_code, ok, content and
+    json(), like a requests.Response, except that download() and
+    save_github_archive() save a document to a file, and
+    open_document() and pypi_json_stream() give a file to read it from.
+    Subclasses implement fetch().
+    """
+
+    def __init__(
+        self,
+        pypi_url="https://pypi.org",
+        pypistats_url="https://pypistats.org",
+        github_api_url="https://api.github.com",
+    ):
+        self.pypi_url = pypi_url.rstrip("/")
+        self.pypistats_url = pypistats_url.rstrip("/")
+        self.github_api_url = github_api_url.rstrip("/")
+
+    def fetch(self, url):
+        """Return the response for one URL"""
+        raise NotImplementedError
+
+    def download(self, url, path):
+        """Save the document at a URL to a file, returning whether it exists"""
+        response = self.fetch(url)
+        if not response.ok:
+            return False
+        with open(path, "wb") as f:
+            f.write(response.content)
+        return True
+
+    @contextmanager
+    def open_document(self, url):
+        """Context manager giving the (status code, binary file) of a URL
+
+        For documents large enough to parse as they are read. This one
+        reads the whole document first; other backends stream it.
+        """
+        response = self.fetch(url)
+        yield response.status_code, io.BytesIO(response.content)
+
+    def pypi_json_url(self, pkg_name, version=None):
+        """URL of a package's metadata in the PyPI JSON API
+
+        With a version, only that release's metadata and files are
+        fetched, not every release ever published.
+        """
+        if version is not None:
+            pkg_name += "/" + version
+        return self.pypi_url + "/pypi/" + pkg_name + "/json"
+
+    def pypi_json(self, pkg_name, version=None):
+        """A package's metadata from the PyPI JSON API"""
+        return self.fetch(self.pypi_json_url(pkg_name, version))
+
+    def pypi_json_stream(self, pkg_name, version=None):
+        """pypi_json() as open_document() gives it"""
+        return self.open_document(self.pypi_json_url(pkg_name, version))
+
+    def simple_index(self, pkg_name):
+        """A package's files and upload times from the simple JSON API"""
+        return self.fetch(
+            self.pypi_url
+            + "/simple/"
+            + pkg_name
+            + "/?format=application/vnd.pypi.simple.v1+json"
+        )
+
+    def project_page(self, pkg_name):
+        """A package's PyPI project page"""
+        return self.fetch(self.pypi_url + "/project/" + pkg_name)
+
+    def user_page(self, username):
+        """A maintainer's PyPI profile page"""
+        return self.fetch(self.pypi_url + "/user/" + username)
+
+    def download_stats(self, pkg_name):
+        """Recent download counts from pypistats"""
+        return self.fetch(self.pypistats_url + "/api/packages/" + pkg_name + "/recent")
+
+    def github_repo(self, repo):
+        """A github repository's data from the API, repo being owner/name"""
+        return self.fetch(self.github_api_url + "/repos/" + repo)
+
+    def github_url(self, url):
+        """URL to fetch a github.com document from"""
+        return url
+
+    def github_page(self, github_page):
+        """A github repository's web page"""
+        return self.fetch(self.github_url(github_page))
+
+    def save_github_archive(self, repo_url, tag, path):
+        """Save the tarball of a github repo's source at a tag to a file
+
+        Returns False if the repo has no such tag.
+        """
+        return self.download(
+            self.github_url(repo_url + "/archive/refs/tags/" + tag + ".tar.gz"), path
+        )
+
+    def artifact_url(self, url):
+        """URL pip should download a release file from"""
+        return url
+
+
+class LiveBackend(Backend):
+    """Fetch from the public sites through the shared HTTP client"""
+
+    def fetch(self, url):
+        return http_client.get(url)
+
+    def open_document(self, url):
+        return http_client.open_stream(url)
+
+    def download(self, url, path):
+        # Streamed past the response cache, for files too large to hold
+        response = http_client.send(url, stream=True)
+        with response:
+            if not response.ok:
+                return False
+            with open(path, "wb") as f:
+                for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+        return True
+
+
+class MirrorBackend(LiveBackend):
+    """Fetch PyPI documents from a mirror and the rest from the public sites
+
+    The mirror must serve the same /pypi/<name>/json, /simple/<name>/,
+    /project/<name> and /user/<name> paths as pypi.org.
+    """
+
+    def __init__(self, pypi_url):
+        super().__init__(pypi_url=pypi_url)
+
+
+class SnapshotServerBackend(LiveBackend):
+    """Fetch every document over HTTP from a server of a snapshot directory
+
+    The server, e.g. snapshot_server.py, answers /<host>/<path> with the
+    document saved for https://<host>/<path>, so scans run against
+    recorded documents with real connections, latency and errors.
+    """
+
+    def __init__(self, server_url):
+        self.server_url = server_url.rstrip("/")
+        super().__init__(
+            self.server_url + "/pypi.org",
+            self.server_url + "/pypistats.org",
+            self.server_url + "/api.github.com",
+        )
+
+    def server_path(self, url):
+        """URL on the server of the document saved for a URL"""
+        parts = urlsplit(url)
+        return self.server_url + "/" + (parts.hostname or "") + parts.path
+
+    def github_url(self, url):
+        return self.server_path(url)
+
+    def artifact_url(self, url):
+        return self.server_path(url)
+
+
+class SnapshotResponse:
+    """A document read from a snapshot directory
+
+    content is a read-only memory map of the file rather than a copy of
+    it in memory. It is empty, with a 404 status, if the file is missing.
+    """
+
+    def __init__(self, url, path):
+        self.url = url
+        self.headers = {}
+        self.content = b""
+        self.status_code = 404
+        if path is not None and os.path.isfile(path):
+            self.status_code = 200
+            with open(path, "rb") as f:
+                # Empty files can't be mapped
+                if os.fstat(f.fileno()).st_size:
+                    self.content = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @property
+    def ok(self):
+        """Whether the document was found"""
+        return self.status_code == 200
+
+    @property
+    def text(self):
+        """The document decoded as UTF-8"""
+        return str(self.content, "utf-8", errors="replace")
+
+    def json(self):
+        """The document parsed as JSON"""
+        return json.loads(self.text)
+
+
+def snapshot_path(directory, url):
+    """File in a snapshot directory holding a URL, or None if unsafe
+
+    Each document is saved in a directory named after its URL path, as
+    "#" and the path's last segment, so https://pypi.org/simple/requests
+    is <directory>/pypi.org/simple/requests/#requests. A URL path never
+    holds a "#", so one URL's document can't be another's directory, and
+    release files keep their extension.
+    """
+    parts = urlsplit(url)
+    path = parts.path.strip("/")
+    if path:
+        path = safe_member_path(path + "/#" + path.rsplit("/", 1)[-1])
+    else:
+        path = "#"
+    if not parts.hostname or path is None:
+        return None
+    return os.path.join(directory, parts.hostname, path)
+
+
+def save_document(directory, url, content):
+    """Save a URL's document to a snapshot directory, returning its path"""
+    path = snapshot_path(directory, url)
+    if path is None:
+        raise ValueError("unsafe snapshot URL: " + url)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    atomic_write(path, content, "wb")
+    return path
+
+
+class SnapshotBackend(Backend):
+    """Read documents from a snapshot directory, never the network"""
+
+    def __init__(self, directory):
+        super().__init__()
+        self.directory = directory
+
+    def download(self, url, path):
+        source = snapshot_path(self.directory, url)
+        if source is None or not os.path.isfile(source):
+            return False
+        shutil.copyfile(source, path)
+        return True
+
+    @contextmanager
+    def open_document(self, url):
+        path = snapshot_path(self.directory, url)
+        with profiling.span("snapshot read", "http", url=url) as details:
+            if path is None or not os.path.isfile(path):
+                details["status"] = 404
+                yield 404, io.BytesIO()
+                return
+            details["status"] = 200
+            details["bytes"] = os.path.getsize(path)
+            with open(path, "rb") as f:
+                yield 200, f
+
+    def fetch(self, url):
+        with profiling.span("snapshot read", "http", url=url) as details:
+            response = SnapshotResponse(url, snapshot_path(self.directory, url))
+            details["status"] = response.status_code
+            details["bytes"] = len(response.content)
+        return response
+
+    def artifact_url(self, url):
+        # Release files saved in the snapshot are installed from disk
+        path = snapshot_path(self.directory, url)
+        if path is not None and os.path.isfile(path):
+            return "file://" + os.path.abspath(path)
+        return url
+
+
+class RecordingBackend(Backend):
+    """Fetch through another backend and save each document to a snapshot"""
+
+    def __init__(self, backend, directory):
+        super().__init__(
+            backend.pypi_url, backend.pypistats_url, backend.github_api_url
+        )
+        self.backend = backend
+        self.directory = directory
+
+    def fetch(self, url):
+        response = self.backend.fetch(url)
+        if response.status_code == 200 and snapshot_path(self.directory, url):
+            save_document(self.directory, url, response.content)
+        return response
+
+    def download(self, url, path):
+        if not self.backend.download(url, path):
+            return False
+        saved_path = snapshot_path(self.directory, url)
+        if saved_path is not None:
+            os.makedirs(os.path.dirname(saved_path), exist_ok=True)
+            shutil.copyfile(path, saved_path)
+        return True
+
+    def artifact_url(self, url):
+        return self.backend.artifact_url(url)
+
+
+def backend_from_environment():
+    """Backend chosen by the PKGSCAN_SNAPSHOT, PKGSCAN_SNAPSHOT_SERVER or
+    PKGSCAN_PYPI_MIRROR environment variables, if one is set
+    """
+    if os.environ.get("PKGSCAN_SNAPSHOT"):
+        return SnapshotBackend(os.environ["PKGSCAN_SNAPSHOT"])
+    if os.environ.get("PKGSCAN_SNAPSHOT_SERVER"):
+        return SnapshotServerBackend(os.environ["PKGSCAN_SNAPSHOT_SERVER"])
+    if os.environ.get("PKGSCAN_PYPI_MIRROR"):
+        return MirrorBackend(os.environ["PKGSCAN_PYPI_MIRROR"])
+    return LiveBackend()
+
+
+_backend = backend_from_environment()
+
+
+def get_backend():
+    """The backend documents are currently fetched from"""
+    return _backend
+
+
+def set_backend(backend):
+    """Fetch documents from another backend from now on"""
+    global _backend  # pylint: disable=global-statement
+    _backend = backend
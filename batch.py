@@ -0,0 +1,255 @@
+"""Scan many packages at once from a requirements file or list of names"""
+
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import ExitStack
+import itertools
+import os
+import sys
+
+from packaging.requirements import InvalidRequirement, Requirement
+from packaging.utils import canonicalize_name
+
+import http_cache
+import http_client
+from main import STATIC_ANALYSIS_FIELDS, Package, fields_for_verbosity
+from pipeline import shared_calls
+from pypi_pkg import split_version_pin
+from result_store import scan_and_store
+
+# Default number of packages scanned at the same time
+DEFAULT_JOBS = 8
+
+
+def parse_package_names(lines):
+    """Extract unique package names from requirements.txt-style lines
+
+    Plain lists of names are a subset of this format, so the same parser
+    handles both. Comments, blank lines, pip options and continuation
+    lines such as hashes are skipped. Exact pins are kept as
+    "name==version" so that release is scanned; other specifiers are
+    dropped.
+    """
+    seen = set()
+    pkg_names = []
+    for line in lines:
+        # Drop comments and surrounding white space
+        line = line.split("#", 1)[0].strip()
+        # Drop a trailing line continuation from pip-compile output
+        line = line.rstrip("\\").strip()
+        # Skip blank lines and options like -r, -e, --hash or --index-url
+        if not line or line.startswith("-"):
+            continue
+        try:
+            requirement = Requirement(line)
+        except InvalidRequirement:
+            # Fall back to the first token for lines pip would reject
+            pkg_name, pkg_version = line.split()[0], None
+        else:
+            # Markers are dropped, and only an exact pin is kept
+            requirement.marker = None
+            pkg_name, pkg_version = split_version_pin(str(requirement))
+        # Treat names that differ only in case or separators as one package
+        key = (canonicalize_name(pkg_name), pkg_version)
+        if key not in seen:
+            seen.add(key)
+            if pkg_version is not None:
+                pkg_name += "==" + pkg_version
+            pkg_names.append(pkg_name)
+    return pkg_names
+
+
+def read_package_names(path):
+    """Read package names from a file, or from stdin if path is '-'"""
+    if path == "-":
+        return parse_package_names(sys.stdin)
+    with open(path, "r") as f:
+        return parse_package_names(f)
+
+
+def scan_package(
+    pkg_name, verbosity, fields=None, keep_raw=False, static_analyzer=None
+):
+    """Scan one package, which may be pinned as name==version
+
+    static_analyzer, if given, replaces static.analyze_package(). Returns
+    (package, error).
+    """
+    if fields is None:
+        fields = fields_for_verbosity(verbosity)
+    try:
+        pkg_name, pkg_version = split_version_pin(pkg_name)
+        package = Package(pkg_name, verbosity, keep_raw=keep_raw, version=pkg_version)
+        package.static_analyzer = static_analyzer
+        # Packages are lazy, so do the work here in the worker thread
+        package.load(fields)
+        return package, None
+    # get_pypi_data() exits on unknown packages, which must not end the
+    # whole batch, so SystemExit is reported like any other failure
+    except (Exception, SystemExit) as error:  # pylint: disable=broad-except
+        return None, error
+
+
+def scan_packages(
+    pkg_names, verbosity, max_workers=DEFAULT_JOBS, fields=None, keep_raw=False
+):
+    """Scan packages in parallel and yield (name, package, error) as each ends
+
+    At most max_workers scans are queued at any time, so lists of
+    thousands of names are consumed lazily. Fetches shared by several
+    packages, such as a common maintainer or github repo, run only once.
+    Static analysis of the packages runs in a pool of worker processes.
+    """
+    if fields is None:
+        fields = fields_for_verbosity(verbosity)
+    pkg_names = iter(pkg_names)
+    with ExitStack() as stack:
+        static_analyzer = None
+        if any(field in STATIC_ANALYSIS_FIELDS for field in fields):
+            # Imported here so batches without -v don't load the tooling
+            from static import analysis_pool  # pylint: disable=import-outside-toplevel
+
+            # Static analysis is CPU-bound, so it runs in worker processes
+            static_analyzer = stack.enter_context(
+                analysis_pool(min(max_workers, os.cpu_count() or 1))
+            )
+        stack.enter_context(shared_calls())
+        executor = stack.enter_context(ThreadPoolExecutor(max_workers=max_workers))
+        running = {}
+        for pkg_name in itertools.islice(pkg_names, max_workers):
+            future = executor.submit(
+                scan_package, pkg_name, verbosity, fields, keep_raw, static_analyzer
+            )
+            running[future] = pkg_name
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                pkg_name = running.pop(future)
+                package, error = future.result()
+                yield pkg_name, package, error
+                # Refill the window with the next package, if any
+                for next_name in itertools.islice(pkg_names, 1):
+                    future = executor.submit(
+                        scan_package,
+                        next_name,
+                        verbosity,
+                        fields,
+                        keep_raw,
+                        static_analyzer,
+                    )
+                    running[future] = next_name
+
+
+def print_batch(
+    pkg_names,
+    verbosity,
+    max_workers=DEFAULT_JOBS,
+    fields=None,
+    keep_raw=False,
+    risk_model=None,
+    features_path=None,
+):
+    """Print results for each package as soon as its scan finishes
+
+    With a risk_score.RiskModel, every package is scored at the end and
+    listed riskiest first. features_path saves their feature matrix.
+    """
+    if fields is None:
+        fields = fields_for_verbosity(verbosity)
+    scan_fields = risk_scan_fields(fields, risk_model)
+    risk_results = []
+    results = scan_packages(pkg_names, verbosity, max_workers, scan_fields, keep_raw)
+    for pkg_name, package, error in results:
+        print("Package: " + pkg_name)
+        if error is not None:
+            print("ERROR: Scan failed: " + repr(error))
+        else:
+            package.print(verbosity, fields)
+            if risk_model is not None:
+                risk_results.append((pkg_name, package.field_values(scan_fields)))
+        print()
+    if risk_model is not None:
+        print_risk_scores(risk_results, risk_model, features_path)
+    print_request_stats()
+
+
+def print_stored_batch(
+    store,
+    pkg_names,
+    verbosity,
+    max_workers=DEFAULT_JOBS,
+    fields=None,
+    rescan=False,
+    max_age=None,
+    keep_raw=False,
+    risk_model=None,
+    features_path=None,
+):
+    """Scan packages into a result_store.ResultStore and print each result
+
+    With rescan, only packages changed upstream since their last snapshot
+    are scanned again, see result_store.scan_and_store(). The packages
+    scanned are scored like print_batch() does.
+    """
+    if fields is None:
+        fields = fields_for_verbosity(verbosity)
+    scan_fields = risk_scan_fields(fields, risk_model)
+    reasons = Counter()
+    risk_results = []
+    results = scan_and_store(
+        store, pkg_names, verbosity, max_workers, scan_fields, rescan, max_age, keep_raw
+    )
+    for pkg_name, package, error, reason in results:
+        reasons[reason] += 1
+        if package is None and error is None:
+            continue
+        print("Package: " + pkg_name + " (" + reason + ")")
+        if error is not None:
+            print("ERROR: Scan failed: " + repr(error))
+        else:
+            package.print(verbosity, fields)
+            if risk_model is not None:
+                risk_results.append((pkg_name, package.field_values(scan_fields)))
+        print()
+    if risk_model is not None:
+        print_risk_scores(risk_results, risk_model, features_path)
+    print(
+        "Stored in {}: ".format(store.path)
+        + " ".join(
+            "{}={}".format(reason, count) for reason, count in sorted(reasons.items())
+        )
+    )
+    print_request_stats()
+
+
+def risk_scan_fields(fields, risk_model):
+    """Fields to scan to print fields and, with a risk model, score risk"""
+    if risk_model is None:
+        return fields
+    # Imported here so batches without --risk don't load NumPy
+    from risk_score import RISK_FIELDS  # pylint: disable=import-outside-toplevel
+
+    return fields + [field for field in RISK_FIELDS if field not in fields]
+
+
+def print_request_stats():
+    """Print the requests sent to each host and the HTTP cache statistics"""
+    # Show the load put on each host, e.g. to stay under the github limit
+    print("Requests per host: ", end="")
+    for host, count in sorted(http_client.request_counts.items()):
+        print(host + "=" + str(count), end=" ")
+    print()
+    print(http_cache.format_stats())
+
+
+def print_risk_scores(risk_results, risk_model, features_path=None):
+    """Score (package name, field values) pairs together and print them"""
+    # pylint: disable=import-outside-toplevel
+    from risk_score import feature_matrix, format_scores, save_matrix
+
+    matrix = feature_matrix(risk_results)
+    if features_path:
+        save_matrix(features_path, matrix)
+    print("Risk scores, riskiest first:")
+    print(format_scores(matrix, risk_model))
+    print()
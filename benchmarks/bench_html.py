@@ -0,0 +1,145 @@
+"""Benchmark parse time and memory of the HTML pages pkgscan scrapes
+
+Compares building a full BeautifulSoup tree and searching it, as
+pkgscan used to, with the targeted parsers in html_extract. Saved pages
+can be passed in, e.g. a PyPI project page, profile and github repo:
+
+    $ curl -so project.html https://pypi.org/project/requests/
+    $ python benchmarks/bench_html.py --project project.html --runs 20
+
+Pages not given are replaced by synthetic ones of a similar shape.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from html_extract import (  # pylint: disable=wrong-import-position
+    extract_github_page,
+    extract_maintainers,
+    extract_profile,
+)
+
+
+def synthetic_page(body, filler_blocks=3000):
+    """Wrap body in a large page of unrelated markup"""
+    filler = '<div class="filler"><p>Release notes <a href="#">link</a></p></div>'
+    return "<html><body>" + filler * filler_blocks + body + "</body></html>"
+
+
+SYNTHETIC_PAGES = {
+    "project": synthetic_page(
+        '<span class="sidebar-section__user-gravatar-text">alice</span>' * 5
+    ),
+    "profile": synthetic_page(
+        '<div class="author-profile__metadiv"><time>Jan 3, 2014</time></div>'
+        '<div class="left-layout__main"><h2>12 projects</h2></div>'
+    ),
+    # The star count sits near the top of a repository page
+    "github": '<a class="social-count js-social-count">1,234</a>'
+    + synthetic_page(""),
+}
+
+
+def soup_maintainers(content):
+    """Maintainer usernames the way pypi_pkg used to read them"""
+    from bs4 import BeautifulSoup  # pylint: disable=import-outside-toplevel
+
+    soup = BeautifulSoup(content, "html.parser")
+    elements = soup.findAll("span", {"class": "sidebar-section__user-gravatar-text"})
+    return [elem.string.strip() for elem in elements]
+
+
+def soup_profile(content):
+    """Profile page the way pypi_profiles used to keep it, as a whole tree"""
+    from bs4 import BeautifulSoup  # pylint: disable=import-outside-toplevel
+
+    return BeautifulSoup(content, "html.parser")
+
+
+def soup_github(content):
+    """Star count the way github_data used to read it"""
+    from bs4 import BeautifulSoup  # pylint: disable=import-outside-toplevel
+
+    soup = BeautifulSoup(content, "html.parser")
+    return soup.find("a", {"class": "social-count js-social-count"})
+
+
+PARSERS = {
+    "project": {"bs4": soup_maintainers, "targeted": extract_maintainers},
+    "profile": {"bs4": soup_profile, "targeted": extract_profile},
+    "github": {"bs4": soup_github, "targeted": extract_github_page},
+}
+
+
+def measure(parse, content, runs):
+    """Return median seconds, peak and retained bytes of parsing content
+
+    The result is kept alive while measuring memory, since pkgscan keeps
+    what it parses for the rest of a scan.
+    """
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        parse(content)
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    result = parse(content)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return statistics.median(timings), peak, retained
+
+
+def main():
+    """Parse each page with each parser and print time and memory"""
+    parser = argparse.ArgumentParser()
+    for page in PARSERS:
+        parser.add_argument("--" + page, help="Saved " + page + " page to parse.")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--json", action="store_true", help="Print JSON results.")
+    args = parser.parse_args()
+
+    results = {}
+    for page, parsers in PARSERS.items():
+        path = getattr(args, page)
+        if path:
+            with open(path, "rb") as f:
+                content = f.read()
+        else:
+            content = SYNTHETIC_PAGES[page].encode("utf-8")
+        for name, parse in parsers.items():
+            try:
+                median, peak, retained = measure(parse, content, args.runs)
+            except ImportError:
+                # bs4 is no longer a dependency and may not be installed
+                continue
+            results[page + "/" + name] = {
+                "page_bytes": len(content),
+                "median_s": median,
+                "peak_bytes": peak,
+                "retained_bytes": retained,
+            }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for name, result in results.items():
+        print(
+            "{:<18} {:>8.2f} ms  peak {:>8.1f} KB  kept {:>8.1f} KB".format(
+                name,
+                result["median_s"] * 1000,
+                result["peak_bytes"] / 1024,
+                result["retained_bytes"] / 1024,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
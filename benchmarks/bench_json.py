@@ -0,0 +1,120 @@
+"""Benchmark the full and incremental parse of PyPI JSON documents
+
+Each saved document is turned into a PypiRecord twice, once from the
+whole parsed document as response.json() gives it and once from the
+summary kept by pypi_stream, timing both and tracing peak memory.
+
+    $ for pkg in botocore awscli boto3; do
+    >     curl -so $pkg.json https://pypi.org/pypi/$pkg/json
+    > done
+    $ python benchmarks/bench_json.py botocore.json awscli.json boto3.json
+
+Without files, a synthetic document with 3000 releases is used.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from pypi_pkg import PypiRecord
+from pypi_stream import summarize_pypi_json
+
+
+def synthetic_document(releases=3000, files_per_release=8):
+    """A PyPI JSON document the size of botocore's"""
+    release_files = {}
+    for number in range(releases):
+        release = "1.{}.{}".format(number // 100, number % 100)
+        release_files[release] = [
+            {
+                "filename": "example-{}-{}.whl".format(release, index),
+                "url": "https://files.example/example-{}-{}.whl".format(release, index),
+                "packagetype": "bdist_wheel",
+                "upload_time": "2020-01-01T00:00:00",
+                "upload_time_iso_8601": "2020-01-01T00:00:00.000000Z",
+                "digests": {"md5": "0" * 32, "sha256": "1" * 64},
+                "size": 100000,
+                "has_sig": False,
+                "yanked": False,
+                "yanked_reason": None,
+                "requires_python": ">=3.6",
+            }
+            for index in range(files_per_release)
+        ]
+    document = {
+        "info": {"author": "A. Author", "version": release, "project_urls": {}},
+        "releases": release_files,
+        "urls": release_files[release],
+    }
+    return json.dumps(document).encode("utf-8")
+
+
+def full_parse(data):
+    """Parse everything, as get_pypi_data did before summaries"""
+    return PypiRecord(json.loads(data.decode("utf-8")))
+
+
+def summary_parse(data):
+    """Parse incrementally, keeping only what PypiRecord reads"""
+    return PypiRecord(summarize_pypi_json(data))
+
+
+def measure(parse, data, runs):
+    """Return median seconds and peak traced bytes of parsing data"""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        parse(data)
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    parse(data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(timings), peak
+
+
+def main():
+    """Measure both parses of every document"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("documents", nargs="*", help="Saved PyPI JSON documents.")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--json", action="store_true", help="Print JSON results.")
+    args = parser.parse_args()
+
+    documents = {}
+    for path in args.documents:
+        with open(path, "rb") as f:
+            documents[os.path.basename(path)] = f.read()
+    if not documents:
+        documents["synthetic"] = synthetic_document()
+
+    results = {}
+    for name, data in documents.items():
+        for mode, parse in (("full", full_parse), ("summary", summary_parse)):
+            median, peak = measure(parse, data, args.runs)
+            results[name + "/" + mode] = {
+                "document_bytes": len(data),
+                "median_s": median,
+                "peak_bytes": peak,
+            }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for name, result in results.items():
+        print(
+            "{:<22} {:>7.1f} ms  peak {:>6.1f} MB".format(
+                name, result["median_s"] * 1000, result["peak_bytes"] / 1e6
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
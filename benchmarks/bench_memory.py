@@ -0,0 +1,177 @@
+"""Benchmark memory held by a batch scan that keeps every Package
+
+Scans a list of packages with the default fields, keeping each Package
+alive as a caller collecting results would, and reports the peak and
+retained Python memory (tracemalloc) with compact records and with
+--keep-raw. Each mode runs in a fresh interpreter.
+
+    $ python benchmarks/bench_memory.py --packages 1000
+    $ python benchmarks/bench_memory.py -r requirements.txt
+
+Without -r, no network is used: responses are generated locally in the
+shape of PyPI, pypistats and github responses, with many releases per
+package so the JSON documents are of realistic size.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+from urllib.parse import urlsplit
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+# pylint: disable=wrong-import-position
+import requests
+
+from batch import read_package_names, scan_packages
+import http_cache
+import http_client
+from main import DEFAULT_FIELDS
+
+# Size of each synthetic package's history
+RELEASES = 300
+FILES_PER_RELEASE = 4
+DESCRIPTION_BYTES = 20000
+
+
+def synthetic_pypi_json(name):
+    """A PyPI JSON document with many releases"""
+    releases = {}
+    for number in range(RELEASES):
+        release = "{}.{}.{}".format(number // 100, number // 10 % 10, number % 10)
+        releases[release] = [
+            {
+                "filename": "{}-{}-{}.whl".format(name, release, index),
+                "url": "https://files.example/{}/{}/{}".format(name, release, index),
+                "packagetype": "bdist_wheel",
+                "upload_time": "2020-01-{:02d}T00:00:00".format(number % 28 + 1),
+                "digests": {"md5": "0" * 32, "sha256": "1" * 64},
+                "size": 100000,
+                "has_sig": False,
+                "yanked": False,
+            }
+            for index in range(FILES_PER_RELEASE)
+        ]
+    return {
+        "info": {
+            "author": "Author " + name,
+            "author_email": name + "@example.com",
+            "home_page": "https://github.com/example/" + name,
+            "project_urls": {"Source": "https://github.com/example/" + name},
+            "description": "x" * DESCRIPTION_BYTES,
+        },
+        "releases": releases,
+        "urls": releases[release],
+    }
+
+
+def synthetic_body(url):
+    """Body of a synthetic response for one of the URLs pkgscan fetches"""
+    parts = urlsplit(url)
+    path = parts.path.strip("/").split("/")
+    if parts.hostname == "pypistats.org":
+        return json.dumps({"data": {"last_month": 1000}}).encode()
+    if parts.hostname == "api.github.com":
+        return json.dumps({"stargazers_count": 10, "readme": "x" * 5000}).encode()
+    if path[0] == "pypi":
+        return json.dumps(synthetic_pypi_json(path[1])).encode()
+    filler = "<div><p>Release history <a href='#'>link</a></p></div>" * 500
+    if path[0] == "user":
+        return (
+            filler + '<div class="author-profile__metadiv"><time>Jan 3, 2014</time>'
+            '</div><div class="left-layout__main"><h2>3 projects</h2></div>'
+        ).encode()
+    # A project page listing two maintainers shared by every package
+    return (
+        filler + '<span class="sidebar-section__user-gravatar-text">alice</span>'
+        '<span class="sidebar-section__user-gravatar-text">bob</span>'
+    ).encode()
+
+
+def synthetic_send(url, timeout=None, **kwargs):  # pylint: disable=unused-argument
+    """Answer a request with a synthetic response instead of the network"""
+    response = requests.Response()
+    response.status_code = 200
+    response.url = url
+    response._content = synthetic_body(url)  # pylint: disable=protected-access
+    return response
+
+
+def run_mode(pkg_names, keep_raw, jobs):
+    """Scan every package, keep them all, and return memory figures"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    packages = []
+    errors = 0
+    for _, package, error in scan_packages(
+        pkg_names, 0, jobs, DEFAULT_FIELDS, keep_raw
+    ):
+        if error is not None:
+            errors += 1
+        packages.append(package)
+    seconds = time.perf_counter() - start
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "packages": len(packages),
+        "errors": errors,
+        "seconds": seconds,
+        "peak_bytes": peak,
+        "retained_bytes": retained,
+    }
+
+
+def main():
+    """Run both modes in fresh interpreters and print their memory use"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-r", "--requirement", help="Scan these packages live.")
+    parser.add_argument("--packages", type=int, default=1000)
+    parser.add_argument("-j", "--jobs", type=int, default=8)
+    parser.add_argument("--mode", choices=["compact", "keep_raw"])
+    parser.add_argument("--json", action="store_true", help="Print JSON results.")
+    args = parser.parse_args()
+
+    if args.mode:
+        http_cache.enabled = False
+        if args.requirement:
+            pkg_names = read_package_names(args.requirement)
+        else:
+            http_client.send = synthetic_send
+            pkg_names = ["pkg{}".format(number) for number in range(args.packages)]
+        result = run_mode(pkg_names, args.mode == "keep_raw", args.jobs)
+        print(json.dumps(result))
+        return
+
+    results = {}
+    for mode in ("compact", "keep_raw"):
+        command = [sys.executable, os.path.abspath(__file__), "--mode", mode]
+        command += ["--packages", str(args.packages), "--jobs", str(args.jobs)]
+        if args.requirement:
+            command += ["--requirement", args.requirement]
+        output = subprocess.run(
+            command, cwd=REPO_DIR, check=True, stdout=subprocess.PIPE
+        ).stdout
+        results[mode] = json.loads(output.decode().splitlines()[-1])
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for mode, result in results.items():
+        print(
+            "{:<9} {} packages in {:.1f}s  peak {:.1f} MB  retained {:.1f} MB".format(
+                mode,
+                result["packages"],
+                result["seconds"],
+                result["peak_bytes"] / 1e6,
+                result["retained_bytes"] / 1e6,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
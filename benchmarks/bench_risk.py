@@ -0,0 +1,102 @@
+"""Benchmark building feature matrices and scoring them with risk_score
+
+Synthetic field values for many packages, with a share of them missing
+or errors, are turned into a feature matrix once. The matrix is then
+scored again and again with randomly reweighted models, as rescoring
+stored results with new weights does.
+
+    $ python benchmarks/bench_risk.py --packages 100000
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from risk_score import DEFAULT_MODEL, RiskModel, feature_matrix
+
+
+def synthetic_results(packages, seed=0):
+    """(name, field values) pairs like scans of packages find"""
+    generator = random.Random(seed)
+    dates = ["Feb 12, 2017", "Jun 3, 2019", "Dec 1, 2020", "Mar 9, 2021"]
+    results = []
+    for number in range(packages):
+        values = {
+            "number_releases_past_year": generator.randint(0, 20),
+            "pypi_pkg_signed": generator.random() < 0.1,
+            "maintainers_list": ["m"] * generator.randint(1, 4),
+            "similar_names": ["requests"] if generator.random() < 0.01 else [],
+            "maintainers_account_creation_date": generator.sample(dates, 2),
+            "number_of_packages_maintained_by_maintainers": [
+                str(generator.randint(1, 50))
+            ],
+            "github_stars": generator.choice(
+                [generator.randint(0, 50000), "1.2k", "No github found", "Error"]
+            ),
+            "downloads": {"last_month": generator.randint(0, 10**7)},
+            "bandit": {"count_high": generator.randint(0, 3), "count_medium": "Error"},
+        }
+        results.append(("package-{}".format(number), values))
+    return results
+
+
+def reweighted_model(generator):
+    """DEFAULT_MODEL with every weight and point scaled at random"""
+    model = json.loads(json.dumps(DEFAULT_MODEL))
+    for term in model["weights"].values():
+        term["weight"] *= generator.uniform(0.5, 2)
+    for rule in model["rules"]:
+        rule["points"] *= generator.uniform(0.5, 2)
+    return RiskModel(model)
+
+
+def main():
+    """Time building one matrix and rescoring it"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--packages", type=int, default=100000)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--json", action="store_true", help="Print JSON results.")
+    args = parser.parse_args()
+
+    results = synthetic_results(args.packages)
+    start = time.perf_counter()
+    matrix = feature_matrix(results)
+    build_s = time.perf_counter() - start
+
+    generator = random.Random(1)
+    timings = []
+    for _ in range(args.runs):
+        model = reweighted_model(generator)
+        start = time.perf_counter()
+        model.score(matrix)
+        timings.append(time.perf_counter() - start)
+
+    summary = {
+        "packages": args.packages,
+        "build_s": build_s,
+        "rescore_median_s": statistics.median(timings),
+        "rescore_max_s": max(timings),
+    }
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+    print(
+        "{} packages: matrix built in {:.2f} s, rescored in {:.1f} ms "
+        "(max {:.1f} ms)".format(
+            args.packages,
+            build_s,
+            summary["rescore_median_s"] * 1000,
+            summary["rescore_max_s"] * 1000,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
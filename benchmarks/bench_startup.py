@@ -0,0 +1,76 @@
+"""Benchmark cold-start time of the pkgscan CLI
+
+Each case starts a fresh interpreter that imports what a non-verbose
+scan imports. "eager" adds the modules main.py used to import at load
+time (static analysis, bs4 and pandas) to show what deferring saves.
+
+    $ python benchmarks/bench_startup.py --runs 20
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CASES = {
+    "deferred": "import main",
+    "eager": "import main, static, bs4, pandas",
+}
+
+
+def time_import(code, runs):
+    """Return wall-clock seconds of each cold interpreter run"""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=REPO_DIR,
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    """Run every case and print medians"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--json", action="store_true", help="Print JSON results.")
+    args = parser.parse_args()
+
+    results = {}
+    for name, code in CASES.items():
+        try:
+            timings = time_import(code, args.runs)
+        except subprocess.CalledProcessError:
+            # pandas may no longer be installed at all
+            continue
+        results[name] = {
+            "median_s": statistics.median(timings),
+            "min_s": min(timings),
+            "runs": args.runs,
+        }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for name, result in results.items():
+        print(
+            "{:<10} median {:.3f}s  min {:.3f}s".format(
+                name, result["median_s"], result["min_s"]
+            )
+        )
+    if "eager" in results:
+        saved = results["eager"]["median_s"] - results["deferred"]["median_s"]
+        print("Cold start saved by deferred imports: {:.3f}s".format(saved))
+
+
+if __name__ == "__main__":
+    main()
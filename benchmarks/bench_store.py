@@ -0,0 +1,97 @@
+"""Benchmark looking up package history in a large result_store database
+
+A temporary store is filled with snapshots of many synthetic packages,
+with maintainers changing now and then between snapshots. Looking up
+the history and maintainer changes of random packages is then timed.
+
+    $ python benchmarks/bench_store.py --packages 50000 --snapshots 3
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from result_store import ResultStore
+
+
+def fill_store(store, packages, snapshots, seed=0):
+    """Record snapshots of synthetic packages, a day apart"""
+    generator = random.Random(seed)
+    start = time.time() - snapshots * 86400
+    maintainers = {
+        number: ["maintainer{}".format(generator.randint(0, packages // 3))]
+        for number in range(packages)
+    }
+    for snapshot in range(snapshots):
+        for number in range(packages):
+            if generator.random() < 0.05:
+                maintainers[number] = maintainers[number][1:] + [
+                    "maintainer{}".format(generator.randint(0, packages // 3))
+                ]
+            store.record(
+                "package-{}".format(number),
+                {
+                    "maintainers_list": maintainers[number],
+                    "github_stars": generator.randint(0, 50000),
+                },
+                state="serial:{}".format(snapshot),
+                scanned_at=start + snapshot * 86400,
+            )
+
+
+def main():
+    """Time filling a store and looking up random packages in it"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--packages", type=int, default=50000)
+    parser.add_argument("--snapshots", type=int, default=3)
+    parser.add_argument("--lookups", type=int, default=1000)
+    parser.add_argument("--json", action="store_true", help="Print JSON results.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        with ResultStore(os.path.join(directory, "results.db")) as store:
+            start = time.perf_counter()
+            fill_store(store, args.packages, args.snapshots)
+            fill_s = time.perf_counter() - start
+
+            generator = random.Random(1)
+            timings = []
+            for _ in range(args.lookups):
+                pkg_name = "package-{}".format(generator.randrange(args.packages))
+                start = time.perf_counter()
+                store.history(pkg_name)
+                store.maintainer_changes(pkg_name)
+                timings.append(time.perf_counter() - start)
+
+    summary = {
+        "packages": args.packages,
+        "snapshots": args.snapshots,
+        "fill_s": fill_s,
+        "lookup_median_ms": statistics.median(timings) * 1000,
+        "lookup_max_ms": max(timings) * 1000,
+    }
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+    print(
+        "{} packages x {} snapshots: stored in {:.1f} s, history looked up in "
+        "{:.3f} ms (max {:.3f} ms)".format(
+            args.packages,
+            args.snapshots,
+            fill_s,
+            summary["lookup_median_ms"],
+            summary["lookup_max_ms"],
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
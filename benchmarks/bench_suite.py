@@ -0,0 +1,427 @@
+"""Offline benchmark suite, scanning fixtures served by a local server
+
+Serves a snapshot directory of recorded documents, see
+record_fixtures.py, with snapshot_server.py and measures:
+
+- the latency of each collection stage in single scans
+- the throughput of a batch scan of every package
+- peak memory of a single scan, a batch scan and a -v scan
+
+Each measurement runs in a fresh interpreter so caches and memory don't
+carry over. Results are written as JSON, and --compare reports metrics
+that got worse than a saved run by more than a threshold, exiting 1 if
+any did, so regressions can be tracked between commits.
+
+    $ python benchmarks/record_fixtures.py fixtures --artifacts
+    $ python benchmarks/bench_suite.py fixtures --latency 0.02 -o base.json
+    $ python benchmarks/bench_suite.py fixtures --latency 0.02 --compare base.json
+
+Without a fixture directory, synthetic fixtures are generated, with one
+package with a history the size of botocore's.
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+# pylint: disable=wrong-import-position
+import analysis_cache
+import backends
+from batch import scan_packages
+import http_cache
+import http_client
+from main import DEFAULT_FIELDS, Package, fields_for_verbosity
+import profiling
+from snapshot_server import SnapshotServer
+
+# Measurements, each run in its own interpreter
+MEASUREMENTS = ["stages", "batch", "memory_single", "memory_batch", "memory_verbose"]
+
+# Releases of the large synthetic package, and of the others
+LARGE_RELEASES = 3000
+RELEASES = 100
+FILES_PER_RELEASE = 8
+
+
+def write_document(directory, path, data):
+    """Save the document at https://<path> to a snapshot directory"""
+    backends.save_document(directory, "https://" + path, data)
+
+
+def synthetic_wheel(name):
+    """A small wheel with one module, in bytes"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as wheel:
+        wheel.writestr(
+            name + "/__init__.py",
+            "import subprocess\n\n\ndef run(command):\n"
+            '    """Run a command"""\n'
+            "    return subprocess.call(command, shell=True)\n",
+        )
+        dist_info = name + "-1.0.dist-info/"
+        wheel.writestr(
+            dist_info + "METADATA",
+            "Metadata-Version: 2.1\nName: {}\nVersion: 1.0\n".format(name),
+        )
+        wheel.writestr(
+            dist_info + "WHEEL",
+            "Wheel-Version: 1.0\nRoot-Is-Purelib: true\nTag: py3-none-any\n",
+        )
+        wheel.writestr(dist_info + "RECORD", "")
+    return buffer.getvalue()
+
+
+def write_synthetic_fixtures(directory, count):
+    """Write the documents scans of count synthetic packages read"""
+    names = ["bench-pkg{}".format(number) for number in range(count)]
+    for number, name in enumerate(names):
+        wheel = synthetic_wheel(name.replace("-", "_"))
+        wheel_url = "https://files.pythonhosted.org/packages/{}-1.0-py3-none-any.whl"
+        wheel_url = wheel_url.format(name.replace("-", "_"))
+        write_document(directory, wheel_url.split("://", 1)[1], wheel)
+        releases = {}
+        for release_number in range(LARGE_RELEASES if number == 0 else RELEASES):
+            release = "0.{}.{}".format(release_number // 100, release_number % 100)
+            releases[release] = [
+                {
+                    "filename": "{}-{}-{}.tar.gz".format(name, release, index),
+                    "url": "https://files.example/{}/{}".format(release, index),
+                    "packagetype": "sdist",
+                    "upload_time": "2020-01-{:02d}T00:00:00".format(
+                        release_number % 28 + 1
+                    ),
+                    "digests": {"md5": "0" * 32, "sha256": "1" * 64},
+                    "size": 100000,
+                    "has_sig": False,
+                    "yanked": False,
+                }
+                for index in range(FILES_PER_RELEASE)
+            ]
+        releases["1.0"] = [
+            {
+                "filename": wheel_url.rsplit("/", 1)[1],
+                "url": wheel_url,
+                "packagetype": "bdist_wheel",
+                "upload_time": "2021-01-01T00:00:00",
+                "digests": {"sha256": hashlib.sha256(wheel).hexdigest()},
+                "has_sig": False,
+                "yanked": False,
+            }
+        ]
+        pypi_data = {
+            "info": {
+                "author": "Author " + name,
+                "author_email": name + "@example.com",
+                "home_page": "https://github.com/example/" + name,
+                "project_urls": {},
+                "version": "1.0",
+                "description": "x" * 20000,
+            },
+            "releases": releases,
+            "urls": releases["1.0"],
+        }
+        write_document(
+            directory, "pypi.org/pypi/" + name + "/json", json.dumps(pypi_data)
+        )
+        # Two maintainers shared by every package, and one of its own
+        maintainers = ["alice", "bob", "maintainer{}".format(number)]
+        write_document(
+            directory,
+            "pypi.org/project/" + name,
+            "".join(
+                '<span class="sidebar-section__user-gravatar-text">'
+                + maintainer
+                + "</span>"
+                for maintainer in maintainers
+            ),
+        )
+        for maintainer in maintainers:
+            write_document(
+                directory,
+                "pypi.org/user/" + maintainer,
+                '<div class="author-profile__metadiv"><time>Jan 3, 2014</time></div>'
+                '<div class="left-layout__main"><h2>3 projects</h2></div>',
+            )
+        write_document(
+            directory,
+            "pypistats.org/api/packages/" + name + "/recent",
+            json.dumps({"data": {"last_month": 1000}}),
+        )
+        write_document(
+            directory,
+            "api.github.com/repos/example/" + name,
+            json.dumps({"stargazers_count": 10}),
+        )
+    return names
+
+
+def fixture_packages(directory):
+    """Names of the packages with PyPI JSON in a fixture directory"""
+    pypi_dir = os.path.join(directory, "pypi.org", "pypi")
+    return sorted(
+        name
+        for name in os.listdir(pypi_dir)
+        if os.path.isfile(os.path.join(pypi_dir, name, "json"))
+    )
+
+
+def summarize(timings):
+    """Median, 90th percentile and maximum of some durations"""
+    timings = sorted(timings)
+    return {
+        "median_s": statistics.median(timings),
+        "p90_s": timings[int(0.9 * (len(timings) - 1))],
+        "max_s": timings[-1],
+        "count": len(timings),
+    }
+
+
+def measure_stages(pkg_names):
+    """Per-stage latency of sequential scans, and whole concurrent scans"""
+    profiling.enabled = True
+    for pkg_name in pkg_names:
+        Package(pkg_name, concurrent=False).load(DEFAULT_FIELDS)
+    profiling.enabled = False
+    results = {
+        name: {
+            "median_s": stats["p50"],
+            "p90_s": stats["p90"],
+            "max_s": stats["max"],
+            "count": stats["count"],
+        }
+        for (_, name), stats in profiling.summarize("stage").items()
+    }
+    scan_timings = []
+    for pkg_name in pkg_names:
+        start = time.perf_counter()
+        Package(pkg_name).load(DEFAULT_FIELDS)
+        scan_timings.append(time.perf_counter() - start)
+    results["scan"] = summarize(scan_timings)
+    return results
+
+
+def measure_batch(pkg_names, jobs):
+    """Throughput of scanning every package as one batch"""
+    start = time.perf_counter()
+    errors = sum(
+        error is not None
+        for _, _, error in scan_packages(pkg_names, 0, jobs, DEFAULT_FIELDS)
+    )
+    seconds = time.perf_counter() - start
+    return {
+        "packages": len(pkg_names),
+        "errors": errors,
+        "seconds_s": seconds,
+        "packages_per_s": len(pkg_names) / seconds,
+    }
+
+
+def measure_memory(scan):
+    """Peak traced and resident memory of running scan()"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    scan()
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # ru_maxrss is in kilobytes on Linux
+    return {
+        "seconds_s": seconds,
+        "peak_traced_bytes": peak,
+        "max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "children_max_rss_bytes": (
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+        ),
+    }
+
+
+def run_measurement(measurement, server_url, pkg_names, jobs):
+    """Run one measurement in this interpreter against the server"""
+    backends.set_backend(backends.SnapshotServerBackend(server_url))
+    # Every request goes to the server, never a cache, and the server
+    # isn't throttled like the sites it stands in for
+    http_cache.enabled = False
+    analysis_cache.enabled = False
+    http_client.HOST_LIMITS["127.0.0.1"] = (64, 1e9, 1e9)
+
+    if measurement == "stages":
+        return measure_stages(pkg_names)
+    if measurement == "batch":
+        return measure_batch(pkg_names, jobs)
+    if measurement == "memory_single":
+        return measure_memory(lambda: Package(pkg_names[0]).load(DEFAULT_FIELDS))
+    if measurement == "memory_batch":
+        return measure_memory(lambda: list(scan_packages(pkg_names, 0, jobs)))
+    return measure_memory(
+        lambda: Package(pkg_names[0], 1).load(fields_for_verbosity(1))
+    )
+
+
+def git_commit():
+    """Commit the working tree is at, or None outside a git checkout"""
+    try:
+        return (
+            subprocess.run(
+                ["git", "rev-parse", "HEAD"],
+                cwd=REPO_DIR,
+                check=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+            )
+            .stdout.decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(results, prefix=""):
+    """Map "a.b.c" paths to every number in nested results"""
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix + key + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(results, baseline, threshold):
+    """Print metrics worse than baseline by more than threshold
+
+    Durations and sizes are worse when higher, rates when lower.
+    Returns the number of regressions.
+    """
+    current = flatten(results["results"])
+    previous = flatten(baseline["results"])
+    regressions = 0
+    for key in sorted(current.keys() & previous.keys()):
+        if not previous[key]:
+            continue
+        change = current[key] / previous[key] - 1
+        if key.endswith("_per_s"):
+            change = -change
+        elif not key.endswith(("_s", "_bytes")):
+            continue
+        if change > threshold:
+            regressions += 1
+            print(
+                "REGRESSION {}: {:.4g} -> {:.4g} ({:+.0%})".format(
+                    key, previous[key], current[key], change
+                )
+            )
+    return regressions
+
+
+def main():
+    """Serve the fixtures, run every measurement and report the results"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("fixtures", nargs="?", help="Snapshot directory to serve.")
+    parser.add_argument(
+        "--packages", type=int, default=20, help="Synthetic packages to generate."
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Seconds to delay each response."
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=0.0, help="Up to this many more seconds."
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="Share of requests to fail."
+    )
+    parser.add_argument("-j", "--jobs", type=int, default=8)
+    parser.add_argument(
+        "--only", help="Comma-separated measurements: " + ", ".join(MEASUREMENTS)
+    )
+    parser.add_argument("-o", "--output", help="Write the JSON results here.")
+    parser.add_argument("--compare", help="Earlier JSON results to compare with.")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    parser.add_argument("--measure", choices=MEASUREMENTS, help=argparse.SUPPRESS)
+    parser.add_argument("--server", help=argparse.SUPPRESS)
+    parser.add_argument("--names", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        result = run_measurement(
+            args.measure, args.server, args.names.split(","), args.jobs
+        )
+        print(json.dumps(result))
+        return
+
+    with tempfile.TemporaryDirectory() as synthetic_dir:
+        fixtures = args.fixtures
+        if fixtures is None:
+            fixtures = synthetic_dir
+            write_synthetic_fixtures(fixtures, args.packages)
+        pkg_names = fixture_packages(fixtures)
+        measurements = args.only.split(",") if args.only else MEASUREMENTS
+        results = {}
+        with SnapshotServer(
+            fixtures,
+            latency=args.latency,
+            jitter=args.jitter,
+            error_rate=args.error_rate,
+        ) as server:
+            for measurement in measurements:
+                server.counts.clear()
+                command = [
+                    sys.executable,
+                    os.path.abspath(__file__),
+                    "--measure",
+                    measurement,
+                    "--server",
+                    server.url,
+                    "--names",
+                    ",".join(pkg_names),
+                    "--jobs",
+                    str(args.jobs),
+                ]
+                output = subprocess.run(
+                    command, cwd=REPO_DIR, check=True, stdout=subprocess.PIPE
+                ).stdout
+                results[measurement] = json.loads(output.decode().splitlines()[-1])
+                results[measurement]["server"] = dict(server.counts)
+                print(measurement + " done", file=sys.stderr)
+
+    report = {
+        "commit": git_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "settings": {
+            "fixtures": args.fixtures or "synthetic",
+            "packages": pkg_names,
+            "latency": args.latency,
+            "jitter": args.jitter,
+            "error_rate": args.error_rate,
+            "jobs": args.jobs,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Benchmark building and querying the typosquat index
+
+Builds an index over a snapshot of names and times lookups of typo'd
+versions of those names. A list of every project on PyPI makes a good
+large snapshot:
+
+    $ curl -s https://pypi.org/simple/ > simple.html
+    $ python benchmarks/bench_typosquat.py simple.html
+
+Without a snapshot, random names are generated.
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import statistics
+import string
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from typosquat import (  # pylint: disable=wrong-import-position
+    TyposquatIndex,
+    build_index,
+    read_snapshot,
+)
+
+
+def read_names(path):
+    """Names from a PyPI simple index listing or a typosquat snapshot"""
+    with open(path, "rb") as f:
+        data = f.read()
+    if data.lstrip().startswith(b"<"):
+        return re.findall(r">([^<]+)</a>", data.decode("utf-8"))
+    if b'"projects"' in data[:1000]:
+        return [project["name"] for project in json.loads(data)["projects"]]
+    return read_snapshot(path)
+
+
+def random_names(count, rng):
+    """Random package-like names"""
+    letters = string.ascii_lowercase + "-"
+    return [
+        "".join(rng.choice(letters) for _ in range(rng.randint(4, 16)))
+        for _ in range(count)
+    ]
+
+
+def typo(name, rng):
+    """Swap two neighbouring characters of a name"""
+    if len(name) < 2:
+        return name + "x"
+    position = rng.randrange(len(name) - 1)
+    return name[:position] + name[position + 1] + name[position] + name[position + 2 :]
+
+
+def main():
+    """Build an index, run queries and print timings"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("snapshot", nargs="?", help="Names to index.")
+    parser.add_argument("--names", type=int, default=300000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--json", action="store_true", help="Print JSON results.")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    if args.snapshot:
+        names = read_names(args.snapshot)
+    else:
+        names = random_names(args.names, rng)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "typosquat.idx")
+        start = time.perf_counter()
+        build_index(names, path)
+        build_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        index = TyposquatIndex(path)
+        open_seconds = time.perf_counter() - start
+
+        queries = [typo(rng.choice(names), rng) for _ in range(args.queries)]
+        timings = []
+        for query in queries:
+            start = time.perf_counter()
+            index.similar_names(query)
+            timings.append(time.perf_counter() - start)
+        index.close()
+
+        timings.sort()
+        results = {
+            "names": len(names),
+            "index_bytes": os.path.getsize(path),
+            "build_s": build_seconds,
+            "open_s": open_seconds,
+            "query_median_s": statistics.median(timings),
+            "query_p99_s": timings[int(len(timings) * 0.99)],
+        }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print("Names indexed: {}".format(results["names"]))
+    print("Index size: {:.1f} MB".format(results["index_bytes"] / 1e6))
+    print("Build: {:.1f}s, open: {:.3f} ms".format(build_seconds, open_seconds * 1e3))
+    print(
+        "Query median {:.1f} us, p99 {:.1f} us".format(
+            results["query_median_s"] * 1e6, results["query_p99_s"] * 1e6
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Record the documents that scans of some packages read, as fixtures
+
+Scans each package live with every default field and saves what was
+fetched to a snapshot directory, which backends.SnapshotBackend and
+snapshot_server.py can then serve with no network. With --artifacts the
+release file static analysis would download is saved too.
+
+    $ python benchmarks/record_fixtures.py fixtures
+    $ python benchmarks/record_fixtures.py fixtures -r requirements.txt --artifacts
+    $ python benchmarks/bench_suite.py fixtures
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+import backends
+from batch import read_package_names, scan_packages
+from main import DEFAULT_FIELDS
+from static import select_artifact
+
+# The packages test_pkgscan.py scans, from small to botocore-sized
+DEFAULT_PACKAGES = [
+    "awscli",
+    "botocore",
+    "django",
+    "faucet",
+    "good",
+    "matplotlib",
+    "networkml",
+    "numpy",
+    "pandas",
+    "pcap2map",
+    "portunus",
+    "pytest",
+    "requests",
+    "ryu",
+    "scapy",
+    "six",
+    "urllib3",
+]
+
+
+def record(directory, pkg_names, artifacts=False, jobs=8):
+    """Scan packages through a RecordingBackend saving to directory"""
+    backend = backends.RecordingBackend(backends.get_backend(), directory)
+    backends.set_backend(backend)
+    failed = []
+    for pkg_name, package, error in scan_packages(pkg_names, 0, jobs, DEFAULT_FIELDS):
+        if error is not None:
+            failed.append(pkg_name)
+            print("ERROR: " + pkg_name + ": " + repr(error), file=sys.stderr)
+            continue
+        if artifacts:
+            pypi_record = package.pypi_pkg["pypi_record"]
+            artifact_file = select_artifact({"urls": pypi_record.urls})
+            if artifact_file is not None:
+                backend.fetch(artifact_file["url"])
+    return failed
+
+
+def main():
+    """Record fixtures for the chosen packages"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("directory", help="Snapshot directory to write.")
+    parser.add_argument("-r", "--requirement", help="Record these packages.")
+    parser.add_argument(
+        "--artifacts",
+        action="store_true",
+        help="Also save the release file each -v scan would analyze.",
+    )
+    parser.add_argument("-j", "--jobs", type=int, default=8)
+    args = parser.parse_args()
+
+    pkg_names = DEFAULT_PACKAGES
+    if args.requirement:
+        pkg_names = read_package_names(args.requirement)
+    failed = record(args.directory, pkg_names, args.artifacts, args.jobs)
+    print(
+        "Recorded {} packages to {}".format(
+            len(pkg_names) - len(failed), args.directory
+        ),
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,364 @@
+"""Scan a package and everything it depends on, directly or not
+
+Dependencies are read from the requires_dist metadata of the scanned
+release, their environment markers are evaluated for a target
+environment, and each requirement is resolved to the highest release
+that satisfies it. The graph is expanded breadth-first with a limited
+number of scans running at the same time. Every (name, version) node
+is scanned once, however many packages in the tree require it.
+
+Resolution is per requirement, not a full resolver like pip's: two
+packages asking for different ranges of one dependency may lead to two
+nodes for it, each scanned once.
+
+    $ python main.py --deps jupyter
+"""
+
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import threading
+
+from packaging import version
+from packaging.markers import default_environment
+from packaging.requirements import InvalidRequirement, Requirement
+from packaging.utils import canonicalize_name
+
+from main import Package, fields_for_verbosity
+from pipeline import shared, shared_calls
+from pypi_pkg import get_pypi_data, get_release_history
+
+# Default number of packages scanned at the same time
+DEFAULT_JOBS = 8
+
+# Fields every node loads, whatever is printed, for the aggregate counts
+REPORT_FIELDS = ["pypi_pkg_signed", "maintainers_list", "similar_names"]
+
+# platform_system and os_name for common values of sys_platform
+PLATFORMS = {
+    "linux": ("Linux", "posix"),
+    "darwin": ("Darwin", "posix"),
+    "win32": ("Windows", "nt"),
+}
+
+
+def target_environment(python_version=None, sys_platform=None):
+    """Marker environment of this interpreter, or of another target
+
+    python_version is like "3.8" or "3.8.10", and sys_platform one of
+    the values of sys.platform, such as "linux", "darwin" or "win32".
+    """
+    environment = default_environment()
+    if python_version:
+        parts = python_version.split(".")
+        environment["python_version"] = ".".join(parts[:2])
+        environment["python_full_version"] = ".".join((parts + ["0"])[:3])
+    if sys_platform:
+        environment["sys_platform"] = sys_platform
+        if sys_platform in PLATFORMS:
+            platform_system, os_name = PLATFORMS[sys_platform]
+            environment["platform_system"] = platform_system
+            environment["os_name"] = os_name
+    return environment
+
+
+def applicable_requirements(requires_dist, environment, extras=()):
+    """Parse requires_dist, keeping what applies with the given extras
+
+    Requirements PyPI lists but pip couldn't parse are skipped.
+    """
+    requirements = []
+    for requirement_string in requires_dist:
+        try:
+            requirement = Requirement(requirement_string)
+        except InvalidRequirement:
+            continue
+        if requirement.marker is not None and not any(
+            requirement.marker.evaluate(dict(environment, extra=extra))
+            for extra in ("",) + tuple(extras)
+        ):
+            continue
+        requirements.append(requirement)
+    return requirements
+
+
+@shared
+def get_releases(pkg_name):
+    """A package's releases from the simple index, or the full JSON"""
+    releases = get_release_history(pkg_name)
+    if releases is None:
+        releases = get_pypi_data(pkg_name, summary=True)["releases"]
+    return releases
+
+
+def resolve_version(releases, specifier):
+    """Highest release satisfying a specifier, or None
+
+    Like pip, releases without files are skipped, yanked releases are
+    only used when nothing else matches and pre-releases only when the
+    specifier asks for one or no final release matches.
+    """
+    candidates = {}
+    for pkg_version, files in releases.items():
+        if not files:
+            continue
+        try:
+            candidates[version.Version(pkg_version)] = all(
+                f.get("yanked") for f in files
+            )
+        except version.InvalidVersion:
+            continue
+    for allow_yanked in (False, True):
+        matches = list(
+            specifier.filter(
+                pkg_version
+                for pkg_version, yanked in candidates.items()
+                if allow_yanked or not yanked
+            )
+        )
+        if matches:
+            return str(max(matches))
+    return None
+
+
+class DependencyTree:
+    """Scan results of a package's whole dependency graph
+
+    nodes maps each (canonical name, version) to a dict holding the
+    package, the error its scan raised if any, its depth from the root,
+    the nodes it requires and the extras it was requested with.
+    Requirements that can't be resolved become nodes with version None.
+    max_depth stops expansion below that many levels, None for no limit.
+    """
+
+    def __init__(
+        self,
+        pkg_name,
+        pkg_version=None,
+        verbosity=0,
+        fields=None,
+        max_workers=DEFAULT_JOBS,
+        environment=None,
+        max_depth=None,
+        keep_raw=False,
+    ):
+        self.pkg_name = pkg_name
+        self.pkg_version = pkg_version
+        self.verbosity = verbosity
+        if fields is None:
+            fields = fields_for_verbosity(verbosity)
+        self.fields = fields
+        self.load_fields = fields + [f for f in REPORT_FIELDS if f not in fields]
+        self.max_workers = max_workers
+        self.environment = environment or target_environment()
+        self.max_depth = max_depth
+        self.keep_raw = keep_raw
+        self.root = None
+        self.nodes = {}
+        # Chosen release of each (name, specifier), shared by all nodes
+        self.resolved = {}
+        self.resolved_lock = threading.Lock()
+
+    def resolve(self, requirement):
+        """Pin a requirement to a release, returning (node key, error)"""
+        name = canonicalize_name(requirement.name)
+        cache_key = (name, str(requirement.specifier))
+        with self.resolved_lock:
+            if cache_key in self.resolved:
+                return self.resolved[cache_key]
+        try:
+            pkg_version = resolve_version(get_releases(name), requirement.specifier)
+            error = None
+            if pkg_version is None:
+                error = LookupError("No release matches " + str(requirement))
+        # get_pypi_data() exits on unknown packages
+        except (Exception, SystemExit) as exception:  # pylint: disable=broad-except
+            pkg_version, error = None, exception
+        with self.resolved_lock:
+            self.resolved[cache_key] = ((name, pkg_version), error)
+        return (name, pkg_version), error
+
+    def dependencies(self, requires_dist, extras):
+        """Resolve the requirements that apply, as (key, error, extras)"""
+        return [
+            self.resolve(requirement) + (frozenset(requirement.extras),)
+            for requirement in applicable_requirements(
+                requires_dist, self.environment, extras
+            )
+        ]
+
+    def scan_node(self, key, extras):
+        """Scan one release and resolve its dependencies
+
+        Returns (package, error, requires_dist, dependencies).
+        """
+        name, pkg_version = key
+        package = Package(
+            name, self.verbosity, keep_raw=self.keep_raw, version=pkg_version
+        )
+        try:
+            requires_dist = package.pypi_pkg["pypi_record"].requires_dist
+        except (Exception, SystemExit) as error:  # pylint: disable=broad-except
+            return None, error, [], []
+        error = None
+        try:
+            package.load(self.load_fields)
+        except (Exception, SystemExit) as exception:  # pylint: disable=broad-except
+            # The dependencies are still known, so the walk goes on
+            error = exception
+        return package, error, requires_dist, self.dependencies(requires_dist, extras)
+
+    def add_node(self, key, depth, error=None):
+        """Record a node the first time it is reached"""
+        if key not in self.nodes:
+            self.nodes[key] = {
+                "package": None,
+                "error": error,
+                "depth": depth,
+                "requires": set(),
+                "extras": set(),
+                "requires_dist": None,
+            }
+        return self.nodes[key]
+
+    def scan(self):
+        """Walk and scan the whole graph, returning self
+
+        Only this thread changes nodes. Workers scan releases and resolve
+        requirements, and each result adds the dependencies not yet seen
+        to the back of the queue.
+        """
+        with shared_calls(), ThreadPoolExecutor(self.max_workers) as executor:
+            if self.pkg_version is None:
+                self.root, error = self.resolve(Requirement(self.pkg_name))
+            else:
+                self.root = (canonicalize_name(self.pkg_name), self.pkg_version)
+                error = None
+            self.add_node(self.root, 0, error)
+            # Each task is (key, extras, scan), scan False when the node
+            # was already scanned and is only reached with new extras
+            queue = deque()
+            if error is None:
+                queue.append((self.root, frozenset(), True))
+            running = {}
+            while queue or running:
+                while queue and len(running) < self.max_workers:
+                    key, extras, scan = queue.popleft()
+                    if scan:
+                        future = executor.submit(self.scan_node, key, extras)
+                    else:
+                        future = executor.submit(
+                            self.dependencies, self.nodes[key]["requires_dist"], extras
+                        )
+                    running[future] = (key, extras, scan)
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key, extras, scan = running.pop(future)
+                    node = self.nodes[key]
+                    if scan:
+                        package, node["error"], requires_dist, dependencies = (
+                            future.result()
+                        )
+                        node["package"] = package
+                        node["requires_dist"] = requires_dist
+                        # Extras asked for while the scan was running
+                        if node["extras"] - extras:
+                            queue.append((key, frozenset(node["extras"]), False))
+                    else:
+                        dependencies = future.result()
+                    self.expand(key, dependencies, queue)
+        return self
+
+    def expand(self, key, dependencies, queue):
+        """Link a node to its dependencies and queue the new ones"""
+        node = self.nodes[key]
+        if self.max_depth is not None and node["depth"] >= self.max_depth:
+            return
+        for dependency, error, extras in dependencies:
+            node["requires"].add(dependency)
+            is_new = dependency not in self.nodes
+            child = self.add_node(dependency, node["depth"] + 1, error)
+            new_extras = extras - child["extras"]
+            child["extras"] |= extras
+            if error is not None:
+                continue
+            if is_new:
+                queue.append((dependency, frozenset(child["extras"]), True))
+            elif new_extras and child["requires_dist"] is not None:
+                queue.append((dependency, frozenset(new_extras), False))
+
+    def counts(self):
+        """Aggregate counts over every node of the tree"""
+        counts = {
+            "packages": len(self.nodes),
+            "failed": 0,
+            "unsigned_releases": 0,
+            "single_maintainer_packages": 0,
+            "similar_to_popular_names": 0,
+            "max_depth": max(node["depth"] for node in self.nodes.values()),
+        }
+        for node in self.nodes.values():
+            package = node["package"]
+            if node["error"] is not None:
+                counts["failed"] += 1
+            if package is None:
+                continue
+            # Only values the scan computed are counted
+            if package.pypi_pkg.get("pypi_pkg_signed") is False:
+                counts["unsigned_releases"] += 1
+            if len(package.pypi_pkg.get("maintainers_list", [])) == 1:
+                counts["single_maintainer_packages"] += 1
+            if package.typosquat.get("similar_names"):
+                counts["similar_to_popular_names"] += 1
+        return counts
+
+    def report(self):
+        """The graph with per-node results and aggregate counts"""
+        return {
+            "root": self.root,
+            "nodes": self.nodes,
+            "counts": self.counts(),
+        }
+
+    def print(self):
+        """Print each node, breadth-first, then the aggregate counts"""
+        for key in sorted(
+            self.nodes, key=lambda key: (self.nodes[key]["depth"], node_sort_key(key))
+        ):
+            node = self.nodes[key]
+            print(node_label(key) + " (depth " + str(node["depth"]) + ")")
+            if node["requires"]:
+                print(
+                    "Requires: "
+                    + " ".join(
+                        node_label(child)
+                        for child in sorted(node["requires"], key=node_sort_key)
+                    )
+                )
+            package = node["package"]
+            if node["error"] is not None:
+                print("ERROR: Scan failed: " + repr(node["error"]))
+                # Printing a field the scan failed on would fetch it again
+                if package is not None:
+                    package.print(self.verbosity, package.computed_fields(self.fields))
+            elif package is not None:
+                package.print(self.verbosity, self.fields)
+            print()
+        for name, count in self.counts().items():
+            print(name.replace("_", " ").capitalize() + ": " + str(count))
+
+
+def node_label(key):
+    """name==version of a node, or the name alone if unresolved"""
+    name, pkg_version = key
+    return name if pkg_version is None else name + "==" + pkg_version
+
+
+def node_sort_key(key):
+    """Sort key of a node, unresolved ones before releases of the name"""
+    name, pkg_version = key
+    return name, pkg_version or ""
+
+
+def scan_dependency_tree(pkg_name, pkg_version=None, **options):
+    """Scan a package's dependency tree and return the DependencyTree"""
+    return DependencyTree(pkg_name, pkg_version, **options).scan()
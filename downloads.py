@@ -1,11 +1,10 @@
 """Functions to fetch and manipulate package download data"""
 
-import requests
+from backends import get_backend
 
 
 def get_download_info(pkg_name):
     """Retrieve package download data from pypistats"""
-    url = "https://pypistats.org/api/packages/" + pkg_name + "/recent"
-    response = requests.get(url)
+    response = get_backend().download_stats(pkg_name)
     metadata_dict = response.json()
     return metadata_dict
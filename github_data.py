@@ -1,7 +1,11 @@
 """Functions related to retrieving data from github repo"""
 
-from bs4 import BeautifulSoup
-import requests
+from urllib.parse import urlsplit
+
+from backends import get_backend
+from html_extract import GithubPageRecord, extract_github_page
+import http_client
+from pipeline import shared
 
 
 def get_github_page(pypi_pkg):
@@ -9,9 +13,9 @@ def get_github_page(pypi_pkg):
 
     github_page = ""
     # Check potential fields for a github link
-    potential_github_fields = [pypi_pkg["pypi_data"]["info"]["home_page"]]
+    potential_github_fields = [pypi_pkg["pypi_record"].home_page or ""]
     # Add project url fields
-    for _, url in pypi_pkg["pypi_data"]["info"]["project_urls"].items():
+    for _, url in pypi_pkg["pypi_record"].project_urls.items():
         potential_github_fields.append(url)
     for field in potential_github_fields:
         # Any field with github in it must be github link
@@ -22,33 +26,52 @@ def get_github_page(pypi_pkg):
     return github_page
 
 
-def get_github_data(github_page_data):
+def get_github_data(github_page_data, keep_raw=False):
     """Retrieve github data, if link exists, from API or website"""
 
     github_data = None
     github_data_source = "API"
 
     if github_page_data["github_page"]:
+        github_data, github_data_source = get_github_repo_data(
+            github_page_data["github_page"], keep_raw
+        )
+
+    return github_data, github_data_source
+
+
+@shared
+def get_github_repo_data(github_page, keep_raw=False):
+    """Retrieve data on one github repo from API or website
+
+    Either way the result is a GithubPageRecord. With keep_raw, its raw
+    field holds the API JSON or page HTML it was read from.
+    """
+
+    github_data = None
+    github_data_source = "API"
 
-        # Try github API. There is rate limiting, including only six
-        # hits without being signed in to github, so rate limiting
-        # will likely apply.
-        repo_info = github_page_data["github_page"].split("/")[-2:]
+    # Try github API. There is rate limiting, including only sixty hits
+    # an hour without a GITHUB_TOKEN, so rate limiting will likely apply.
+    # Once github reports the quota is used up, go straight to scraping.
+    backend = get_backend()
+    if not http_client.rate_limit_exhausted(urlsplit(backend.github_api_url).hostname):
+        repo_info = github_page.split("/")[-2:]
         url_end = "/".join(repo_info)
-        github_url = "https://api.github.com/repos/" + url_end
-        response = requests.get(github_url)
-        metadata_dict = response.json()
-        github_data = metadata_dict
-
-        # If github API rate limit exceeded. Try scraping github page
-        if not response.ok:
-            github_data_source = "webscrape"
-            html = requests.get(github_page_data["github_page"])
-            try:
-                soup = BeautifulSoup(html.content, "html.parser")
-                github_data = soup
-            except TypeError:
-                github_data = None
+        response = backend.github_repo(url_end)
+        if response.ok:
+            repo_json = response.json()
+            github_data = GithubPageRecord(
+                repo_json["stargazers_count"], repo_json if keep_raw else None
+            )
+
+    # If github API rate limit exceeded. Try scraping github page
+    if github_data is None:
+        github_data_source = "webscrape"
+        html = backend.github_page(github_page)
+        github_data = extract_github_page(html.content)
+        if keep_raw:
+            github_data = github_data._replace(raw=html.content)
 
     return github_data, github_data_source
 
@@ -59,17 +82,10 @@ def get_github_stars(github_page_data):
     num_stars = "No github found"
 
     if github_page_data["github_page"]:
-        # If data on github comes form github API, parse json
-        if github_page_data["github_data_source"] == "API":
-            num_stars = github_page_data["github_data"]["stargazers_count"]
-        # If data on github comes from web scraping, parse beautiful soup object
-        elif github_page_data["github_data_source"] == "webscrape":
-            try:
-                num_stars_element = github_page_data["github_data"].find(
-                    "a", {"class": "social-count js-social-count"}
-                )
-                num_stars = num_stars_element.contents[0].strip()
-            except AttributeError:
-                num_stars = "Error"
+        # Both the API and web scraping leave the count in the record,
+        # which is None when the scraped page had no star count
+        num_stars = github_page_data["github_data"].stars
+        if num_stars is None:
+            num_stars = "Error"
 
     return num_stars
@@ -0,0 +1,184 @@
+"""Targeted extraction of the few HTML elements pkgscan reads from pages
+
+Each parser streams through a page with the standard library's
+html.parser and keeps only the text it needs, instead of building a
+full document tree. Results are small records, not parse trees.
+"""
+
+from collections import namedtuple
+from html.parser import HTMLParser
+
+# Bytes fed to a parser at a time, so parsing can stop once done
+CHUNK_SIZE = 64 * 1024
+
+# What pkgscan reads from a PyPI maintainer profile page. raw is only
+# set when the page itself is kept for debugging.
+ProfileRecord = namedtuple(
+    "ProfileRecord",
+    ["account_creation_dates", "package_counts", "raw"],
+    defaults=[None],
+)
+
+# What pkgscan reads about a github repository, from its page or the API
+GithubPageRecord = namedtuple("GithubPageRecord", ["stars", "raw"], defaults=[None])
+
+
+def has_classes(attrs, classes):
+    """Check whether a tag's class attribute includes all given classes"""
+    for name, value in attrs:
+        if name == "class" and value:
+            return set(classes) <= set(value.split())
+    return False
+
+
+class TargetedParser(HTMLParser):
+    """Base parser that can report when it has everything it needs"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.done = False
+
+
+class MaintainerListParser(TargetedParser):
+    """Collect maintainer usernames from a PyPI project page sidebar"""
+
+    def __init__(self):
+        super().__init__()
+        self.usernames = []
+        self.text = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "span" and has_classes(
+            attrs, ["sidebar-section__user-gravatar-text"]
+        ):
+            self.text = []
+
+    def handle_endtag(self, tag):
+        if tag == "span" and self.text is not None:
+            self.usernames.append("".join(self.text).strip())
+            self.text = None
+
+    def handle_data(self, data):
+        if self.text is not None:
+            self.text.append(data)
+
+
+class ProfileParser(TargetedParser):
+    """Collect account creation dates and package counts from a profile
+
+    Dates are the first <time> of each author-profile__metadiv block.
+    Package counts are the first word of the first <h2> in each
+    left-layout__main block.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.dates = []
+        self.package_counts = []
+        # Depth of nested <div>s inside the block being read, or None
+        self.metadiv_depth = None
+        self.main_depth = None
+        # Whether the current block already produced its value
+        self.metadiv_found = False
+        self.main_found = False
+        # Text of the <time> or <h2> being read, or None
+        self.time_text = None
+        self.h2_text = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "div":
+            if self.metadiv_depth is not None:
+                self.metadiv_depth += 1
+            elif has_classes(attrs, ["author-profile__metadiv"]):
+                self.metadiv_depth = 0
+                self.metadiv_found = False
+            if self.main_depth is not None:
+                self.main_depth += 1
+            elif has_classes(attrs, ["left-layout__main"]):
+                self.main_depth = 0
+                self.main_found = False
+        elif tag == "time" and self.metadiv_depth is not None:
+            if not self.metadiv_found:
+                self.time_text = []
+        elif tag == "h2" and self.main_depth is not None:
+            if not self.main_found:
+                self.h2_text = []
+
+    def handle_endtag(self, tag):
+        if tag == "div":
+            if self.metadiv_depth is not None:
+                self.metadiv_depth -= 1
+                if self.metadiv_depth < 0:
+                    self.metadiv_depth = None
+            if self.main_depth is not None:
+                self.main_depth -= 1
+                if self.main_depth < 0:
+                    self.main_depth = None
+        elif tag == "time" and self.time_text is not None:
+            self.dates.append("".join(self.time_text).strip())
+            self.time_text = None
+            self.metadiv_found = True
+        elif tag == "h2" and self.h2_text is not None:
+            # Take only number from the number of packages, drop "packages"
+            self.package_counts.append("".join(self.h2_text).strip().split(" ")[0])
+            self.h2_text = None
+            self.main_found = True
+
+    def handle_data(self, data):
+        if self.time_text is not None:
+            self.time_text.append(data)
+        if self.h2_text is not None:
+            self.h2_text.append(data)
+
+
+class GithubStarsParser(TargetedParser):
+    """Find the star count link on a github repository page"""
+
+    def __init__(self):
+        super().__init__()
+        self.stars = None
+        self.text = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "a" and self.stars is None:
+            if has_classes(attrs, ["social-count", "js-social-count"]):
+                self.text = []
+
+    def handle_endtag(self, tag):
+        if tag == "a" and self.text is not None:
+            self.stars = "".join(self.text).strip()
+            self.text = None
+            # Nothing after the first match is needed
+            self.done = True
+
+    def handle_data(self, data):
+        if self.text is not None:
+            self.text.append(data)
+
+
+def run_parser(parser, content):
+    """Feed page text, bytes or a memory map to a parser until it is done"""
+    if not isinstance(content, str):
+        content = str(content, "utf-8", errors="replace")
+    for start in range(0, len(content), CHUNK_SIZE):
+        parser.feed(content[start : start + CHUNK_SIZE])
+        if parser.done:
+            break
+    parser.close()
+    return parser
+
+
+def extract_maintainers(content):
+    """Return the maintainer usernames listed on a PyPI project page"""
+    return run_parser(MaintainerListParser(), content).usernames
+
+
+def extract_profile(content):
+    """Return a ProfileRecord from a PyPI user profile page"""
+    parser = run_parser(ProfileParser(), content)
+    return ProfileRecord(parser.dates, parser.package_counts)
+
+
+def extract_github_page(content):
+    """Return a GithubPageRecord from a github repository page"""
+    return GithubPageRecord(run_parser(GithubStarsParser(), content).stars)
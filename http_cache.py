@@ -0,0 +1,318 @@
+"""On-disk HTTP response cache with conditional revalidation"""
+
+from collections import Counter
+from contextlib import contextmanager
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+DAY = 24 * 60 * 60
+
+# Seconds a cached response is used without asking the server again, by
+# endpoint class. After that it is revalidated with a conditional request,
+# so a TTL of 0 means "check every time, download only on change".
+TTLS = {
+    "pypi_json": 0,
+    "pypi_project_page": DAY,
+    "pypi_profile": 7 * DAY,
+    "pypistats": DAY,
+    "github_api": DAY,
+    "github_page": DAY,
+    "other": 0,
+}
+
+# Total bytes of cached bodies kept before least recently used are evicted
+MAX_BYTES = 512 * 1024 * 1024
+
+# Directory holding the cache, and whether get() should use it at all
+CACHE_DIR = os.environ.get(
+    "PKGSCAN_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "pkgscan")
+)
+enabled = True
+
+# Counts of fresh hits, revalidations, misses, evictions and bytes saved
+stats = Counter()
+
+# key -> (body size, last access time) for every entry on disk
+_index = None
+_lock = threading.Lock()
+
+
+def endpoint_class(url):
+    """Classify a URL into one of the TTLS endpoint classes"""
+    parts = urlsplit(url)
+    host = parts.hostname or ""
+    path = parts.path
+    if host == "pypistats.org":
+        return "pypistats"
+    if host == "api.github.com":
+        return "github_api"
+    if host == "github.com":
+        return "github_page"
+    if path.startswith("/pypi/") and path.rstrip("/").endswith("/json"):
+        return "pypi_json"
+    if path.startswith("/user/"):
+        return "pypi_profile"
+    if path.startswith("/project/"):
+        return "pypi_project_page"
+    return "other"
+
+
+def entry_paths(url):
+    """Return the (metadata, body) file paths for a URL"""
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    base = os.path.join(CACHE_DIR, key[:2], key)
+    return base + ".json", base + ".body"
+
+
+def load_index():
+    """Build the size and access-time index from the files on disk"""
+    global _index  # pylint: disable=global-statement
+    if _index is None:
+        _index = {}
+        for root, _, files in os.walk(CACHE_DIR):
+            for name in files:
+                if name.endswith(".body"):
+                    path = os.path.join(root, name)
+                    stat = os.stat(path)
+                    _index[path] = (stat.st_size, stat.st_atime)
+    return _index
+
+
+def evict():
+    """Remove least recently used entries until under MAX_BYTES"""
+    index = load_index()
+    total = sum(size for size, _ in index.values())
+    if total <= MAX_BYTES:
+        return
+    for body_path in sorted(index, key=lambda path: index[path][1]):
+        size, _ = index.pop(body_path)
+        for path in (body_path[: -len(".body")] + ".json", body_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        stats["evictions"] += 1
+        total -= size
+        if total <= MAX_BYTES:
+            break
+
+
+def count(name, amount=1):
+    """Add to one of the cache statistics"""
+    with _lock:
+        stats[name] += amount
+
+
+def atomic_write(path, data, mode):
+    """Write a file via a temporary file so no one sees it half-written"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, mode) as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        # Eviction only sees indexed entries, so nothing else removes it
+        os.unlink(tmp_path)
+        raise
+
+
+def atomic_write_chunks(path, chunks):
+    """Write byte chunks to a file like atomic_write(), returning its size"""
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+                size += len(chunk)
+        os.replace(tmp_path, path)
+    except BaseException:
+        # A download failing part way leaves no temporary file behind
+        os.unlink(tmp_path)
+        raise
+    return size
+
+
+def read_meta(url):
+    """Return (metadata, body path) cached for a URL, or (None, None)"""
+    meta_path, body_path = entry_paths(url)
+    try:
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+        size = os.path.getsize(body_path)
+    except (OSError, ValueError):
+        return None, None
+    # Record the access so eviction keeps recently used entries
+    with _lock:
+        load_index()[body_path] = (size, time.time())
+    return meta, body_path
+
+
+def read_entry(url):
+    """Return (metadata, body) cached for a URL, or (None, None)"""
+    meta, body_path = read_meta(url)
+    if meta is None:
+        return None, None
+    try:
+        with open(body_path, "rb") as f:
+            return meta, f.read()
+    except OSError:
+        return None, None
+
+
+def write_entry(url, response, chunks=None):
+    """Store a successful response and its validators
+
+    chunks iterates over the body of a streamed response, which is then
+    written as it arrives rather than read into memory first.
+    """
+    meta_path, body_path = entry_paths(url)
+    os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+    meta = {
+        "url": url,
+        "stored_at": time.time(),
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "content_type": response.headers.get("Content-Type"),
+    }
+    if chunks is None:
+        chunks = [response.content]
+    size = atomic_write_chunks(body_path, chunks)
+    atomic_write(meta_path, json.dumps(meta), "w")
+    with _lock:
+        load_index()[body_path] = (size, time.time())
+        evict()
+
+
+def touch_entry(url, meta):
+    """Mark a cached entry as fresh again after a 304"""
+    meta_path, _ = entry_paths(url)
+    meta["stored_at"] = time.time()
+    atomic_write(meta_path, json.dumps(meta), "w")
+
+
+def build_response(url, meta, body):
+    """Turn a cached body back into a requests.Response"""
+    response = requests.Response()
+    response.status_code = 200
+    response.reason = "OK"
+    response.url = url
+    response._content = body  # pylint: disable=protected-access
+    response.headers = CaseInsensitiveDict()
+    if meta.get("content_type"):
+        response.headers["Content-Type"] = meta["content_type"]
+    return response
+
+
+def is_fresh(url, meta):
+    """Whether a cached entry may be used without asking the server"""
+    return time.time() - meta["stored_at"] < TTLS[endpoint_class(url)]
+
+
+def revalidation_headers(meta):
+    """Conditional request headers asking whether an entry changed"""
+    headers = {}
+    if meta.get("etag"):
+        headers["If-None-Match"] = meta["etag"]
+    if meta.get("last_modified"):
+        headers["If-Modified-Since"] = meta["last_modified"]
+    return headers
+
+
+def cached_get(url, fetch):
+    """Return a response for url, calling fetch(headers) only when needed
+
+    A fresh entry is returned without any request. A stale entry is
+    revalidated with If-None-Match/If-Modified-Since and reused on a 304.
+    The response's cache_status tells which happened: "hit",
+    "revalidated" or "miss".
+    """
+    meta, body = read_entry(url)
+    if meta is None:
+        response = fetch({})
+        count("misses")
+        if response.status_code == 200:
+            write_entry(url, response)
+        response.cache_status = "miss"
+        return response
+
+    if is_fresh(url, meta):
+        count("hits")
+        count("bytes_saved", len(body))
+        response = build_response(url, meta, body)
+        response.cache_status = "hit"
+        return response
+
+    response = fetch(revalidation_headers(meta))
+    if response.status_code == 304:
+        count("revalidated")
+        count("bytes_saved", len(body))
+        touch_entry(url, meta)
+        response = build_response(url, meta, body)
+        response.cache_status = "revalidated"
+        return response
+
+    count("misses")
+    if response.status_code == 200:
+        write_entry(url, response)
+    response.cache_status = "miss"
+    return response
+
+
+@contextmanager
+def cached_stream(url, fetch, chunk_size=1024 * 1024):
+    """Like cached_get(), but give (status code, body file, cache status)
+
+    fetch(headers) must return a streamed response. The body is never
+    held in memory whole: a cached one is read from its file, and a new
+    one is written to the cache as it arrives, then read back.
+    """
+    meta, _ = read_meta(url)
+    _, body_path = entry_paths(url)
+    if meta is not None and is_fresh(url, meta):
+        count("hits")
+        count("bytes_saved", os.path.getsize(body_path))
+        with open(body_path, "rb") as f:
+            yield 200, f, "hit"
+        return
+
+    response = fetch({} if meta is None else revalidation_headers(meta))
+    with response:
+        if meta is not None and response.status_code == 304:
+            count("revalidated")
+            count("bytes_saved", os.path.getsize(body_path))
+            touch_entry(url, meta)
+            cache_status = "revalidated"
+        else:
+            count("misses")
+            if response.status_code != 200:
+                # Error pages are small and never cached
+                yield response.status_code, io.BytesIO(response.content), "miss"
+                return
+            write_entry(url, response, response.iter_content(chunk_size))
+            cache_status = "miss"
+    with open(body_path, "rb") as f:
+        yield 200, f, cache_status
+
+
+def format_stats():
+    """Summarize cache effectiveness in one line"""
+    return (
+        "HTTP cache: {hits} fresh hits, {revalidated} revalidated, "
+        "{misses} misses, {evictions} evictions, {mb:.1f} MB not downloaded"
+    ).format(
+        hits=stats["hits"],
+        revalidated=stats["revalidated"],
+        misses=stats["misses"],
+        evictions=stats["evictions"],
+        mb=stats["bytes_saved"] / 1e6,
+    )
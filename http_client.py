@@ -0,0 +1,282 @@
+"""Shared HTTP client with connection pooling and per-host rate limiting"""
+
+from collections import Counter
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import http_cache
+import profiling
+
+# Seconds to wait for a connection and then for each read of the response
+TIMEOUT = (5, 30)
+
+# Number of times a 429 or 5xx response, connection error or timeout is
+# retried before giving up
+RETRIES = 3
+
+# Base and maximum seconds of the exponential backoff between retries
+BACKOFF = 0.5
+MAX_BACKOFF = 60
+
+# Status codes worth retrying because the server may recover
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Per-host (max concurrent requests, requests per second, burst size).
+# Hosts not listed use DEFAULT_HOST_LIMITS.
+HOST_LIMITS = {
+    "pypi.org": (16, 20, 40),
+    "pypistats.org": (4, 5, 10),
+    "api.github.com": (4, 10, 10),
+    "github.com": (4, 5, 10),
+}
+DEFAULT_HOST_LIMITS = (8, 10, 20)
+
+# Hosts GITHUB_TOKEN is sent to. An optional token raises the github API
+# limit from 60 to 5000 requests per hour.
+GITHUB_TOKEN_HOSTS = {"api.github.com"}
+
+
+class TokenBucket:
+    """Token bucket allowing rate requests per second with bursts of capacity"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available and take it"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                # Refill for the time passed since the last update
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            # Sleep outside the lock so other threads can check the bucket
+            time.sleep(wait)
+
+
+class HostLimiter:
+    """Concurrency cap and token bucket for a single host"""
+
+    def __init__(self, max_concurrent, rate, capacity):
+        self.semaphore = threading.BoundedSemaphore(max_concurrent)
+        self.bucket = TokenBucket(rate, capacity)
+
+
+_session = None
+_limiters = {}
+_lock = threading.Lock()
+
+# Number of requests sent to each host, including retries
+request_counts = Counter()
+
+# Latest (remaining, reset epoch) API quota reported by each host
+rate_limits = {}
+
+
+def get_session():
+    """Return the process-wide session, creating it on first use"""
+    global _session  # pylint: disable=global-statement
+    with _lock:
+        if _session is None:
+            session = requests.Session()
+            # Keep enough idle connections per host for every thread that
+            # HOST_LIMITS lets talk to it at once
+            pool_size = max(limits[0] for limits in HOST_LIMITS.values())
+            adapter = HTTPAdapter(pool_connections=16, pool_maxsize=pool_size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+def auth_headers(host, headers=None):
+    """Headers for a request to host, with GITHUB_TOKEN only for github's API
+
+    The token is never set on the shared session, so it can't reach
+    PyPI, mirrors or file hosts.
+    """
+    headers = dict(headers or {})
+    github_token = os.environ.get("GITHUB_TOKEN")
+    if github_token and host in GITHUB_TOKEN_HOSTS:
+        headers["Authorization"] = "token " + github_token
+    return headers
+
+
+def get_limiter(host):
+    """Return the limiter for a host, creating it on first use"""
+    with _lock:
+        if host not in _limiters:
+            _limiters[host] = HostLimiter(*HOST_LIMITS.get(host, DEFAULT_HOST_LIMITS))
+        return _limiters[host]
+
+
+def parse_retry_after(value):
+    """Convert a Retry-After header, in seconds or as a date, to seconds"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_date.timestamp() - time.time())
+
+
+def backoff_delay(attempt, retry_after=None):
+    """Seconds to wait before retry number attempt (starting at 0)"""
+    if retry_after is not None:
+        return min(retry_after, MAX_BACKOFF)
+    # "Full jitter" spreads retries from many threads over the window
+    return random.uniform(0, min(MAX_BACKOFF, BACKOFF * 2**attempt))
+
+
+def record_rate_limit(host, response):
+    """Remember the API quota a host reports in its response headers"""
+    remaining = response.headers.get("X-RateLimit-Remaining")
+    reset = response.headers.get("X-RateLimit-Reset")
+    if remaining is not None and reset is not None:
+        try:
+            rate_limits[host] = (int(remaining), int(reset))
+        except ValueError:
+            pass
+
+
+def rate_limit_exhausted(host):
+    """Check whether a host has reported that its API quota is used up"""
+    remaining, reset = rate_limits.get(host, (1, 0))
+    return remaining <= 0 and reset > time.time()
+
+
+def get(url, timeout=None, **kwargs):
+    """Send a GET request through the shared session and response cache
+
+    Plain GETs are answered from http_cache when possible. Requests are
+    limited per host and retried with jittered backoff on 429 and 5xx
+    responses, honouring Retry-After, and on connection errors and
+    timeouts. The last response is returned even if it is still an
+    error, like requests.get() would.
+    """
+    with profiling.span("GET", "http", url=url) as details:
+        # Only plain GETs are cached; extra arguments such as custom
+        # headers could change what the server sends back
+        if http_cache.enabled and not kwargs:
+            response = http_cache.cached_get(
+                url, lambda headers: send(url, timeout, headers=headers)
+            )
+        else:
+            response = send(url, timeout, **kwargs)
+        details["status"] = response.status_code
+        details["bytes"] = len(response.content)
+        details["cache"] = getattr(response, "cache_status", "off")
+    return response
+
+
+@contextmanager
+def open_stream(url, timeout=None):
+    """Context manager giving the (status code, binary file) of a GET
+
+    Like get(), but the body is read as it arrives instead of being held
+    in memory whole: from the cache's file, after being streamed into the
+    cache, or off the connection if the cache is off.
+    """
+    with profiling.span("GET", "http", url=url, stream=True) as details:
+        if http_cache.enabled:
+            with http_cache.cached_stream(
+                url, lambda headers: send(url, timeout, headers=headers, stream=True)
+            ) as (status_code, body, cache_status):
+                details["status"] = status_code
+                details["cache"] = cache_status
+                yield status_code, body
+        else:
+            response = send(url, timeout, stream=True)
+            with response:
+                # Undo any gzip content encoding, as iter_content() would
+                response.raw.decode_content = True
+                details["status"] = response.status_code
+                details["cache"] = "off"
+                yield response.status_code, response.raw
+
+
+def send(url, timeout=None, **kwargs):
+    """Send a GET request with rate limiting and retries, bypassing the cache
+
+    Connection errors and timeouts are retried like 429 and 5xx
+    responses. A streamed response keeps its place under the host's
+    concurrency cap until it is closed, so read it in a with block.
+    """
+    host = urlsplit(url).hostname
+    limiter = get_limiter(host)
+    session = get_session()
+    kwargs["headers"] = auth_headers(host, kwargs.get("headers"))
+    attempt = 0
+    while True:
+        with profiling.span("wait " + host, "http"):
+            limiter.bucket.acquire()
+            limiter.semaphore.acquire()
+        try:
+            with _lock:
+                request_counts[host] += 1
+            with profiling.span("send " + host, "http", attempt=attempt) as details:
+                response = session.get(url, timeout=timeout or TIMEOUT, **kwargs)
+                details["status"] = response.status_code
+        except (requests.ConnectionError, requests.Timeout):
+            limiter.semaphore.release()
+            if attempt >= RETRIES:
+                raise
+            time.sleep(backoff_delay(attempt))
+            attempt += 1
+            continue
+        except BaseException:
+            limiter.semaphore.release()
+            raise
+        if kwargs.get("stream"):
+            release_on_close(response, limiter.semaphore)
+        else:
+            limiter.semaphore.release()
+        record_rate_limit(host, response)
+        if response.status_code not in RETRY_STATUSES or attempt >= RETRIES:
+            return response
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        # Give a streamed response's connection and slot back before retrying
+        response.close()
+        time.sleep(backoff_delay(attempt, retry_after))
+        attempt += 1
+
+
+def release_on_close(response, semaphore):
+    """Release a host's semaphore once, when a streamed response is closed"""
+    close = response.close
+    lock = threading.Lock()
+    held = [True]
+
+    def close_and_release():
+        try:
+            close()
+        finally:
+            with lock:
+                if held[0]:
+                    held[0] = False
+                    semaphore.release()
+
+    response.close = close_and_release
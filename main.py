@@ -1,9 +1,15 @@
 """Package class to store data about one PyPI package"""
 
 import argparse
+import threading
+from urllib.parse import urljoin
 
+import analysis_cache
+import backends
 from downloads import get_download_info
 from github_data import get_github_data, get_github_page, get_github_stars
+import http_cache
+import http_client
 from pypi_pkg import (
     get_author_email,
     get_author_name,
@@ -12,127 +18,431 @@ from pypi_pkg import (
     get_last_release_date,
     get_number_releases_past_year,
     get_number_versions,
-    get_pypi_data,
     get_pypi_maintainers_list,
+    get_pypi_record,
     is_pypi_pkg_signed,
+    split_version_pin,
 )
+from pipeline import MAX_WORKERS, LazySection, run_stages
+import profiling
 from pypi_profiles import (
     get_maintainers_account_creation_date,
     get_number_of_packages_maintained_by_maintainers,
     get_pypi_maintainers_data,
 )
-from static import (
-    download_and_unzip_package,
-    generate_bandit_dict,
-    generate_pylint_dict,
-    remove_package_and_static_analysis_artifacts,
-)
+from typosquat import get_similar_names
+
+# Every field that can be selected, mapped to the section attribute and
+# key holding it and the stages it needs, in the order they are printed
+FIELDS = {
+    "first_release_date": ("pypi_pkg", "first_release_date", ["pypi_record"]),
+    "last_release_date": ("pypi_pkg", "last_release_date", ["pypi_record"]),
+    "number_versions": ("pypi_pkg", "number_versions", ["pypi_record"]),
+    "number_releases_past_year": (
+        "pypi_pkg",
+        "number_releases_past_year",
+        ["pypi_record"],
+    ),
+    "home_page": ("pypi_pkg", "home_page", ["pypi_record"]),
+    "github_page": ("github_page_data", "github_page", ["github_page"]),
+    "author_email": ("pypi_pkg", "author_email", ["pypi_record"]),
+    "author_name": ("pypi_pkg", "author_name", ["pypi_record"]),
+    "pypi_pkg_signed": ("pypi_pkg", "pypi_pkg_signed", ["pypi_record"]),
+    "maintainers_list": ("pypi_pkg", "maintainers_list", ["maintainers_list"]),
+    "similar_names": ("typosquat", "similar_names", []),
+    "maintainers_account_creation_date": (
+        "pypi_profiles",
+        "maintainers_account_creation_date",
+        ["maintainers_data"],
+    ),
+    "number_of_packages_maintained_by_maintainers": (
+        "pypi_profiles",
+        "number_of_packages_maintained_by_maintainers",
+        ["maintainers_data"],
+    ),
+    "github_stars": ("github_page_data", "github_stars", ["github_data"]),
+    "source_correspondence": (
+        "github_page_data",
+        "source_correspondence",
+        ["source_correspondence"],
+    ),
+    "downloads": ("downloads", "data", ["downloads"]),
+    "bandit": ("static_analysis", "bandit", ["static_analysis"]),
+    "ast_checks": ("static_analysis", "ast_checks", ["static_analysis"]),
+    "pylint": ("static_analysis", "pylint", ["static_analysis"]),
+    "download": ("static_analysis", "download", ["static_analysis"]),
+}
+
+# Fields printed by default, and the static analysis fields added by -v
+DEFAULT_FIELDS = [
+    "first_release_date",
+    "last_release_date",
+    "number_versions",
+    "number_releases_past_year",
+    "home_page",
+    "github_page",
+    "author_email",
+    "author_name",
+    "maintainers_list",
+    "similar_names",
+    "maintainers_account_creation_date",
+    "number_of_packages_maintained_by_maintainers",
+    "github_stars",
+    "downloads",
+]
+STATIC_ANALYSIS_FIELDS = ["bandit", "ast_checks", "pylint", "download"]
+
+
+def fields_for_verbosity(verbosity):
+    """Fields printed at a verbosity level"""
+    if verbosity:
+        return DEFAULT_FIELDS + STATIC_ANALYSIS_FIELDS
+    return list(DEFAULT_FIELDS)
 
 
 class Package:
-    """PyPI package class"""
+    """PyPI package class
+
+    Nothing is fetched when a Package is created. Each value in the
+    pypi_pkg, typosquat, pypi_profiles, github_page_data, downloads and
+    static_analysis sections is computed when first read and runs only
+    the stages it needs. load() fetches what a set of fields needs ahead
+    of time, running independent stages at the same time.
+
+    With a version, metadata and static analysis are about that release
+    instead of the latest one, and release history comes from PyPI's
+    simple index rather than the full JSON of every release.
 
-    def __init__(self, pkg_name, verbosity):
+    Fetched documents are reduced to compact records as soon as they
+    arrive. With keep_raw, the records also hold the PyPI JSON, profile
+    pages and github data they came from, for debugging.
+    """
+
+    def __init__(
+        self, pkg_name, verbosity=0, concurrent=True, keep_raw=False, version=None
+    ):
         self.pkg_name = pkg_name
+        self.version = version
+        self.verbosity = verbosity
+        # Independent requests run at the same time unless concurrent is
+        # False, in which case every stage runs one after another for
+        # comparison and debugging
+        self.concurrent = concurrent
+        self.keep_raw = keep_raw
+        # Function running static analysis, like static.analyze_package(),
+        # which batch scans replace with one running in a process pool
+        self.static_analyzer = None
+        # Result of each stage that has run so far
+        self.stage_results = {}
+        self.stage_lock = threading.Lock()
         # PyPI package data
-        self.pypi_pkg = {}
-        self.generate_pypi_pkg_dict_data()
+        self.pypi_pkg = LazySection(self.pypi_pkg_loaders())
+        # Popular package names this one looks like, found offline
+        self.typosquat = LazySection(
+            {"similar_names": lambda: get_similar_names(self.pkg_name)}
+        )
         # PyPI maintainers data
-        self.pypi_profiles = {}
-        self.generate_pypi_profiles_data()
+        self.pypi_profiles = LazySection(self.pypi_profiles_loaders())
         # Github page data
-        self.github_page_data = {}
-        self.generate_github_data()
-        # Get package download data
-        self.downloads = get_download_info(self.pkg_name)
-        # Perform static code analysis if verbosity selected
-        if verbosity:
-            self.static_analysis = {}
-            self.generate_static_analysis_results()
-
-    def generate_pypi_pkg_dict_data(self):
-        """Create a dict of all pypi package-related data"""
-        self.pypi_pkg["pypi_data"] = get_pypi_data(self.pkg_name)
-        self.pypi_pkg["first_release_date"] = get_first_release_date(self.pypi_pkg)
-        self.pypi_pkg["last_release_date"] = get_last_release_date(self.pypi_pkg)
-        self.pypi_pkg["number_versions"] = get_number_versions(self.pypi_pkg)
-        self.pypi_pkg["number_releases_past_year"] = get_number_releases_past_year(
-            self.pypi_pkg
+        self.github_page_data = LazySection(self.github_loaders())
+        # Package download data
+        self.downloads = LazySection({"data": lambda: self.stage("downloads")["data"]})
+        # Static code analysis results
+        self.static_analysis = LazySection(
+            {
+                "bandit": lambda: self.stage("static_analysis")["bandit"],
+                "ast_checks": lambda: self.stage("static_analysis")["ast_checks"],
+                "pylint": lambda: self.stage("static_analysis")["pylint"],
+                "download": lambda: self.stage("static_analysis")["download"],
+            }
         )
-        self.pypi_pkg["author_email"] = get_author_email(self.pypi_pkg)
-        self.pypi_pkg["author_name"] = get_author_name(self.pypi_pkg)
-        self.pypi_pkg["home_page"] = get_home_page(self.pypi_pkg)
-        self.pypi_pkg["pypi_pkg_signed"] = is_pypi_pkg_signed(self.pypi_pkg)
-        self.pypi_pkg["maintainers_list"] = get_pypi_maintainers_list(self.pkg_name)
-
-    def generate_pypi_profiles_data(self):
-        """Create a dict of all pypi profile-related data"""
-        self.pypi_profiles["maintainers_data"] = get_pypi_maintainers_data(
-            self.pypi_pkg
+
+    def collection_stages(self):
+        """Map each stage to its function and the stages it needs"""
+        profile_workers = MAX_WORKERS if self.concurrent else 1
+        return {
+            "pypi_record": (
+                lambda: get_pypi_record(self.pkg_name, self.keep_raw, self.version),
+                [],
+            ),
+            "maintainers_list": (
+                lambda: get_pypi_maintainers_list(self.pkg_name),
+                [],
+            ),
+            "downloads": (lambda: get_download_info(self.pkg_name), []),
+            "maintainers_data": (
+                lambda maintainers_list: get_pypi_maintainers_data(
+                    {"maintainers_list": maintainers_list},
+                    profile_workers,
+                    self.keep_raw,
+                ),
+                ["maintainers_list"],
+            ),
+            "github_page": (
+                lambda pypi_record: get_github_page({"pypi_record": pypi_record}),
+                ["pypi_record"],
+            ),
+            "github_data": (
+                lambda github_page: get_github_data(
+                    {"github_page": github_page}, self.keep_raw
+                ),
+                ["github_page"],
+            ),
+            "static_analysis": (
+                self.generate_static_analysis_results,
+                ["pypi_record"],
+            ),
+            "source_correspondence": (
+                self.generate_source_correspondence,
+                ["pypi_record", "github_page"],
+            ),
+        }
+
+    def fetch_stages(self, names):
+        """Run the named stages and their dependencies unless already run"""
+        with self.stage_lock:
+            if all(name in self.stage_results for name in names):
+                return
+            # Each stage is recorded as a span when profiling
+            stages = {
+                name: (
+                    profiling.timed(name, "stage", function, package=self.pkg_name),
+                    dependencies,
+                )
+                for name, (function, dependencies) in self.collection_stages().items()
+            }
+            self.stage_results = run_stages(
+                stages,
+                self.concurrent,
+                targets=names,
+                results=self.stage_results,
+            )
+
+    def stage(self, name):
+        """Return the result of one stage, running it if needed"""
+        self.fetch_stages([name])
+        return self.stage_results[name]
+
+    def load(self, fields):
+        """Compute the given fields, fetching everything they need at once"""
+        stages = []
+        for field in fields:
+            stages.extend(FIELDS[field][2])
+        self.fetch_stages(stages)
+        for field in fields:
+            section, key, _ = FIELDS[field]
+            getattr(self, section)[key]  # pylint: disable=expression-not-assigned
+
+    def field_values(self, fields):
+        """Map each of the given fields to its value, computing it if needed"""
+        self.load(fields)
+        return {
+            field: getattr(self, FIELDS[field][0])[FIELDS[field][1]] for field in fields
+        }
+
+    def computed_fields(self, fields):
+        """The given fields whose values were already computed"""
+        return [
+            field
+            for field in fields
+            if FIELDS[field][1] in getattr(self, FIELDS[field][0])
+        ]
+
+    def pypi_pkg_loaders(self):
+        """Functions computing each pypi package-related value"""
+        return {
+            "pypi_record": lambda: self.stage("pypi_record"),
+            # The whole PyPI JSON, only kept with keep_raw
+            "pypi_data": lambda: self.stage("pypi_record").raw,
+            "first_release_date": lambda: get_first_release_date(self.pypi_pkg),
+            "last_release_date": lambda: get_last_release_date(self.pypi_pkg),
+            "number_versions": lambda: get_number_versions(self.pypi_pkg),
+            "number_releases_past_year": lambda: get_number_releases_past_year(
+                self.pypi_pkg
+            ),
+            "author_email": lambda: get_author_email(self.pypi_pkg),
+            "author_name": lambda: get_author_name(self.pypi_pkg),
+            "home_page": lambda: get_home_page(self.pypi_pkg),
+            "pypi_pkg_signed": lambda: is_pypi_pkg_signed(self.pypi_pkg),
+            "maintainers_list": lambda: self.stage("maintainers_list"),
+        }
+
+    def pypi_profiles_loaders(self):
+        """Functions computing each pypi profile-related value"""
+        return {
+            "maintainers_data": lambda: self.stage("maintainers_data"),
+            "maintainers_account_creation_date": (
+                lambda: get_maintainers_account_creation_date(self.pypi_profiles)
+            ),
+            "number_of_packages_maintained_by_maintainers": (
+                lambda: get_number_of_packages_maintained_by_maintainers(
+                    self.pypi_profiles
+                )
+            ),
+        }
+
+    def github_loaders(self):
+        """Functions computing each github-related value"""
+        return {
+            "github_page": lambda: self.stage("github_page"),
+            "github_data": lambda: self.stage("github_data")[0],
+            "github_data_source": lambda: self.stage("github_data")[1],
+            "github_stars": lambda: get_github_stars(self.github_page_data),
+            "source_correspondence": lambda: self.stage("source_correspondence"),
+        }
+
+    def release_files(self, pypi_record):
+        """The release's files in the JSON's shape, with URLs to fetch them"""
+        # Mirrors may list them by URLs relative to the JSON's own
+        backend = backends.get_backend()
+        json_url = backend.pypi_url + "/pypi/" + self.pkg_name + "/json"
+        return [
+            dict(
+                release_file,
+                url=backend.artifact_url(urljoin(json_url, release_file["url"])),
+            )
+            for release_file in pypi_record.urls
+        ]
+
+    def generate_source_correspondence(self, pypi_record, github_page):
+        """Compare the release with its tagged source on github"""
+        # Imported on first use, like the static analysis tooling
+        # pylint: disable=import-outside-toplevel
+        from source_correspondence import check_source_correspondence
+
+        return check_source_correspondence(
+            self.pkg_name,
+            pypi_record.release_version,
+            self.release_files(pypi_record),
+            github_page,
         )
-        self.pypi_profiles[
-            "maintainers_account_creation_date"
-        ] = get_maintainers_account_creation_date(self.pypi_profiles)
-        self.pypi_profiles[
-            "number_of_packages_maintained_by_maintainers"
-        ] = get_number_of_packages_maintained_by_maintainers(self.pypi_profiles)
-
-    def generate_github_data(self):
-        """Create a dict of all github-related data"""
-        self.github_page_data["github_page"] = get_github_page(self.pypi_pkg)
-        (
-            self.github_page_data["github_data"],
-            self.github_page_data["github_data_source"],
-        ) = get_github_data(self.github_page_data)
-        self.github_page_data["github_stars"] = get_github_stars(self.github_page_data)
-
-    def generate_static_analysis_results(self):
+
+    def generate_static_analysis_results(self, pypi_record=None):
         """Create a dict of all static analysis-related results"""
-        download_and_unzip_package(self.pkg_name)
-        self.static_analysis["bandit"] = generate_bandit_dict()
-        self.static_analysis["pylint"] = generate_pylint_dict()
-        remove_package_and_static_analysis_artifacts()
-
-    def print(self, verbosity):
-        """Print package information"""
-        print("First release date: " + self.pypi_pkg["first_release_date"])
-        print("Last release data: " + self.pypi_pkg["last_release_date"])
-        print("Number of versions: " + str(self.pypi_pkg["number_versions"]))
-        print(
-            "Number releases past year: "
-            + str(self.pypi_pkg["number_releases_past_year"])
-        )
-        print("Home page: " + self.pypi_pkg["home_page"])
-        print("Github link: " + self.github_page_data["github_page"])
-        print("Author email: " + self.pypi_pkg["author_email"])
-        print("Author name: " + self.pypi_pkg["author_name"])
-        print("Maintainer usernames: ", end="")
-        for maintainer in self.pypi_pkg["maintainers_list"]:
-            print(maintainer, end=" ")
-        print()
-        print("Maintainer accounts creation dates: ", end="")
-        for date in self.pypi_profiles["maintainers_account_creation_date"]:
-            print(date, end=" ")
-        print()
-        print("Number of packagages maintained by maintainers: ", end=" ")
-        for num in self.pypi_profiles["number_of_packages_maintained_by_maintainers"]:
-            print(num, end=" ")
-        print()
-        print("Github stars: " + str(self.github_page_data["github_stars"]))
-        print(
-            "Number of PyPI downloads in past month:",
-            str(self.downloads["data"]["last_month"]),
-        )
-        if verbosity >= 1:
+        # Imported on first use so scans without -v don't load the
+        # analysis tooling at startup
+        from static import analyze_package  # pylint: disable=import-outside-toplevel
+
+        pypi_data = None
+        if pypi_record:
+            pypi_data = {"urls": self.release_files(pypi_record)}
+        requirement = self.pkg_name
+        if self.version is not None:
+            requirement += "==" + self.version
+        return (self.static_analyzer or analyze_package)(requirement, pypi_data)
+
+    def print(self, verbosity, fields=None):
+        """Print package information
+
+        Only the given fields are printed, and only what they need is
+        fetched. By default the fields for the verbosity level are used.
+        """
+        if fields is None:
+            fields = fields_for_verbosity(verbosity)
+        self.load(fields)
+        if "first_release_date" in fields:
+            print("First release date: " + self.pypi_pkg["first_release_date"])
+        if "last_release_date" in fields:
+            print("Last release data: " + self.pypi_pkg["last_release_date"])
+        if "number_versions" in fields:
+            print("Number of versions: " + str(self.pypi_pkg["number_versions"]))
+        if "number_releases_past_year" in fields:
+            print(
+                "Number releases past year: "
+                + str(self.pypi_pkg["number_releases_past_year"])
+            )
+        if "home_page" in fields:
+            print("Home page: " + self.pypi_pkg["home_page"])
+        if "github_page" in fields:
+            print("Github link: " + self.github_page_data["github_page"])
+        if "author_email" in fields:
+            print("Author email: " + self.pypi_pkg["author_email"])
+        if "author_name" in fields:
+            print("Author name: " + self.pypi_pkg["author_name"])
+        if "pypi_pkg_signed" in fields:
+            print("Latest release signed: " + str(self.pypi_pkg["pypi_pkg_signed"]))
+        if "maintainers_list" in fields:
+            print("Maintainer usernames: ", end="")
+            for maintainer in self.pypi_pkg["maintainers_list"]:
+                print(maintainer, end=" ")
+            print()
+        if "similar_names" in fields:
+            print("Similar popular package names: ", end="")
+            for name in self.typosquat["similar_names"]:
+                print(name, end=" ")
+            print()
+        if "maintainers_account_creation_date" in fields:
+            print("Maintainer accounts creation dates: ", end="")
+            for date in self.pypi_profiles["maintainers_account_creation_date"]:
+                print(date, end=" ")
+            print()
+        if "number_of_packages_maintained_by_maintainers" in fields:
+            print("Number of packagages maintained by maintainers: ", end=" ")
+            for num in self.pypi_profiles[
+                "number_of_packages_maintained_by_maintainers"
+            ]:
+                print(num, end=" ")
+            print()
+        if "github_stars" in fields:
+            print("Github stars: " + str(self.github_page_data["github_stars"]))
+        if "source_correspondence" in fields:
+            correspondence = self.github_page_data["source_correspondence"]
+            if correspondence is None:
+                print("Github source correspondence: no github repo or release file")
+            elif correspondence["tag"] is None:
+                print("Github source correspondence: no tag for this release")
+            else:
+                print(
+                    "Release files added or changed from github tag "
+                    + correspondence["tag"]
+                    + ":",
+                    len(correspondence["added"]),
+                    "added,",
+                    len(correspondence["changed"]),
+                    "changed, of",
+                    correspondence["release_files"],
+                )
+            if correspondence and correspondence["tag"] and verbosity >= 2:
+                for status in ("added", "changed"):
+                    for path in correspondence[status]:
+                        print(status + ": " + path)
+        if "downloads" in fields:
+            print(
+                "Number of PyPI downloads in past month:",
+                str(self.downloads["data"]["last_month"]),
+            )
+        if "bandit" in fields:
             print(
                 "Bandit vulnerabilities count (including #nosec): ",
                 str(self.static_analysis["bandit"]["count_all"]),
             )
+        if "ast_checks" in fields:
+            ast_checks = self.static_analysis["ast_checks"]
+            print(
+                "Obfuscation and risky behavior findings (high severity): ",
+                str(ast_checks["count_all"]),
+                "(" + str(ast_checks["count_high"]) + ")",
+            )
+            print("Max McCabe complexity: ", str(ast_checks["mccabe"]["max"]))
+        if "pylint" in fields:
             print(
                 "Pylint average lint score: ",
                 str(self.static_analysis["pylint"]["average_lint_score"]),
             )
-        if verbosity >= 2:
+        if "download" in fields:
+            download = self.static_analysis["download"]
+            print(
+                "Release file bytes fetched: ",
+                str(download["bytes_fetched"]),
+                "of",
+                str(download["artifact_bytes"]),
+                "("
+                + str(download["bytes_saved"])
+                + " saved, "
+                + download["method"]
+                + ")",
+            )
+        if "bandit" in fields and verbosity >= 2:
             print(
                 "Bandit high severity vulnerabilities count (including #nosec): ",
                 str(self.static_analysis["bandit"]["count_high"]),
@@ -145,6 +455,11 @@ class Package:
                 "Bandit low severity vulnerabilities count (including #nosec): ",
                 str(self.static_analysis["bandit"]["count_low"]),
             )
+        if "ast_checks" in fields and verbosity >= 2:
+            for finding in self.static_analysis["ast_checks"]["findings"]:
+                print(
+                    "{severity} {detector}: {file}:{line}: {message}".format(**finding)
+                )
 
 
 if __name__ == "__main__":
@@ -158,8 +473,259 @@ if __name__ == "__main__":
         default=0,
         help="Increase verbosity and perform static analysis.",
     )
-    parser.add_argument("package_name", type=str, help="Input package name")
+    parser.add_argument(
+        "--sequential",
+        action="store_true",
+        help="Run network requests one at a time instead of concurrently.",
+    )
+    parser.add_argument(
+        "-r",
+        "--requirement",
+        help="Scan every package in a requirements file or list of names "
+        "('-' reads stdin).",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=8,
+        help="Number of packages to scan at the same time with -r or --deps.",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=None,
+        help="Seconds to wait on each HTTP connect and read.",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Don't read or write the on-disk HTTP response and analysis caches.",
+    )
+    parser.add_argument(
+        "--cache-stats",
+        action="store_true",
+        help="Print HTTP cache hits, misses and revalidations at the end.",
+    )
+    parser.add_argument(
+        "--fields",
+        help="Comma-separated fields to print instead of the defaults: "
+        + ", ".join(FIELDS),
+    )
+    parser.add_argument(
+        "--mirror",
+        help="Base URL of a PyPI mirror to read PyPI metadata and pages from. "
+        "pip reads PIP_INDEX_URL for downloads.",
+    )
+    parser.add_argument(
+        "--snapshot",
+        help="Read every document from a snapshot directory, not the network.",
+    )
+    parser.add_argument(
+        "--record-snapshot",
+        help="Save every fetched document to a snapshot directory.",
+    )
+    parser.add_argument(
+        "--keep-raw",
+        action="store_true",
+        help="Keep fetched PyPI JSON, profile pages and github data on each "
+        "package for debugging, instead of only the fields derived from them.",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Print the time spent in each stage, request and analysis step, "
+        "with percentiles over every package.",
+    )
+    parser.add_argument(
+        "--trace",
+        help="Write the same spans to a Chrome trace JSON file, for "
+        "chrome://tracing or Perfetto.",
+    )
+    parser.add_argument(
+        "--deps",
+        action="store_true",
+        help="Also scan every package the package depends on, directly or "
+        "not, and print counts over the whole tree.",
+    )
+    parser.add_argument(
+        "--max-depth",
+        type=int,
+        default=None,
+        help="With --deps, don't follow dependencies deeper than this.",
+    )
+    parser.add_argument(
+        "--python-version",
+        help="With --deps, evaluate dependency markers for this Python "
+        "version instead of the running one, e.g. 3.8.",
+    )
+    parser.add_argument(
+        "--platform",
+        help="With --deps, evaluate dependency markers for this sys.platform, "
+        "e.g. linux, darwin or win32.",
+    )
+    parser.add_argument(
+        "--risk",
+        action="store_true",
+        help="Score each package's risk from its fields, with the terms "
+        "adding most to the score.",
+    )
+    parser.add_argument(
+        "--risk-model",
+        help="Score risk with the weights and rules in this JSON file "
+        "instead of the defaults. Implies --risk.",
+    )
+    parser.add_argument(
+        "--save-features",
+        help="With --risk, save the scored feature matrix to this .npz file "
+        "for risk_score.py to score again.",
+    )
+    parser.add_argument(
+        "--store",
+        nargs="?",
+        const="",
+        help="Save each scan as a snapshot in this SQLite file, or in "
+        "PKGSCAN_STORE if none is given.",
+    )
+    parser.add_argument(
+        "--rescan",
+        action="store_true",
+        help="With --store, only scan packages changed on PyPI since their "
+        "last snapshot.",
+    )
+    parser.add_argument(
+        "--max-age",
+        type=float,
+        help="With --rescan, also scan packages whose last snapshot is older "
+        "than this many days.",
+    )
+    parser.add_argument(
+        "package_name",
+        type=str,
+        nargs="?",
+        help="Input package name, optionally pinned as name==version",
+    )
     args = parser.parse_args()
 
-    package = Package(args.package_name, args.verbosity)
-    package.print(args.verbosity)
+    fields = None
+    if args.fields:
+        fields = [field.strip() for field in args.fields.split(",")]
+        unknown_fields = [field for field in fields if field not in FIELDS]
+        if unknown_fields:
+            parser.error("unknown fields: " + ", ".join(unknown_fields))
+    # Options the batch, store and dependency tree scans can't honour
+    if args.sequential and (args.requirement or args.deps or args.store is not None):
+        parser.error("--sequential only applies to scanning a single package")
+    if args.deps and args.store is not None:
+        parser.error("--deps trees can't be saved with --store")
+    if args.deps and (args.risk or args.risk_model):
+        parser.error("--risk can't score a --deps tree")
+
+    if args.timeout:
+        http_client.TIMEOUT = args.timeout
+    if args.profile or args.trace:
+        profiling.enabled = True
+    if args.no_cache:
+        http_cache.enabled = False
+        analysis_cache.enabled = False
+    if args.snapshot:
+        backends.set_backend(backends.SnapshotBackend(args.snapshot))
+    elif args.mirror:
+        backends.set_backend(backends.MirrorBackend(args.mirror))
+    if args.record_snapshot:
+        backends.set_backend(
+            backends.RecordingBackend(backends.get_backend(), args.record_snapshot)
+        )
+
+    risk_model = None
+    if args.risk or args.risk_model:
+        # Imported here so scans without --risk don't load NumPy
+        from risk_score import RiskModel
+
+        risk_model = RiskModel()
+        if args.risk_model:
+            risk_model = RiskModel.from_file(args.risk_model)
+
+    if args.store is not None and (args.requirement or args.package_name):
+        # Imported here because batch itself imports Package from main
+        from batch import print_stored_batch, read_package_names
+        from result_store import ResultStore
+
+        if args.requirement:
+            pkg_names = read_package_names(args.requirement)
+        else:
+            pkg_names = [args.package_name]
+        with ResultStore(args.store or None) as result_store:
+            print_stored_batch(
+                result_store,
+                pkg_names,
+                args.verbosity,
+                args.jobs,
+                fields,
+                args.rescan,
+                None if args.max_age is None else args.max_age * 86400,
+                args.keep_raw,
+                risk_model,
+                args.save_features,
+            )
+    elif args.requirement:
+        # Imported here because batch itself imports Package from main
+        from batch import print_batch, read_package_names
+
+        print_batch(
+            read_package_names(args.requirement),
+            args.verbosity,
+            args.jobs,
+            fields,
+            args.keep_raw,
+            risk_model,
+            args.save_features,
+        )
+    elif args.package_name and args.deps:
+        # Imported here because dependency_tree imports Package from main
+        from dependency_tree import scan_dependency_tree, target_environment
+
+        pkg_name, version = split_version_pin(args.package_name)
+        scan_dependency_tree(
+            pkg_name,
+            version,
+            verbosity=args.verbosity,
+            fields=fields,
+            max_workers=args.jobs,
+            environment=target_environment(args.python_version, args.platform),
+            max_depth=args.max_depth,
+            keep_raw=args.keep_raw,
+        ).print()
+    elif args.package_name:
+        pkg_name, version = split_version_pin(args.package_name)
+        package = Package(
+            pkg_name, args.verbosity, not args.sequential, args.keep_raw, version
+        )
+        package.print(args.verbosity, fields)
+        if risk_model is not None:
+            from batch import print_risk_scores
+            from risk_score import RISK_FIELDS
+
+            print()
+            print_risk_scores(
+                [
+                    (
+                        args.package_name,
+                        package.field_values(
+                            (fields or fields_for_verbosity(args.verbosity))
+                            + RISK_FIELDS
+                        ),
+                    )
+                ],
+                risk_model,
+                args.save_features,
+            )
+    else:
+        parser.error("a package name or --requirement file is required")
+
+    if args.cache_stats:
+        print(http_cache.format_stats())
+    if args.profile:
+        print(profiling.format_summary())
+    if args.trace:
+        profiling.write_chrome_trace(args.trace)
@@ -0,0 +1,150 @@
+"""Scheduler to run dependent data-collection stages concurrently"""
+
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+import functools
+import threading
+
+# Default number of threads used to run independent stages at the same time
+MAX_WORKERS = 8
+
+# Futures of calls shared between scans, keyed on function and arguments.
+# None means sharing is switched off, which is the default for one scan.
+_shared_futures = None
+_shared_lock = threading.Lock()
+
+
+def order_stages(stages, targets=None):
+    """Return stage names in an order where dependencies come first
+
+    stages maps each stage name to a (function, dependency names) tuple.
+    If targets is given, only those stages and their dependencies are
+    returned.
+    """
+    ordered = []
+    visiting = set()
+
+    def visit(name):
+        if name in ordered:
+            return
+        if name not in stages:
+            raise ValueError("Unknown stage: " + name)
+        if name in visiting:
+            raise ValueError("Dependency cycle at stage: " + name)
+        visiting.add(name)
+        for dependency in stages[name][1]:
+            visit(dependency)
+        visiting.remove(name)
+        ordered.append(name)
+
+    for name in stages if targets is None else targets:
+        visit(name)
+    return ordered
+
+
+def run_stages(
+    stages, concurrent=True, max_workers=MAX_WORKERS, targets=None, results=None
+):
+    """Run every stage once its dependencies finish and return all results
+
+    Each stage function is called with the results of its dependencies as
+    positional arguments, in the order they are listed. With concurrent set
+    to False the stages run one after another in dependency order, which
+    gives the same results and can be used to compare stage by stage.
+    targets limits the run to those stages and what they need, and stages
+    already present in results are reused instead of run again.
+    """
+    # Validate the graph up front so a cycle can't hang the scheduler
+    results = dict(results or {})
+    ordered = [name for name in order_stages(stages, targets) if name not in results]
+
+    if not concurrent:
+        for name in ordered:
+            function, dependencies = stages[name]
+            results[name] = function(*[results[dep] for dep in dependencies])
+        return results
+
+    pending = {name: stages[name] for name in ordered}
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            # Start every stage whose dependencies have all finished
+            for name in list(pending):
+                function, dependencies = pending[name]
+                if all(dep in results for dep in dependencies):
+                    del pending[name]
+                    args = [results[dep] for dep in dependencies]
+                    running[executor.submit(function, *args)] = name
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                # result() re-raises any error from the stage, including
+                # the sys.exit() used when a package is not on PyPI
+                results[running.pop(future)] = future.result()
+
+    return results
+
+
+class LazySection(dict):
+    """Dict whose values are computed on first access and then kept
+
+    loaders maps each key to a function returning its value. Keys that
+    have not been read yet are absent, so "in" and iteration only show
+    what has been computed so far.
+    """
+
+    def __init__(self, loaders):
+        super().__init__()
+        self.loaders = loaders
+
+    def __missing__(self, key):
+        if key not in self.loaders:
+            raise KeyError(key)
+        value = self.loaders[key]()
+        self[key] = value
+        return value
+
+
+@contextmanager
+def shared_calls():
+    """Within this block, identical shared() calls run once and share a result"""
+    global _shared_futures  # pylint: disable=global-statement
+    with _shared_lock:
+        _shared_futures = {}
+    try:
+        yield
+    finally:
+        with _shared_lock:
+            _shared_futures = None
+
+
+def shared(function):
+    """Decorate a fetch function so concurrent scans can share its results
+
+    Outside a shared_calls() block the function runs normally. Inside one,
+    the first call with some arguments does the work and every other call
+    with the same arguments, including ones already waiting in another
+    thread, gets the same result.
+    """
+
+    @functools.wraps(function)
+    def wrapper(*args):
+        with _shared_lock:
+            if _shared_futures is None:
+                future = None
+                owner = False
+            else:
+                key = (function.__qualname__, args)
+                future = _shared_futures.get(key)
+                owner = future is None
+                if owner:
+                    future = _shared_futures[key] = Future()
+        if future is None:
+            return function(*args)
+        if owner:
+            try:
+                future.set_result(function(*args))
+            except BaseException as error:  # pylint: disable=broad-except
+                future.set_exception(error)
+        return future.result()
+
+    return wrapper
@@ -0,0 +1,167 @@
+"""Record where a scan spends its time, as spans of named work
+
+Stages, HTTP requests, snapshot reads and static analysis steps each
+record a span with their duration and details such as bytes, HTTP
+status and cache status. Nothing is recorded unless enabled is set.
+The spans can be summarized per name with percentiles, which gives
+per-stage figures over every package of a batch, or written as a Chrome
+trace to open in chrome://tracing or Perfetto.
+
+    $ python main.py --profile --trace trace.json requests
+"""
+
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+
+# Whether spans are recorded at all
+enabled = False
+
+# Every finished span as a dict, in the order they ended
+spans = []
+_lock = threading.Lock()
+
+
+@contextmanager
+def span(name, category, **details):
+    """Record the time spent in a block as a span
+
+    The block can add details to the yielded dict, such as the status
+    of a response it got.
+    """
+    if not enabled:
+        yield details
+        return
+    start = time.perf_counter()
+    try:
+        yield details
+    finally:
+        end = time.perf_counter()
+        record = {
+            "name": name,
+            "category": category,
+            "start": start,
+            "seconds": end - start,
+            "thread": threading.get_ident(),
+            "details": details,
+        }
+        with _lock:
+            spans.append(record)
+
+
+def timed(name, category, function, **details):
+    """Wrap a function so each call is recorded as a span"""
+
+    def run(*args):
+        with span(name, category, **details):
+            return function(*args)
+
+    return run
+
+
+def reset():
+    """Forget every span recorded so far"""
+    with _lock:
+        del spans[:]
+
+
+def take():
+    """Return every span recorded so far and forget them
+
+    Worker processes hand their spans back to the parent this way, which
+    adds them with extend().
+    """
+    with _lock:
+        records = list(spans)
+        del spans[:]
+    return records
+
+
+def extend(records):
+    """Add spans recorded elsewhere, such as in a worker process"""
+    with _lock:
+        spans.extend(records)
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of a sorted list"""
+    position = max(0, min(len(sorted_values) - 1, int(fraction * len(sorted_values))))
+    return sorted_values[position]
+
+
+def summarize(category=None):
+    """Count, total and percentiles of each (category, name) of span
+
+    Durations are in seconds. bytes sums the bytes of spans that
+    transferred any.
+    """
+    with _lock:
+        records = list(spans)
+    groups = {}
+    for record in records:
+        if category is None or record["category"] == category:
+            key = (record["category"], record["name"])
+            groups.setdefault(key, []).append(record)
+    summary = {}
+    for key, group in groups.items():
+        durations = sorted(record["seconds"] for record in group)
+        summary[key] = {
+            "count": len(durations),
+            "total": sum(durations),
+            "p50": percentile(durations, 0.5),
+            "p90": percentile(durations, 0.9),
+            "p99": percentile(durations, 0.99),
+            "max": durations[-1],
+            "bytes": sum(record["details"].get("bytes") or 0 for record in group),
+        }
+    return summary
+
+
+def format_summary():
+    """Summarize every span name as a table, slowest total first"""
+    summary = summarize()
+    lines = [
+        "{:<30} {:>6} {:>9} {:>9} {:>9} {:>9} {:>9} {:>10}".format(
+            "Span", "count", "total s", "p50 ms", "p90 ms", "p99 ms", "max ms", "MB"
+        )
+    ]
+    for (category, name), stats in sorted(
+        summary.items(), key=lambda item: -item[1]["total"]
+    ):
+        lines.append(
+            "{:<30} {:>6} {:>9.2f} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f} {:>10.2f}".format(
+                (category + ":" + name)[:30],
+                stats["count"],
+                stats["total"],
+                stats["p50"] * 1000,
+                stats["p90"] * 1000,
+                stats["p99"] * 1000,
+                stats["max"] * 1000,
+                stats["bytes"] / 1e6,
+            )
+        )
+    return "\n".join(lines)
+
+
+def write_chrome_trace(path):
+    """Write every span as complete events in the Chrome trace format"""
+    with _lock:
+        records = list(spans)
+    origin = min((record["start"] for record in records), default=0)
+    events = [
+        {
+            "name": record["name"],
+            "cat": record["category"],
+            "ph": "X",
+            "ts": (record["start"] - origin) * 1e6,
+            "dur": record["seconds"] * 1e6,
+            "pid": os.getpid(),
+            "tid": record["thread"],
+            "args": record["details"],
+        }
+        for record in records
+    ]
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, default=str)
@@ -1,141 +1,357 @@
 """Functions related to gathering data about a particular package on PyPI"""
-from datetime import datetime, timedelta
-import json
+
+from array import array
+from bisect import bisect_right
+from datetime import datetime, timedelta, timezone
 import sys
 
-from bs4 import BeautifulSoup
 from packaging import version
-import requests
+from packaging.requirements import InvalidRequirement, Requirement
+from packaging.utils import (
+    InvalidSdistFilename,
+    InvalidWheelFilename,
+    parse_sdist_filename,
+    parse_wheel_filename,
+)
+
+from backends import get_backend
+from html_extract import extract_maintainers
+from pipeline import shared
+import profiling
+from pypi_stream import reduce_url_files, summarize_pypi_json
 
 
 def get_author_email(pypi_pkg):
     """Retrieve author email"""
-    author_email = pypi_pkg["pypi_data"]["info"]["author_email"]
+    author_email = pypi_pkg["pypi_record"].author_email
     return author_email
 
 
 def get_author_name(pypi_pkg):
     """Get author's name"""
-    author_name = pypi_pkg["pypi_data"]["info"]["author"]
+    author_name = pypi_pkg["pypi_record"].author_name
     return author_name
 
 
+# Release date of a package none of whose releases has files
+NO_RELEASE_FILES = "No release files found"
+
+
 def get_first_release_date(pypi_pkg):
     """Retrieve date of first release"""
-    sorted_version_list = get_sorted_version_list(pypi_pkg)
+    release_index = get_release_index(pypi_pkg)
     # Because some versions lack any info, i.e. are empty, skip those
-    # and save the version number of the first non-empty version
-    for pkg_version in sorted_version_list:
-        if pypi_pkg["pypi_data"]["releases"][pkg_version] != []:
-            first_release_version = pkg_version
-            break
-    # Extract upload time
-    upload_time = pypi_pkg["pypi_data"]["releases"][first_release_version][0][
-        "upload_time"
-    ]
-    # Extract the date
-    first_release_date = upload_time[:10]
-    return first_release_date
+    # and use the first non-empty version
+    first_release = release_index.first_nonempty()
+    if first_release is None:
+        return NO_RELEASE_FILES
+    return release_index.upload_date(first_release)
 
 
 def get_home_page(pypi_pkg):
     """Retrieve home page link"""
-    home_page = pypi_pkg["pypi_data"]["info"]["home_page"]
+    home_page = pypi_pkg["pypi_record"].home_page
     return home_page
 
 
 def get_last_release_date(pypi_pkg):
     """Retrieve date of last release"""
-    sorted_version_list = get_sorted_version_list(pypi_pkg)
-    last_release_version = sorted_version_list[-1]
-    # Extract upload time
-    upload_time = pypi_pkg["pypi_data"]["releases"][last_release_version][0][
-        "upload_time"
-    ]
-    last_release_date = upload_time[:10]
-    return last_release_date
+    release_index = get_release_index(pypi_pkg)
+    last_release = release_index.last_nonempty()
+    if last_release is None:
+        return NO_RELEASE_FILES
+    return release_index.upload_date(last_release)
 
 
 def get_number_releases_past_year(pypi_pkg):
-    """Retrieve mean time between releases over past two years"""
-    sorted_version_list = get_sorted_version_list(pypi_pkg)
-    # Determine current and date one year ago
-    today = datetime.now()
-    one_year_ago = today - timedelta(days=365)
-
-    num_versions_within_last_year = 0
-    # Loop thru versions in reverse order
-    sorted_version_list.reverse()
-    for pkg_version in sorted_version_list:
-        # Retrieve version date
-        try:
-            upload_time = pypi_pkg["pypi_data"]["releases"][pkg_version][0][
-                "upload_time"
-            ]
-        except IndexError:
-            upload_time = "2010-11-04T00:05:23"
-        # Convert version date to datetime object
-        upload_datetime = datetime.fromisoformat(upload_time)
-        # Check if version date is within past year
-        if upload_datetime > one_year_ago:
-            num_versions_within_last_year += 1
-        else:
-            break
-
-    return num_versions_within_last_year
+    """Count releases uploaded within the past year"""
+    release_index = get_release_index(pypi_pkg)
+    one_year_ago = datetime.now(timezone.utc) - timedelta(days=365)
+    return release_index.count_uploaded_since(one_year_ago.timestamp())
 
 
 def get_number_versions(pypi_pkg):
     """Count number of versions released"""
-    version_list = list(pypi_pkg["pypi_data"]["releases"])
-    num_versions = len(version_list)
+    num_versions = len(get_release_index(pypi_pkg).versions)
     return num_versions
 
 
-def get_pypi_data(pkg_name):
-    """Retrieve metadata from PyPI json endpoint"""
+def get_pypi_data(pkg_name, pkg_version=None, summary=False):
+    """Retrieve metadata from PyPI json endpoint
+
+    With pkg_version, the metadata and files of that release only. With
+    summary, the document is parsed as it is downloaded and only the
+    fields pkgscan reads are kept, see pypi_stream.
+    """
+    backend = get_backend()
     try:
-        pkg_url = "https://pypi.org/pypi/" + pkg_name + "/json"
-        response = requests.get(pkg_url)
-        metadata_dict = response.json()
-    except json.decoder.JSONDecodeError:
-        print("ERROR: No such package on PyPI")
+        if summary:
+            with backend.pypi_json_stream(pkg_name, pkg_version) as (
+                status_code,
+                document,
+            ):
+                with profiling.span("pypi json", "parse", stream=True):
+                    metadata_dict = summarize_pypi_json(document)
+        else:
+            response = backend.pypi_json(pkg_name, pkg_version)
+            status_code = response.status_code
+            with profiling.span("pypi json", "parse", bytes=len(response.content)):
+                metadata_dict = response.json()
+    # Invalid JSON, e.g. an HTML error page
+    except ValueError:
+        metadata_dict = None
+    # PyPI answers an unknown version with a JSON 404 message
+    if metadata_dict is None or status_code == 404:
+        if pkg_version is not None:
+            print("ERROR: No such package version on PyPI")
+        else:
+            print("ERROR: No such package on PyPI")
         sys.exit(1)
 
     return metadata_dict
 
 
+def filename_version(filename):
+    """Version of a wheel or sdist from its file name, or None"""
+    try:
+        if filename.endswith(".whl"):
+            return str(parse_wheel_filename(filename)[1])
+        return str(parse_sdist_filename(filename)[1])
+    except (InvalidSdistFilename, InvalidWheelFilename, version.InvalidVersion):
+        return None
+
+
+def normalize_version(version_string):
+    """PEP 440 spelling of a version, so index and file names agree"""
+    try:
+        return str(version.Version(version_string))
+    except version.InvalidVersion:
+        return version_string
+
+
+@shared
+def get_release_history(pkg_name):
+    """Releases and upload times from the simple JSON API, or None
+
+    The result has the shape of the "releases" of the PyPI JSON, with
+    only the upload time and yanked flag of each file. The simple index
+    lists files without the per-release metadata, so it is much smaller
+    than the full JSON of a package with a long history. None is
+    returned if the index doesn't offer JSON. Within shared_calls(), each
+    package's index is fetched once, e.g. to pick a dependency's version
+    and then scan it.
+    """
+    response = get_backend().simple_index(pkg_name)
+    if not response.ok:
+        return None
+    try:
+        index = response.json()
+    except ValueError:
+        return None
+    releases = {
+        normalize_version(pkg_version): [] for pkg_version in index.get("versions", [])
+    }
+    for release_file in index.get("files", []):
+        pkg_version = filename_version(release_file["filename"])
+        if pkg_version is None or not release_file.get("upload-time"):
+            continue
+        releases.setdefault(pkg_version, []).append(
+            {
+                "upload_time": release_file["upload-time"],
+                "yanked": bool(release_file.get("yanked")),
+            }
+        )
+    for files in releases.values():
+        files.sort(key=lambda release_file: release_file["upload_time"])
+    return releases
+
+
+def get_pypi_record(pkg_name, keep_raw=False, pkg_version=None):
+    """Retrieve a package's PyPI metadata as a compact PypiRecord
+
+    A pinned scan reads that release's metadata from the per-version
+    JSON and the release history from the simple index, falling back to
+    the full JSON if the index has no JSON form.
+    """
+    if pkg_version is None:
+        # The whole document is only needed when it is kept
+        return PypiRecord(get_pypi_data(pkg_name, summary=not keep_raw), keep_raw)
+    pypi_data = get_pypi_data(pkg_name, pkg_version)
+    releases = get_release_history(pkg_name)
+    if releases is None:
+        releases = get_pypi_data(pkg_name, summary=True)["releases"]
+    pypi_data["releases"] = releases
+    return PypiRecord(pypi_data, keep_raw, pkg_version)
+
+
+def split_version_pin(requirement):
+    """Split "name==version" into (name, version), version None if unpinned
+
+    Only exact pins select a release. Other specifiers, such as >=, are
+    dropped and the latest release is scanned.
+    """
+    try:
+        parsed = Requirement(requirement)
+    except InvalidRequirement:
+        return requirement, None
+    specifiers = list(parsed.specifier)
+    if len(specifiers) == 1 and specifiers[0].operator in ("==", "==="):
+        if not specifiers[0].version.endswith(".*"):
+            return parsed.name, specifiers[0].version
+    return parsed.name, None
+
+
 def get_pypi_maintainers_list(pkg_name):
     """Retrieve list of PyPI maintainers via web scraping"""
     # Scrape regular PyPI package site
-    url = "https://pypi.org/project/" + pkg_name
-    html = requests.get(url)
-    soup = BeautifulSoup(html.content, "html.parser")
-    elements = soup.findAll("span", {"class": "sidebar-section__user-gravatar-text"})
-    # Strip white space from all elements
-    maintainers_full_list = [elem.string.strip() for elem in elements]
+    html = get_backend().project_page(pkg_name)
+    # Read only the sidebar username spans, already stripped of white space
+    maintainers_full_list = extract_maintainers(html.content)
     # Remove duplicates via set, then sort a list of maintainers
     maintainers_list = sorted(list(set(maintainers_full_list)))
     return maintainers_list
 
 
 def is_pypi_pkg_signed(pypi_pkg):
-    """Check if latest version of package is signed"""
-    sorted_version_list = get_sorted_version_list(pypi_pkg)
-    last_release_version = sorted_version_list[-1]
-    # Extract whether there is a signature
-    is_signed = pypi_pkg["pypi_data"]["releases"][last_release_version][0]["has_sig"]
-    return is_signed
+    """Check if latest version of package, or the pinned one, is signed"""
+    pypi_record = pypi_pkg["pypi_record"]
+    if pypi_record.version is not None:
+        return bool(pypi_record.urls) and bool(pypi_record.urls[0].get("has_sig"))
+    release_index = get_release_index(pypi_pkg)
+    last_release = release_index.last_nonempty()
+    return last_release is not None and bool(release_index.signed[last_release])
+
+
+def version_sort_key(version_string):
+    """Sort key ordering versions semantically, legacy versions first"""
+    # Versions that don't follow PEP 440 sort before all others, as they
+    # did with the LegacyVersion class of older packaging releases
+    try:
+        return (1, version.Version(version_string))
+    except version.InvalidVersion:
+        return (0, version_string)
 
 
 def sort_semantic_version(unsorted_list):
     """Sort a list of semantic version numbers"""
-    sorted_list = sorted(unsorted_list, key=lambda x: version.Version(x))
+    sorted_list = sorted(unsorted_list, key=version_sort_key)
     return sorted_list
 
 
 def get_sorted_version_list(pypi_pkg):
     """Create list of package versions sorted"""
-    version_list = list(pypi_pkg["pypi_data"]["releases"])
-    sorted_version_list = sort_semantic_version(version_list)
-    return sorted_version_list
+    return list(get_release_index(pypi_pkg).versions)
+
+
+def parse_upload_time(upload_time):
+    """Convert a PyPI upload_time string, which is in UTC, to an epoch"""
+    upload_datetime = datetime.fromisoformat(upload_time[:19])
+    return upload_datetime.replace(tzinfo=timezone.utc).timestamp()
+
+
+class ReleaseIndex:
+    """Releases of one package sorted by version, built once per package
+
+    Position i of each array describes versions[i]. upload_times holds
+    the upload time of the first file of each release as an epoch, or
+    NaN for releases without files. sorted_upload_times holds the same
+    times without the NaNs in ascending order for binary search.
+    """
+
+    __slots__ = (
+        "versions",
+        "upload_times",
+        "sorted_upload_times",
+        "empty",
+        "yanked",
+        "signed",
+    )
+
+    def __init__(self, releases):
+        self.versions = sort_semantic_version(releases)
+        self.upload_times = array("d")
+        self.empty = bytearray()
+        self.yanked = bytearray()
+        self.signed = bytearray()
+        for pkg_version in self.versions:
+            files = releases[pkg_version]
+            if files:
+                self.upload_times.append(parse_upload_time(files[0]["upload_time"]))
+            else:
+                self.upload_times.append(float("nan"))
+            self.empty.append(not files)
+            # A release is yanked when every one of its files is
+            self.yanked.append(bool(files) and all(f.get("yanked") for f in files))
+            # PyPI no longer reports signatures, so a missing key is unsigned
+            self.signed.append(bool(files) and bool(files[0].get("has_sig")))
+        self.sorted_upload_times = array(
+            "d", sorted(t for t in self.upload_times if t == t)
+        )
+
+    def first_nonempty(self):
+        """Position of the lowest version that has files, or None"""
+        position = self.empty.find(0)
+        return None if position < 0 else position
+
+    def last_nonempty(self):
+        """Position of the highest version that has files, or None"""
+        position = self.empty.rfind(0)
+        return None if position < 0 else position
+
+    def upload_date(self, position):
+        """Upload date of a release as YYYY-MM-DD"""
+        upload_datetime = datetime.fromtimestamp(
+            self.upload_times[position], timezone.utc
+        )
+        return upload_datetime.strftime("%Y-%m-%d")
+
+    def count_uploaded_since(self, timestamp):
+        """Count releases uploaded after an epoch timestamp"""
+        return len(self.sorted_upload_times) - bisect_right(
+            self.sorted_upload_times, timestamp
+        )
+
+
+def get_release_index(pypi_pkg):
+    """Return the package's ReleaseIndex"""
+    return pypi_pkg["pypi_record"].release_index
+
+
+class PypiRecord:
+    """The parts of a package's PyPI JSON that pkgscan reads
+
+    The JSON of a package with thousands of releases runs to megabytes,
+    so only these fields are kept. raw holds the whole document when
+    keep_raw is set, for debugging, and is None otherwise. version is the
+    pinned release a scan is about, in which case urls, requires_dist and
+    the author fields describe that release, or None for the latest.
+    """
+
+    __slots__ = (
+        "author_email",
+        "author_name",
+        "home_page",
+        "project_urls",
+        "requires_dist",
+        "release_index",
+        "urls",
+        "release_version",
+        "raw",
+        "version",
+    )
+
+    def __init__(self, pypi_data, keep_raw=False, pkg_version=None):
+        info = pypi_data.get("info", {})
+        self.author_email = info.get("author_email")
+        self.author_name = info.get("author")
+        self.home_page = info.get("home_page")
+        self.project_urls = dict(info.get("project_urls") or {})
+        # Requirement strings, with any environment markers
+        self.requires_dist = list(info.get("requires_dist") or [])
+        self.release_index = ReleaseIndex(pypi_data.get("releases", {}))
+        # Files of the latest release, in the shape of the JSON "urls" list
+        self.urls = reduce_url_files(pypi_data.get("urls", []))
+        # Version of the release urls lists the files of
+        self.release_version = info.get("version")
+        self.raw = pypi_data if keep_raw else None
+        self.version = pkg_version
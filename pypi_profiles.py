@@ -1,17 +1,42 @@
 """Functions related to gathering data about PyPI maintainer profiles"""
 
-from bs4 import BeautifulSoup
-import requests
+from concurrent.futures import ThreadPoolExecutor
 
+from backends import get_backend
+from html_extract import extract_profile
+from pipeline import shared
 
-def get_pypi_maintainers_data(pypi_pkg):
+
+@shared
+def get_pypi_maintainer_data(username, keep_raw=False):
+    """Retrieve metadata from PyPI on one maintainer via web scraping"""
+    html = get_backend().user_page(username)
+    # Keep a small record of the fields used rather than the whole page
+    profile = extract_profile(html.content)
+    if keep_raw:
+        profile = profile._replace(raw=html.content)
+    return profile
+
+
+def get_pypi_maintainers_data(pypi_pkg, max_workers=1, keep_raw=False):
     """Retrieve metadata from PyPI on all maintainers via web scraping"""
-    maintainers_data = []
-    for username in pypi_pkg["maintainers_list"]:
-        url = "https://pypi.org/user/" + username
-        html = requests.get(url)
-        soup = BeautifulSoup(html.content, "html.parser")
-        maintainers_data.append(soup)
+    maintainers_list = pypi_pkg["maintainers_list"]
+    # Profile pages don't depend on each other, so fetch them at the same
+    # time when more than one worker is allowed. map() keeps list order.
+    if max_workers > 1 and len(maintainers_list) > 1:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            maintainers_data = list(
+                executor.map(
+                    get_pypi_maintainer_data,
+                    maintainers_list,
+                    [keep_raw] * len(maintainers_list),
+                )
+            )
+    else:
+        maintainers_data = [
+            get_pypi_maintainer_data(username, keep_raw)
+            for username in maintainers_list
+        ]
 
     return maintainers_data
 
@@ -20,22 +45,10 @@ def get_maintainers_account_creation_date(pypi_profiles):
     """Retrieve dates that maintainers' PyPI accounts were created"""
 
     dates = []
-    # Loop through beautiful soup-ified maintainer data to extract dates
-    for soup in pypi_profiles["maintainers_data"]:
-        # Because 'time' elements will appear in multiple locations on
-        # a PyPI maintainer profile page, filter in only those html
-        # tags associated with author metadata
-        author_metadata_elements = soup.findAll(
-            "div", {"class": "author-profile__metadiv"}
-        )
-        for elem in author_metadata_elements:
-            # Extract any time-related elements and add to dates list
-            # if it exists
-            date = elem.find("time")
-            if date:
-                # The [0] slice is because contents is a list and
-                # strip() is not a valid method for lists
-                dates.append(date.contents[0].strip())
+    # Each profile record holds the dates found in the author metadata
+    # blocks of that profile page
+    for profile in pypi_profiles["maintainers_data"]:
+        dates.extend(profile.account_creation_dates)
 
     return dates
 
@@ -45,16 +58,8 @@ def get_number_of_packages_maintained_by_maintainers(pypi_profiles):
 
     num_packages = []
 
-    # Loop thru beautiful-souped maintainer list
-    for soup in pypi_profiles["maintainers_data"]:
-        package_count_elements = soup.findAll("div", {"class": "left-layout__main"})
-        # Extract count of number of projects maintained for each profile
-        for element in package_count_elements:
-            num_package_element = element.find("h2")
-            # Remove whitespace
-            num_package_element_stripped = num_package_element.contents[0].strip()
-            # Take only number from the number of packages, drop "packages" units
-            num_package = num_package_element_stripped.split(" ")[0]
-            num_packages.append(num_package)
+    # Loop thru maintainer profile records
+    for profile in pypi_profiles["maintainers_data"]:
+        num_packages.extend(profile.package_counts)
 
     return num_packages
@@ -0,0 +1,130 @@
+"""Incremental parsing of large PyPI JSON documents
+
+The JSON of packages like botocore lists every file of thousands of
+releases, but pkgscan reads only a few info fields, each release's
+first upload time and signature flag, whether a release was yanked and
+the latest release's files. summarize_pypi_json() reads the document
+incrementally with ijson and keeps only those, so the dict of every file
+of every release is never built, and the document can be parsed as it
+is downloaded. Without ijson installed, the document is parsed whole
+and then reduced to the same summary.
+"""
+
+import io
+import json
+import mmap
+
+# Fields of the "info" object pkgscan reads
+INFO_KEYS = (
+    "author",
+    "author_email",
+    "home_page",
+    "project_urls",
+    "requires_dist",
+    "version",
+)
+# Fields kept from the first file of each release
+RELEASE_FILE_KEYS = ("upload_time", "has_sig")
+# Fields kept from each of the latest release's files
+URL_FILE_KEYS = ("filename", "url", "packagetype", "yanked", "has_sig", "size")
+
+
+def summarize_pypi_json(data):
+    """Parse a PyPI JSON document into a summary
+
+    data is bytes, a memory map or a binary file, e.g. a response still
+    being downloaded, which is read once. The summary has the shape of
+    the PyPI JSON. Each release lists at most one file, the first, whose
+    "yanked" is true only if every file of the release was yanked. Raises
+    ValueError on invalid JSON.
+    """
+    if isinstance(data, (bytes, bytearray, mmap.mmap)):
+        data = data_stream(data)
+    try:
+        import ijson  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return reduce_pypi_json(json.loads(str(data.read(), "utf-8")))
+    info = None
+    releases = {}
+    # The latest release's files double as the document's "urls" list.
+    # PyPI puts "info" first; until it is read every release's are kept.
+    urls = {}
+    try:
+        # A single pass, so a download never has to be rewound. One
+        # release at a time is built, then reduced and dropped.
+        events = ijson.parse(data, use_float=True)
+        for prefix, event, value in events:
+            if prefix == "info" and event == "start_map":
+                info = build_value(ijson, events, event, value)
+            elif prefix == "releases" and event == "map_key":
+                pkg_version = value
+                _, event, value = next(events)
+                files = build_value(ijson, events, event, value)
+                releases[pkg_version] = reduce_release_files(files)
+                if info is None or pkg_version == info.get("version"):
+                    urls[pkg_version] = reduce_url_files(files)
+    except ijson.JSONError as error:
+        raise ValueError(str(error)) from error
+    info = info or {}
+    return {
+        "info": {key: info[key] for key in INFO_KEYS if key in info},
+        "releases": releases,
+        "urls": urls.get(info.get("version"), []),
+    }
+
+
+def build_value(ijson, events, event, value):
+    """Build the JSON value starting with an ijson event from the rest"""
+    builder = ijson.ObjectBuilder()
+    depth = 0
+    while True:
+        builder.event(event, value)
+        if event in ("start_map", "start_array"):
+            depth += 1
+        elif event in ("end_map", "end_array"):
+            depth -= 1
+        if depth == 0:
+            return builder.value
+        _, event, value = next(events)
+
+
+def data_stream(data):
+    """A stream reading bytes or a memory map from the start, without copying"""
+    if isinstance(data, mmap.mmap):
+        data.seek(0)
+        return data
+    return io.BytesIO(data)
+
+
+def reduce_release_files(files):
+    """Keep the first file of a release, marked yanked if all files were"""
+    if not files:
+        return []
+    first_file = {key: files[0][key] for key in RELEASE_FILE_KEYS if key in files[0]}
+    first_file["yanked"] = all(f.get("yanked") for f in files)
+    return [first_file]
+
+
+def reduce_url_files(files):
+    """Keep the fields of each latest release file used to pick an artifact"""
+    urls = []
+    for release_file in files:
+        kept_file = {
+            key: release_file[key] for key in URL_FILE_KEYS if key in release_file
+        }
+        kept_file["digests"] = {"sha256": release_file["digests"]["sha256"]}
+        urls.append(kept_file)
+    return urls
+
+
+def reduce_pypi_json(pypi_data):
+    """Reduce a fully parsed PyPI JSON document to the same summary"""
+    info = pypi_data.get("info", {})
+    return {
+        "info": {key: info[key] for key in INFO_KEYS if key in info},
+        "releases": {
+            pkg_version: reduce_release_files(files)
+            for pkg_version, files in pypi_data.get("releases", {}).items()
+        },
+        "urls": reduce_url_files(pypi_data.get("urls", [])),
+    }
@@ -0,0 +1,338 @@
+"""Read the Python sources of a release file straight from its URL
+
+A wheel is a zip, whose central directory at the end of the file lists
+where each member starts. RemoteFile reads the end with one HTTP range
+request, then only the byte ranges of the .py files and RECORD, so the
+rest of the wheel, such as compiled extensions and data files, is never
+downloaded. Servers that ignore ranges, and sdists, which are compressed
+as one stream, are downloaded whole through the shared HTTP client
+instead, with no pip subprocess.
+
+A wheel's sha256 digest can't be checked without reading all of it. Each
+member read by range is checked against its zip CRC-32 and against the
+sha256 listed in the wheel's RECORD instead.
+"""
+
+import base64
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import hashlib
+import io
+import os
+import sys
+import threading
+from urllib.parse import unquote, urlsplit
+import zipfile
+
+from artifact import ArchiveLimitError, is_python_source, iter_zip_member_chunks
+import http_client
+import profiling
+
+# Bytes read from the end of a wheel first. This holds the end of central
+# directory record and, for all but the largest wheels, the directory.
+TAIL_SIZE = 64 * 1024
+
+# Bytes read at a time for reads not covered by a planned range
+READ_AHEAD = 64 * 1024
+
+# Member ranges closer than this are fetched in one request, and the gap
+# is doubled until at most MAX_RANGE_REQUESTS requests remain
+MERGE_GAP = 16 * 1024
+MAX_RANGE_REQUESTS = 32
+
+# Range requests sent at once for one wheel
+RANGE_WORKERS = 4
+
+
+class RangesNotSupported(Exception):
+    """The server answered a range request with the whole file
+
+    response holds that answer, so the file needn't be fetched again.
+    """
+
+    def __init__(self, response):
+        super().__init__("server ignored the range request")
+        self.response = response
+
+
+class ArtifactIntegrityError(ValueError):
+    """A release file or member does not match its published digest"""
+
+
+class RemoteFile(io.RawIOBase):
+    """Seekable read-only file whose bytes are fetched by range requests
+
+    Fetched ranges are kept in memory, so zipfile can seek around the
+    file freely while each byte is requested at most once.
+    """
+
+    def __init__(self, url):
+        super().__init__()
+        self.url = url
+        self.position = 0
+        self.segments = {}
+        self.requests = 0
+        self.bytes_fetched = 0
+        self.size = None
+        self.lock = threading.Lock()
+        self.fetch("bytes=-" + str(TAIL_SIZE))
+
+    def fetch(self, byte_range):
+        """Request a range, keep its bytes and learn the file's size"""
+        response = http_client.get(self.url, headers={"Range": byte_range})
+        with self.lock:
+            self.requests += 1
+        if response.status_code == 200:
+            raise RangesNotSupported(response)
+        if response.status_code != 206:
+            response.raise_for_status()
+            raise OSError("unexpected status {}".format(response.status_code))
+        # Content-Range: bytes <first>-<last>/<size>
+        unit_range, _, size = response.headers["Content-Range"].partition("/")
+        first = int(unit_range.split()[-1].split("-")[0])
+        with self.lock:
+            self.size = int(size)
+            self.segments[first] = response.content
+            self.bytes_fetched += len(response.content)
+
+    def missing(self, start, end):
+        """Trim a range by the bytes already held at either end of it"""
+        for first, data in sorted(self.segments.items()):
+            last = first + len(data)
+            if first <= start < last:
+                start = last
+            if first < end <= last:
+                end = first
+        return start, end
+
+    def fetch_ranges(self, ranges):
+        """Fetch (start, end) ranges, end exclusive, a few at a time"""
+        byte_ranges = []
+        for start, end in ranges:
+            start, end = self.missing(start, end)
+            if start < end:
+                byte_ranges.append("bytes={}-{}".format(start, end - 1))
+        with ThreadPoolExecutor(max_workers=RANGE_WORKERS) as executor:
+            for _ in executor.map(self.fetch, byte_ranges):
+                pass
+
+    def read_at(self, position, length):
+        """Bytes from position on, fetching those not held yet"""
+        end = min(position + length, self.size)
+        chunks = []
+        while position < end:
+            for start, data in self.segments.items():
+                if start <= position < start + len(data):
+                    chunk = data[position - start : end - start]
+                    break
+            else:
+                # Fetch up to the next held segment, at least READ_AHEAD
+                following = [start for start in self.segments if start > position]
+                fetch_end = min(
+                    [max(end, position + READ_AHEAD), self.size] + following
+                )
+                self.fetch("bytes={}-{}".format(position, fetch_end - 1))
+                continue
+            chunks.append(chunk)
+            position += len(chunk)
+        return b"".join(chunks)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.position = max(0, offset)
+        return self.position
+
+    def readinto(self, buffer):
+        data = self.read_at(self.position, len(buffer))
+        buffer[: len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+
+def member_ranges(archive, wanted):
+    """Merged (start, end) byte ranges holding every wanted member
+
+    A member runs from its local header to the next member's, or to the
+    central directory for the last one.
+    """
+    infos = sorted(archive.infolist(), key=lambda info: info.header_offset)
+    ends = [info.header_offset for info in infos[1:]] + [archive.start_dir]
+    ranges = [
+        (info.header_offset, end)
+        for info, end in zip(infos, ends)
+        if not info.is_dir() and wanted(info.filename)
+    ]
+    gap = MERGE_GAP
+    while True:
+        merged = []
+        for start, end in ranges:
+            if merged and start - merged[-1][1] <= gap:
+                merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+            else:
+                merged.append((start, end))
+        if len(merged) <= MAX_RANGE_REQUESTS:
+            return merged
+        gap *= 2
+
+
+def is_record(name):
+    """Check whether a wheel member is its .dist-info/RECORD"""
+    parts = name.split("/")
+    return len(parts) == 2 and parts[0].endswith(".dist-info") and parts[1] == "RECORD"
+
+
+def is_wanted_member(name):
+    """Check whether a wheel member is read for static analysis"""
+    return is_python_source(name) or is_record(name)
+
+
+def record_hashes(record):
+    """Map each path listed in a wheel's RECORD to its sha256 digest"""
+    hashes = {}
+    lines = record.decode("utf-8", errors="replace").splitlines()
+    for row in csv.reader(lines):
+        if len(row) >= 2 and row[1].startswith("sha256="):
+            hashes[row[0]] = row[1][len("sha256=") :]
+        # Other algorithms, and unhashed files like RECORD, aren't checked
+    return hashes
+
+
+def check_record(sources, record):
+    """Raise ArtifactIntegrityError unless sources match RECORD's digests"""
+    hashes = record_hashes(record)
+    for name, data in sources.items():
+        digest = base64.urlsafe_b64encode(hashlib.sha256(data).digest())
+        if name in hashes and digest.rstrip(b"=").decode() != hashes[name]:
+            raise ArtifactIntegrityError(name + " does not match RECORD")
+
+
+def read_remote_wheel(url):
+    """Read a wheel's Python sources by range requests
+
+    Returns (sources, remote_file). Raises RangesNotSupported if the
+    server sends whole files instead.
+    """
+    remote_file = RemoteFile(url)
+    with zipfile.ZipFile(remote_file) as archive:
+        remote_file.fetch_ranges(member_ranges(archive, is_wanted_member))
+    sources = {}
+    record = None
+    try:
+        # Every byte read from here on is already held in memory
+        for name, chunks in iter_zip_member_chunks(remote_file, is_wanted_member):
+            data = b"".join(chunks)
+            if is_record(name):
+                record = data
+            else:
+                sources[name] = data
+    except ArchiveLimitError as error:
+        # Analyze what was read before the limit rather than nothing
+        print("WARNING: " + url + ": " + str(error), file=sys.stderr)
+    if record is not None:
+        check_record(sources, record)
+    return sources, remote_file
+
+
+def download_artifact(url, digest, path, response=None):
+    """Download a release file whole to path and check its sha256 digest
+
+    response is reused if the file was already sent in answer to a
+    range request. Returns the number of bytes downloaded.
+    """
+    if response is None:
+        with profiling.span("artifact download", "http", url=url):
+            response = http_client.send(url)
+    response.raise_for_status()
+    if hashlib.sha256(response.content).hexdigest() != digest:
+        raise ArtifactIntegrityError(url + " does not match its sha256 digest")
+    with open(path, "wb") as f:
+        f.write(response.content)
+    return len(response.content)
+
+
+def local_path(url):
+    """Path of a file:// URL, or None for other URLs"""
+    parts = urlsplit(url)
+    if parts.scheme != "file":
+        return None
+    return unquote(parts.path)
+
+
+def check_local_artifact(path, digest):
+    """Raise ArtifactIntegrityError unless a local file has the digest"""
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(chunk)
+    if sha256.hexdigest() != digest:
+        raise ArtifactIntegrityError(path + " does not match its sha256 digest")
+
+
+def fetch_artifact(artifact_file, workspace):
+    """Get a release file's Python sources, reading as little as possible
+
+    artifact_file is the file's entry from the PyPI JSON "urls" list.
+    Returns (sources, archive_path, download). archive_path is a file in
+    the workspace to read the sources from when they weren't read by
+    range requests, else None. download reports the "method" used, the
+    file's "artifact_bytes", the "bytes_fetched" and the "bytes_saved".
+    """
+    url = artifact_file["url"]
+    digest = artifact_file["digests"]["sha256"]
+    size = artifact_file.get("size")
+    path = local_path(url)
+    if path is not None:
+        check_local_artifact(path, digest)
+        size = os.path.getsize(path)
+        # Nothing was downloaded, but nothing was spared a download either
+        return None, path, download_report("local", size, 0, 0, bytes_saved=0)
+
+    response = None
+    if artifact_file["filename"].lower().endswith(".whl"):
+        try:
+            with profiling.span("range reads", "http", url=url) as details:
+                sources, remote_file = read_remote_wheel(url)
+                details["bytes"] = remote_file.bytes_fetched
+            return (
+                sources,
+                None,
+                download_report(
+                    "range",
+                    remote_file.size,
+                    remote_file.bytes_fetched,
+                    remote_file.requests,
+                ),
+            )
+        except RangesNotSupported as error:
+            response = error.response
+    path = os.path.join(workspace, os.path.basename(artifact_file["filename"]))
+    fetched = download_artifact(url, digest, path, response)
+    return None, path, download_report("download", size or fetched, fetched, 1)
+
+
+def download_report(method, artifact_bytes, bytes_fetched, requests, bytes_saved=None):
+    """Describe how a release file was fetched and the bytes it saved
+
+    bytes_saved defaults to the bytes of the file that weren't fetched.
+    """
+    if bytes_saved is None:
+        bytes_saved = max(0, (artifact_bytes or 0) - bytes_fetched)
+    return {
+        "method": method,
+        "artifact_bytes": artifact_bytes,
+        "bytes_fetched": bytes_fetched,
+        "bytes_saved": bytes_saved,
+        "requests": requests,
+    }
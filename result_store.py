@@ -0,0 +1,411 @@
+"""Keep scan results over time in a local SQLite database
+
+Each scan of a package is saved as a time-stamped snapshot of its field
+values, release index and static analysis results. Maintainers added or
+removed since a package's previous snapshot are recorded as changes,
+which can be looked up by package, by maintainer or by time.
+
+A rescan first asks PyPI for each package's upstream state, the last
+serial of its simple index, which PyPI bumps on every change to a
+project, including its releases, files and maintainer roles. Only
+packages whose state differs from their latest snapshot are scanned
+again.
+
+    $ python main.py -r requirements.txt --store
+    $ python main.py -r requirements.txt --store --rescan
+    $ python result_store.py history requests
+    $ python result_store.py maintainer-changes --since 30
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import time
+
+from packaging.utils import canonicalize_name
+
+from backends import get_backend
+from pypi_pkg import split_version_pin
+
+# Database file holding every snapshot
+STORE_PATH = os.environ.get(
+    "PKGSCAN_STORE",
+    os.path.join(os.path.expanduser("~"), ".local", "share", "pkgscan", "results.db"),
+)
+
+# Fields every snapshot keeps, whatever else was scanned
+STORED_FIELDS = ["maintainers_list", "maintainers_account_creation_date"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS packages (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    state TEXT,
+    scanned_at REAL
+);
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY,
+    package_id INTEGER NOT NULL REFERENCES packages (id),
+    scanned_at REAL NOT NULL,
+    version TEXT,
+    state TEXT,
+    maintainers TEXT NOT NULL,
+    fields TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS snapshots_by_package
+    ON snapshots (package_id, scanned_at);
+CREATE TABLE IF NOT EXISTS maintainer_changes (
+    id INTEGER PRIMARY KEY,
+    package_id INTEGER NOT NULL REFERENCES packages (id),
+    snapshot_id INTEGER NOT NULL REFERENCES snapshots (id),
+    changed_at REAL NOT NULL,
+    maintainer TEXT NOT NULL,
+    change TEXT NOT NULL CHECK (change IN ('added', 'removed'))
+);
+CREATE INDEX IF NOT EXISTS maintainer_changes_by_package
+    ON maintainer_changes (package_id, changed_at);
+CREATE INDEX IF NOT EXISTS maintainer_changes_by_maintainer
+    ON maintainer_changes (maintainer, changed_at);
+CREATE INDEX IF NOT EXISTS maintainer_changes_by_time
+    ON maintainer_changes (changed_at);
+"""
+
+
+def upstream_state(pkg_name):
+    """A token that changes whenever a package changes on PyPI, or None
+
+    The last serial PyPI sends with the simple index is used, else a
+    hash of the index itself.
+    """
+    response = get_backend().simple_index(pkg_name)
+    if not response.ok:
+        return None
+    serial = response.headers.get("X-PyPI-Last-Serial")
+    if serial is None:
+        try:
+            serial = response.json().get("meta", {}).get("_last-serial")
+        except ValueError:
+            serial = None
+    if serial is not None:
+        return "serial:" + str(serial)
+    return "sha256:" + hashlib.sha256(response.content).hexdigest()
+
+
+def release_index_data(package):
+    """Versions, upload times and yanked flags of a scanned package"""
+    release_index = package.pypi_pkg["pypi_record"].release_index
+    return {
+        "versions": list(release_index.versions),
+        # Releases without files have no upload time
+        "upload_times": [
+            None if math.isnan(upload_time) else upload_time
+            for upload_time in release_index.upload_times
+        ],
+        "yanked": [bool(yanked) for yanked in release_index.yanked],
+    }
+
+
+class ResultStore:
+    """Snapshots of scan results in an SQLite database
+
+    Writes must come from the thread that opened the store.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or STORE_PATH
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.row_factory = sqlite3.Row
+        # Readers, such as a history query, don't wait for a rescan
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # Each snapshot is its own commit; with WAL this is still safe
+        # against crashes without syncing to disk every time
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        """Close the database"""
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def package_id(self, pkg_name):
+        """Row id of a tracked package, or None"""
+        row = self.connection.execute(
+            "SELECT id FROM packages WHERE name = ?", (canonicalize_name(pkg_name),)
+        ).fetchone()
+        return row["id"] if row else None
+
+    def states(self, pkg_names):
+        """Map tracked package names to (state, scanned_at) of their latest scan"""
+        states = {}
+        for pkg_name in set(pkg_names):
+            row = self.connection.execute(
+                "SELECT state, scanned_at FROM packages WHERE name = ?",
+                (canonicalize_name(pkg_name),),
+            ).fetchone()
+            if row is not None:
+                states[pkg_name] = (row["state"], row["scanned_at"])
+        return states
+
+    def record(self, pkg_name, values, version=None, state=None, scanned_at=None):
+        """Save a snapshot of a package's field values
+
+        values maps field names to what the scan found, and may hold a
+        "release_index". Maintainers added or removed since the previous
+        snapshot are recorded as changes. Returns the snapshot's id.
+        """
+        scanned_at = time.time() if scanned_at is None else scanned_at
+        name = canonicalize_name(pkg_name)
+        maintainers = values.get("maintainers_list")
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR IGNORE INTO packages (name) VALUES (?)",
+                (name,),
+            )
+            package_id = self.package_id(name)
+            previous = self.connection.execute(
+                "SELECT maintainers FROM snapshots WHERE package_id = ?"
+                " ORDER BY scanned_at DESC, id DESC LIMIT 1",
+                (package_id,),
+            ).fetchone()
+            # A scan that didn't read the maintainers keeps the last list
+            if not isinstance(maintainers, list):
+                maintainers = json.loads(previous["maintainers"]) if previous else []
+            snapshot_id = self.connection.execute(
+                "INSERT INTO snapshots"
+                " (package_id, scanned_at, version, state, maintainers, fields)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    package_id,
+                    scanned_at,
+                    version,
+                    state,
+                    json.dumps(sorted(maintainers)),
+                    json.dumps(values, default=str),
+                ),
+            ).lastrowid
+            if previous is not None:
+                before = set(json.loads(previous["maintainers"]))
+                changes = [
+                    (maintainer, "added") for maintainer in set(maintainers) - before
+                ] + [
+                    (maintainer, "removed") for maintainer in before - set(maintainers)
+                ]
+                self.connection.executemany(
+                    "INSERT INTO maintainer_changes"
+                    " (package_id, snapshot_id, changed_at, maintainer, change)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (package_id, snapshot_id, scanned_at, maintainer, change)
+                        for maintainer, change in sorted(changes)
+                    ],
+                )
+            self.connection.execute(
+                "UPDATE packages SET state = ?, scanned_at = ? WHERE id = ?",
+                (state, scanned_at, package_id),
+            )
+        return snapshot_id
+
+    def history(self, pkg_name, with_fields=True, limit=None):
+        """Snapshots of a package as dicts, oldest first
+
+        With a limit, only that many of the most recent snapshots.
+        """
+        columns = "id, scanned_at, version, state, maintainers"
+        if with_fields:
+            columns += ", fields"
+        query = (
+            "SELECT " + columns + " FROM snapshots WHERE package_id ="
+            " (SELECT id FROM packages WHERE name = ?)"
+            " ORDER BY scanned_at DESC, id DESC"
+        )
+        parameters = [canonicalize_name(pkg_name)]
+        if limit is not None:
+            query += " LIMIT ?"
+            parameters.append(limit)
+        snapshots = []
+        for row in self.connection.execute(query, parameters):
+            snapshot = dict(row)
+            snapshot["maintainers"] = json.loads(snapshot["maintainers"])
+            if with_fields:
+                snapshot["fields"] = json.loads(snapshot["fields"])
+            snapshots.append(snapshot)
+        snapshots.reverse()
+        return snapshots
+
+    def latest(self, pkg_name):
+        """A package's most recent snapshot, or None"""
+        snapshots = self.history(pkg_name, limit=1)
+        return snapshots[0] if snapshots else None
+
+    def maintainer_changes(self, pkg_name=None, maintainer=None, since=None):
+        """Maintainers added to or removed from packages, oldest first
+
+        Each change is a dict of package, maintainer, change ("added" or
+        "removed") and changed_at. Filter by package, maintainer or a
+        time since which changes happened.
+        """
+        conditions = []
+        parameters = []
+        if pkg_name is not None:
+            conditions.append("packages.name = ?")
+            parameters.append(canonicalize_name(pkg_name))
+        if maintainer is not None:
+            conditions.append("maintainer_changes.maintainer = ?")
+            parameters.append(maintainer)
+        if since is not None:
+            conditions.append("maintainer_changes.changed_at >= ?")
+            parameters.append(since)
+        query = (
+            "SELECT packages.name AS package, maintainer, change, changed_at"
+            " FROM maintainer_changes"
+            " JOIN packages ON packages.id = maintainer_changes.package_id"
+        )
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY changed_at, maintainer_changes.id"
+        return [dict(row) for row in self.connection.execute(query, parameters)]
+
+
+def check_packages(store, pkg_names, max_workers=8, max_age=None, now=None):
+    """Yield (name, state, reason) telling whether each package changed
+
+    reason is "new" for untracked packages, "changed" when the upstream
+    state differs from the latest snapshot's, "stale" when that snapshot
+    is older than max_age seconds and "unchanged" otherwise. Packages
+    whose state can't be found count as changed. States are fetched in
+    parallel.
+    """
+    now = time.time() if now is None else now
+    pkg_names = list(pkg_names)
+    # Pinned names share the state of their project
+    projects = [split_version_pin(pkg_name)[0] for pkg_name in pkg_names]
+    stored = store.states(projects)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        states = executor.map(upstream_state, projects)
+        for pkg_name, project, state in zip(pkg_names, projects, states):
+            if project not in stored:
+                reason = "new"
+            elif state is None or state != stored[project][0]:
+                reason = "changed"
+            elif max_age is not None and now - stored[project][1] > max_age:
+                reason = "stale"
+            else:
+                reason = "unchanged"
+            yield pkg_name, state, reason
+
+
+def scan_and_store(
+    store,
+    pkg_names,
+    verbosity,
+    max_workers=8,
+    fields=None,
+    rescan=False,
+    max_age=None,
+    keep_raw=False,
+):
+    """Scan packages and save a snapshot of each to the store
+
+    With rescan, packages that are unchanged upstream and scanned less
+    than max_age seconds ago are skipped. Yields (name, package, error,
+    reason) for every package, see check_packages(), with no package
+    for those skipped. keep_raw is passed on to batch.scan_packages().
+    """
+    # Imported here because batch imports Package from main
+    # pylint: disable=import-outside-toplevel
+    from batch import scan_packages
+    from main import fields_for_verbosity
+
+    if fields is None:
+        fields = fields_for_verbosity(verbosity)
+    scan_fields = fields + [field for field in STORED_FIELDS if field not in fields]
+    checked = {}
+    for pkg_name, state, reason in check_packages(
+        store, pkg_names, max_workers, max_age
+    ):
+        if rescan and reason == "unchanged":
+            yield pkg_name, None, None, reason
+        else:
+            checked[pkg_name] = (state, reason)
+    for pkg_name, package, error in scan_packages(
+        list(checked), verbosity, max_workers, scan_fields, keep_raw
+    ):
+        state, reason = checked[pkg_name]
+        if error is None:
+            values = package.field_values(scan_fields)
+            values["release_index"] = release_index_data(package)
+            name, version = split_version_pin(pkg_name)
+            store.record(name, values, version, state)
+        yield pkg_name, package, error, reason
+
+
+def print_history(store, pkg_name):
+    """Print when a package was scanned and how its maintainers changed"""
+    snapshots = store.history(pkg_name, with_fields=False)
+    if not snapshots:
+        print("No snapshots of " + pkg_name)
+        return
+    for snapshot in snapshots:
+        print(
+            time.strftime("%Y-%m-%d %H:%M", time.gmtime(snapshot["scanned_at"])),
+            snapshot["version"] or "latest",
+            snapshot["state"] or "-",
+            " ".join(snapshot["maintainers"]),
+        )
+    for change in store.maintainer_changes(pkg_name):
+        print(
+            time.strftime("%Y-%m-%d %H:%M", time.gmtime(change["changed_at"])),
+            change["change"],
+            change["maintainer"],
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--store", help="Database file, instead of PKGSCAN_STORE.")
+    commands = parser.add_subparsers(dest="command")
+    history_parser = commands.add_parser(
+        "history", help="Print a package's snapshots and maintainer changes."
+    )
+    history_parser.add_argument("package_name")
+    changes_parser = commands.add_parser(
+        "maintainer-changes", help="Print maintainers added or removed."
+    )
+    changes_parser.add_argument("--package", help="Only this package's changes.")
+    changes_parser.add_argument("--maintainer", help="Only this maintainer's.")
+    changes_parser.add_argument(
+        "--since", type=float, help="Only changes in the past this many days."
+    )
+    args = parser.parse_args()
+
+    with ResultStore(args.store) as result_store:
+        if args.command == "history":
+            print_history(result_store, args.package_name)
+        elif args.command == "maintainer-changes":
+            start_time = None
+            if args.since is not None:
+                start_time = time.time() - args.since * 86400
+            for maintainer_change in result_store.maintainer_changes(
+                args.package, args.maintainer, start_time
+            ):
+                print(
+                    time.strftime(
+                        "%Y-%m-%d %H:%M", time.gmtime(maintainer_change["changed_at"])
+                    ),
+                    maintainer_change["package"],
+                    maintainer_change["change"],
+                    maintainer_change["maintainer"],
+                )
+        else:
+            parser.error("a command is required")
@@ -0,0 +1,315 @@
+"""Score the risk of many scanned packages at once with NumPy
+
+The fields of each scanned package become one row of a feature matrix.
+Values that could not be found, such as "No github found", "Error" or a
+field that wasn't scanned, are missing, which a boolean mask beside the
+matrix records instead of a made-up number.
+
+A RiskModel scores the whole matrix in one pass. Weighted terms add
+weight * transform(value) and rule terms add points where a value is
+below or above a threshold. Missing values add each term's "missing"
+points instead. The contributions of every term are kept per package,
+so each score can be explained, and a saved matrix can be scored again
+with other weights without scanning anything:
+
+    $ python main.py -r requirements.txt --risk --save-features features.npz
+    $ python risk_score.py features.npz --model model.json
+"""
+
+import argparse
+from collections import namedtuple
+from datetime import datetime, timezone
+from functools import lru_cache
+import json
+import time
+
+import numpy as np
+
+# Fields the features are computed from
+RISK_FIELDS = [
+    "number_releases_past_year",
+    "pypi_pkg_signed",
+    "maintainers_list",
+    "similar_names",
+    "maintainers_account_creation_date",
+    "number_of_packages_maintained_by_maintainers",
+    "github_stars",
+    "downloads",
+]
+
+# Scores higher are riskier. Popular, actively maintained packages score
+# below zero and new, unknown or flagged ones well above it.
+DEFAULT_MODEL = {
+    "weights": {
+        "github_stars": {"weight": -3.0, "transform": "log1p", "missing": 15.0},
+        "downloads_last_month": {
+            "weight": -1.5,
+            "transform": "log1p",
+            "missing": 5.0,
+        },
+        "bandit_high": {"weight": 8.0, "transform": "log1p"},
+        "bandit_medium": {"weight": 2.0, "transform": "log1p"},
+        "ast_checks_high": {"weight": 15.0, "transform": "log1p"},
+    },
+    "rules": [
+        {"feature": "newest_account_days", "below": 90, "points": 25.0},
+        {"feature": "newest_account_days", "below": 365, "points": 10.0},
+        {"feature": "max_maintainer_packages", "below": 2, "points": 10.0},
+        {"feature": "maintainers", "below": 2, "points": 5.0},
+        {"feature": "releases_past_year", "below": 1, "points": 5.0},
+        {"feature": "similar_names", "above": 0, "points": 20.0},
+        {"feature": "lint_score", "below": 5.0, "points": 3.0},
+        {"feature": "signed", "below": 1, "points": 2.0},
+    ],
+}
+
+# One row per package, named by names, and one column per feature.
+# values is a float64 array holding 0 wherever missing is True.
+FeatureMatrix = namedtuple("FeatureMatrix", ["names", "features", "values", "missing"])
+
+# Transforms a weighted term can apply to its feature before weighting
+TRANSFORMS = {
+    "linear": lambda values: values,
+    # Heavy-tailed counts such as stars and downloads
+    "log1p": lambda values: np.log1p(np.maximum(values, 0)),
+}
+
+
+def to_number(value):
+    """A field value as a float, or None if it isn't a number
+
+    Booleans count as 0 or 1, and counts shown like github's "1.2k" or
+    "3m" are expanded.
+    """
+    if isinstance(value, bool):
+        return float(value)
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not isinstance(value, str):
+        return None
+    text = value.strip().lower().replace(",", "")
+    multiplier = {"k": 1e3, "m": 1e6}.get(text[-1:], 1)
+    if multiplier != 1:
+        text = text[:-1]
+    try:
+        return float(text) * multiplier
+    except ValueError:
+        return None
+
+
+def numbers(values):
+    """The values of a list field that are numbers"""
+    if not isinstance(values, list):
+        return []
+    parsed = [to_number(value) for value in values]
+    return [number for number in parsed if number is not None]
+
+
+@lru_cache(maxsize=None)
+def account_created(date):
+    """Timestamp of a "Feb 12, 2017"-style date, or None if it isn't one
+
+    Maintainers are shared by many packages, so each date is parsed once.
+    """
+    try:
+        created = datetime.strptime(date, "%b %d, %Y")
+    except (TypeError, ValueError):
+        return None
+    return created.replace(tzinfo=timezone.utc).timestamp()
+
+
+def account_ages(dates, now):
+    """Days since each of a list of account creation dates"""
+    created = [account_created(date) for date in dates or [] if isinstance(date, str)]
+    return [(now - timestamp) / 86400 for timestamp in created if timestamp is not None]
+
+
+def section_value(values, field, key):
+    """A key of a field holding a dict, such as bandit's count_high"""
+    section = values.get(field)
+    return section.get(key) if isinstance(section, dict) else None
+
+
+# Each feature, computed from a package's field values and the time now.
+# A feature is missing when its function returns anything but a number.
+FEATURES = {
+    "releases_past_year": lambda values, now: values.get("number_releases_past_year"),
+    "signed": lambda values, now: values.get("pypi_pkg_signed"),
+    "maintainers": lambda values, now: (
+        len(values["maintainers_list"])
+        if isinstance(values.get("maintainers_list"), list)
+        else None
+    ),
+    "similar_names": lambda values, now: (
+        len(values["similar_names"])
+        if isinstance(values.get("similar_names"), list)
+        else None
+    ),
+    "newest_account_days": lambda values, now: min(
+        account_ages(values.get("maintainers_account_creation_date"), now),
+        default=None,
+    ),
+    "max_maintainer_packages": lambda values, now: max(
+        numbers(values.get("number_of_packages_maintained_by_maintainers")),
+        default=None,
+    ),
+    "github_stars": lambda values, now: values.get("github_stars"),
+    "downloads_last_month": lambda values, now: section_value(
+        values, "downloads", "last_month"
+    ),
+    "bandit_high": lambda values, now: section_value(values, "bandit", "count_high"),
+    "bandit_medium": lambda values, now: section_value(
+        values, "bandit", "count_medium"
+    ),
+    "ast_checks_high": lambda values, now: section_value(
+        values, "ast_checks", "count_high"
+    ),
+    "lint_score": lambda values, now: section_value(
+        values, "pylint", "average_lint_score"
+    ),
+}
+
+
+def feature_matrix(results, now=None):
+    """Build a FeatureMatrix from (package name, field values) pairs
+
+    Field values map field names to what a scan found, as
+    Package.field_values() returns or as stored as JSON.
+    """
+    now = time.time() if now is None else now
+    names = []
+    rows = []
+    for name, values in results:
+        names.append(name)
+        row = []
+        for feature in FEATURES.values():
+            number = to_number(feature(values, now))
+            row.append(np.nan if number is None else number)
+        rows.append(row)
+    values = np.array(rows, dtype=np.float64).reshape(len(rows), len(FEATURES))
+    missing = np.isnan(values)
+    values[missing] = 0.0
+    return FeatureMatrix(names, list(FEATURES), values, missing)
+
+
+def save_matrix(path, matrix):
+    """Save a FeatureMatrix to an .npz file to score again later"""
+    np.savez_compressed(
+        path,
+        names=np.array(matrix.names, dtype=str),
+        features=np.array(matrix.features, dtype=str),
+        values=matrix.values,
+        missing=matrix.missing,
+    )
+
+
+def load_matrix(path):
+    """Load a FeatureMatrix saved by save_matrix()"""
+    with np.load(path) as saved:
+        return FeatureMatrix(
+            saved["names"].tolist(),
+            saved["features"].tolist(),
+            saved["values"],
+            saved["missing"],
+        )
+
+
+class RiskModel:
+    """Weighted and rule terms over features, evaluated a matrix at a time
+
+    model is a dict like DEFAULT_MODEL. "weights" maps features to their
+    "weight", optional "transform" and "missing" points. Each of the
+    "rules" gives a "feature", a "below" or "above" threshold and the
+    "points" it adds, with optional "missing" points too.
+    """
+
+    def __init__(self, model=None):
+        model = DEFAULT_MODEL if model is None else model
+        weights = model.get("weights", {})
+        rules = model.get("rules", [])
+        self.terms = list(weights)
+        self.weighted_features = list(weights)
+        self.weights = np.array([term["weight"] for term in weights.values()])
+        self.transforms = [term.get("transform", "linear") for term in weights.values()]
+        self.rule_features = [rule["feature"] for rule in rules]
+        # A rule holds where sign * value < sign * threshold, so "above"
+        # rules are "below" rules on negated values
+        self.signs = np.array([-1.0 if "above" in rule else 1.0 for rule in rules])
+        self.thresholds = np.array(
+            [rule.get("below", rule.get("above")) for rule in rules], dtype=np.float64
+        )
+        self.points = np.array([rule["points"] for rule in rules], dtype=np.float64)
+        for rule in rules:
+            side = "above" if "above" in rule else "below"
+            self.terms.append("{} {} {}".format(rule["feature"], side, rule[side]))
+        self.missing_points = np.array(
+            [term.get("missing", 0.0) for term in weights.values()]
+            + [rule.get("missing", 0.0) for rule in rules],
+            dtype=np.float64,
+        )
+
+    @classmethod
+    def from_file(cls, path):
+        """Load a model from a JSON file shaped like DEFAULT_MODEL"""
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def contributions(self, matrix):
+        """(package, term) array of the points each term adds to each score"""
+        columns = {feature: index for index, feature in enumerate(matrix.features)}
+        weighted = [columns[feature] for feature in self.weighted_features]
+        ruled = [columns[feature] for feature in self.rule_features]
+
+        values = matrix.values[:, weighted]
+        transformed = np.empty_like(values)
+        for transform in set(self.transforms):
+            selected = np.array([name == transform for name in self.transforms])
+            transformed[:, selected] = TRANSFORMS[transform](values[:, selected])
+        passed = self.signs * matrix.values[:, ruled] < self.signs * self.thresholds
+        contributions = np.hstack([transformed * self.weights, passed * self.points])
+
+        missing = np.hstack([matrix.missing[:, weighted], matrix.missing[:, ruled]])
+        return np.where(missing, self.missing_points, contributions)
+
+    def score(self, matrix):
+        """Risk score of every package, with each term's contributions"""
+        contributions = self.contributions(matrix)
+        return contributions.sum(axis=1), contributions
+
+
+def explain(model, contributions, top=3):
+    """The terms adding the most to one score, as (term, points) pairs"""
+    order = np.argsort(-np.abs(contributions))[:top]
+    return [
+        (model.terms[index], float(contributions[index]))
+        for index in order
+        if contributions[index]
+    ]
+
+
+def format_scores(matrix, model, top=3):
+    """One line per package, riskiest first, with its largest contributions"""
+    scores, contributions = model.score(matrix)
+    lines = []
+    for row in np.argsort(-scores, kind="stable"):
+        reasons = ", ".join(
+            "{} {:+.1f}".format(term, points)
+            for term, points in explain(model, contributions[row], top)
+        )
+        lines.append(
+            "{:<30} {:>7.1f}  {}".format(matrix.names[row], scores[row], reasons)
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("features", help="Feature matrix saved by --save-features.")
+    parser.add_argument("--model", help="JSON file of weights and rules to score with.")
+    parser.add_argument(
+        "--top", type=int, default=3, help="Terms to show for each package."
+    )
+    args = parser.parse_args()
+
+    risk_model = RiskModel.from_file(args.model) if args.model else RiskModel()
+    print(format_scores(load_matrix(args.features), risk_model, args.top))
@@ -0,0 +1,223 @@
+"""Local HTTP server of a snapshot directory, for tests and benchmarks
+
+Serves the documents a snapshot directory holds, see backends, at
+/<host>/<path>, so https://pypi.org/pypi/requests/json is answered from
+<directory>/pypi.org/pypi/requests/json/#json. Each response can be delayed
+to stand in for a remote site, and a share of requests can be failed
+with a 503 to exercise retries. Single byte ranges are answered with a
+206, like a CDN does for release files, unless ranges is turned off.
+
+    $ python main.py --record-snapshot snapshot requests
+    $ python snapshot_server.py snapshot --port 8000 --latency 0.05
+    $ PKGSCAN_SNAPSHOT_SERVER=http://127.0.0.1:8000 python main.py requests
+"""
+
+import argparse
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import random
+import threading
+import time
+
+from backends import snapshot_path
+
+
+def parse_range(header, size):
+    """(start, end) of a single "bytes=" Range header, end exclusive
+
+    Returns None for headers that aren't one byte range, which are
+    answered with the whole file, and raises ValueError for ranges
+    outside the file.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes=") :].strip().partition("-")
+    try:
+        if not first:
+            # A suffix range, the last bytes of the file
+            start, end = max(0, size - int(last)), size
+        else:
+            start, end = int(first), min(size, int(last) + 1 if last else size)
+    except ValueError:
+        return None
+    if start >= end:
+        raise ValueError("range not satisfiable")
+    return start, end
+
+
+def content_type(path):
+    """Content type of a saved document, guessed from its first byte"""
+    with open(path, "rb") as f:
+        start = f.read(1)
+    if start in (b"{", b"["):
+        return "application/json"
+    if start == b"<":
+        return "text/html; charset=utf-8"
+    return "application/octet-stream"
+
+
+class SnapshotServer:
+    """Serve a snapshot directory from a background thread
+
+    latency seconds, plus up to jitter more, are waited before every
+    response. error_rate is the share of requests answered with a 503
+    instead, drawn from a generator seeded with seed so runs repeat.
+    Range headers are ignored if ranges is false. counts tallies
+    requests, injected errors, missing documents, range requests and
+    bytes sent.
+    """
+
+    def __init__(
+        self,
+        directory,
+        host="127.0.0.1",
+        port=0,
+        latency=0.0,
+        jitter=0.0,
+        error_rate=0.0,
+        seed=0,
+        ranges=True,
+    ):
+        self.directory = directory
+        self.ranges = ranges
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = Counter()
+        self.httpd = ThreadingHTTPServer((host, port), self.handler_class())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        """Base URL the server answers on"""
+        host, port = self.httpd.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def handler_class(self):
+        """Request handler class bound to this server"""
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """Answer GETs from the snapshot directory"""
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                """Send the document saved for a path, or an error"""
+                status, path = server.route(self.path)
+                if path is None:
+                    self.send_response(status)
+                    if status == 503:
+                        self.send_header("Retry-After", "0")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                size = os.path.getsize(path)
+                byte_range = None
+                if server.ranges:
+                    try:
+                        byte_range = parse_range(self.headers.get("Range"), size)
+                    except ValueError:
+                        self.send_error(416)
+                        return
+                start, end = byte_range or (0, size)
+                self.send_response(200 if byte_range is None else 206)
+                if server.ranges:
+                    self.send_header("Accept-Ranges", "bytes")
+                if byte_range is not None:
+                    self.send_header(
+                        "Content-Range", "bytes {}-{}/{}".format(start, end - 1, size)
+                    )
+                self.send_header("Content-Type", content_type(path))
+                self.send_header("Content-Length", str(end - start))
+                self.end_headers()
+                with open(path, "rb") as f:
+                    f.seek(start)
+                    self.wfile.write(f.read(end - start))
+                with server.lock:
+                    server.counts["bytes_sent"] += end - start
+                    if byte_range is not None:
+                        server.counts["range_requests"] += 1
+
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                pass
+
+        return Handler
+
+    def route(self, request_path):
+        """Wait out the latency and pick (status, file) for a request path"""
+        with self.lock:
+            self.counts["requests"] += 1
+            delay = self.latency + self.random.uniform(0, self.jitter)
+            fail = self.random.random() < self.error_rate
+            if fail:
+                self.counts["errors_injected"] += 1
+        if delay:
+            time.sleep(delay)
+        if fail:
+            return 503, None
+        # The first path segment is the host the document was saved from
+        path = snapshot_path(self.directory, "https:/" + request_path.split("?", 1)[0])
+        if path is None or not os.path.isfile(path):
+            with self.lock:
+                self.counts["not_found"] += 1
+            return 404, None
+        return 200, path
+
+    def start(self):
+        """Start serving in a daemon thread"""
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and close the socket"""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.thread is not None:
+            self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("directory", help="Snapshot directory to serve.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Seconds to delay each response."
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=0.0, help="Up to this many more seconds."
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="Share of requests to fail."
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--no-ranges", action="store_true", help="Ignore Range headers."
+    )
+    args = parser.parse_args()
+
+    snapshot_server = SnapshotServer(
+        args.directory,
+        args.host,
+        args.port,
+        args.latency,
+        args.jitter,
+        args.error_rate,
+        args.seed,
+        not args.no_ranges,
+    )
+    print("Serving " + args.directory + " at " + snapshot_server.url)
+    try:
+        snapshot_server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        snapshot_server.httpd.server_close()
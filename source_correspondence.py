@@ -0,0 +1,430 @@
+"""Check that a release's files correspond to its tagged source on github
+
+Code injected into a release but never committed shows up as files that
+only the release file has, or that differ from the source at the
+release's tag. Both trees are hashed file by file into a manifest, and
+each directory gets a Merkle hash of its entries, so directories that
+match are skipped whole when the trees are compared.
+
+Line endings are normalized before hashing, and files that builds add,
+such as PKG-INFO or compiled extensions, are skipped. The source can be
+a github tag's tarball, a local git repository at a ref, a checkout or
+any archive standing in for one:
+
+    $ python source_correspondence.py requests-2.31.0.tar.gz ~/src/requests --ref v2.31.0
+"""
+
+import argparse
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import fnmatch
+import hashlib
+import json
+import os
+import subprocess
+from urllib.parse import urlsplit
+
+from artifact import is_archive, iter_member_chunks
+from backends import get_backend
+from remote_artifact import check_local_artifact, download_artifact, local_path
+
+# Files builds add or rewrite, which are never in the source, matched
+# against both the whole path and the file name
+GENERATED_PATTERNS = [
+    "PKG-INFO",
+    "*.egg-info/*",
+    "*.dist-info/*",
+    "__pycache__/*",
+    "*.pyc",
+    "*.pyo",
+    "*.so",
+    "*.pyd",
+    "*.dylib",
+    "*.dll",
+    # Written by setuptools_scm and versioneer from the git tag
+    "_version.py",
+]
+
+# Bytes hashed at a time, so files of any size are hashed in bounded memory
+CHUNK_SIZE = 1024 * 1024
+
+# Files hashed at the same time. hashlib releases the GIL while hashing.
+HASH_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+# Bytes checked for a NUL byte to tell binary files from text
+BINARY_CHECK_SIZE = 8192
+
+
+def is_generated(path):
+    """Check whether a file is one that builds add to a release"""
+    name = path.rsplit("/", 1)[-1]
+    return any(
+        fnmatch.fnmatch(path, pattern) or fnmatch.fnmatch(name, pattern)
+        for pattern in GENERATED_PATTERNS
+    )
+
+
+def normalized_digest(chunks):
+    """sha256 of a file's chunks, with CRLF and CR line endings as LF
+
+    Files with a NUL byte near the start are binary and hashed as is.
+    """
+    sha256 = hashlib.sha256()
+    binary = None
+    pending_cr = False
+    for chunk in chunks:
+        if binary is None:
+            binary = b"\0" in chunk[:BINARY_CHECK_SIZE]
+        if binary:
+            sha256.update(chunk)
+            continue
+        # A CR ending one chunk may start a CRLF ending the next one
+        if pending_cr:
+            chunk = b"\r" + chunk
+        pending_cr = chunk.endswith(b"\r")
+        if pending_cr:
+            chunk = chunk[:-1]
+        sha256.update(chunk.replace(b"\r\n", b"\n").replace(b"\r", b"\n"))
+    if pending_cr:
+        sha256.update(b"\n")
+    return sha256.hexdigest()
+
+
+def file_digest(path):
+    """Normalized digest of a file on disk, read a chunk at a time"""
+    with open(path, "rb") as f:
+        return normalized_digest(iter(lambda: f.read(CHUNK_SIZE), b""))
+
+
+def hash_all(items, digest):
+    """Map each name to digest(item) for (name, item) pairs, in parallel"""
+    with ThreadPoolExecutor(max_workers=HASH_WORKERS) as executor:
+        futures = {name: executor.submit(digest, item) for name, item in items}
+        return {name: future.result() for name, future in futures.items()}
+
+
+def strip_top_directory(manifest):
+    """Drop the directory every path shares, as sdists and github tarballs
+    put everything under name-version/
+    """
+    tops = {path.split("/", 1)[0] for path in manifest}
+    if len(tops) != 1 or not all("/" in path for path in manifest):
+        return manifest
+    return {path.split("/", 1)[1]: digest for path, digest in manifest.items()}
+
+
+def skip_generated(manifest):
+    """Split a manifest into its non-generated files and a skipped count"""
+    kept = {path: digest for path, digest in manifest.items() if not is_generated(path)}
+    return kept, len(manifest) - len(kept)
+
+
+def archive_manifest(path):
+    """Map each file of a wheel, sdist or tarball to its normalized digest
+
+    Members are hashed as they are decompressed, a chunk at a time, so
+    no member is held in memory whole.
+    """
+    manifest = {}
+    for name, chunks in iter_member_chunks(path):
+        manifest[name[2:] if name.startswith("./") else name] = normalized_digest(
+            chunks
+        )
+    return strip_top_directory(manifest)
+
+
+def directory_manifest(root):
+    """Map each file below a directory to its normalized digest"""
+    paths = []
+    for directory, subdirectories, files in os.walk(root):
+        subdirectories[:] = [name for name in subdirectories if name != ".git"]
+        for name in files:
+            path = os.path.join(directory, name)
+            if os.path.isfile(path) and not os.path.islink(path):
+                paths.append(path)
+    return hash_all(
+        ((os.path.relpath(path, root).replace(os.sep, "/"), path) for path in paths),
+        file_digest,
+    )
+
+
+def git_manifest(repository, ref):
+    """Map each file of a local git repository at ref to its normalized digest
+
+    Blobs are streamed from one git cat-file process and each distinct
+    blob is hashed once.
+    """
+    listing = subprocess.run(
+        ["git", "-C", repository, "ls-tree", "-r", "-z", "--full-tree", ref],
+        check=True,
+        stdout=subprocess.PIPE,
+    ).stdout
+    blobs = {}
+    for entry in listing.split(b"\0"):
+        if not entry:
+            continue
+        # <mode> SP <type> SP <object> TAB <path>; links and submodules
+        # are not files
+        info, _, path = entry.partition(b"\t")
+        mode, object_type, blob = info.split()
+        if object_type == b"blob" and mode != b"120000":
+            blobs[path.decode("utf-8", "surrogateescape")] = blob.decode()
+
+    process = subprocess.Popen(
+        ["git", "-C", repository, "cat-file", "--batch"],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+    )
+    digests = {}
+    with ThreadPoolExecutor(max_workers=HASH_WORKERS) as executor:
+        # Feed the object names from a thread, so git never blocks on a
+        # full pipe while this one reads
+        writer = executor.submit(write_lines, process.stdin, set(blobs.values()))
+        for _ in range(len(set(blobs.values()))):
+            # <object> SP <type> SP <size> LF <contents> LF
+            blob, _, size = process.stdout.readline().split()
+            data = process.stdout.read(int(size))
+            process.stdout.read(1)
+            digests[blob.decode()] = executor.submit(normalized_digest, [data])
+        writer.result()
+    process.wait()
+    return {path: digests[blob].result() for path, blob in blobs.items()}
+
+
+def write_lines(stream, lines):
+    """Write each line to a stream and close it"""
+    for line in lines:
+        stream.write(line.encode() + b"\n")
+    stream.close()
+
+
+def git_ref_exists(repository, ref):
+    """Check whether a local git repository has a tree at ref"""
+    result = subprocess.run(
+        ["git", "-C", repository, "rev-parse", "--verify", "-q", ref + "^{tree}"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return result.returncode == 0
+
+
+def source_manifest(source, ref=None):
+    """Manifest of a source tree: an archive, a git repository or a directory
+
+    ref picks the commit or tag of a git repository. Without one, its
+    working tree is read like any directory.
+    """
+    if os.path.isfile(source) and is_archive(source):
+        return archive_manifest(source)
+    if ref is not None:
+        return git_manifest(source, ref)
+    return directory_manifest(source)
+
+
+def merkle_tree(manifest):
+    """Nest a manifest into directories, each with a hash of its entries
+
+    A directory is a (hash, {name: entry}) pair, and a file is its digest.
+    """
+    root = {}
+    for path, digest in manifest.items():
+        parts = path.split("/")
+        node = root
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        node[parts[-1]] = digest
+    return hash_directory(root)
+
+
+def hash_directory(entries):
+    """Hash a directory's sorted entries, hashing its subdirectories first"""
+    sha256 = hashlib.sha256()
+    children = {}
+    for name in sorted(entries):
+        entry = entries[name]
+        if isinstance(entry, dict):
+            entry = hash_directory(entry)
+            kind, digest = b"d", entry[0]
+        else:
+            kind, digest = b"f", entry
+        children[name] = entry
+        sha256.update(
+            kind + name.encode("utf-8", "surrogateescape") + b"\0" + digest.encode()
+        )
+    return sha256.hexdigest(), children
+
+
+def compare_trees(release, source, counts, path=""):
+    """Yield ("added" or "changed", path) for each release file unlike the source
+
+    Release directories whose hash matches the source's are counted in
+    counts["directories_skipped"] without looking inside.
+    """
+    for name, entry in release[1].items():
+        entry_path = path + name
+        source_entry = source[1].get(name) if source is not None else None
+        if isinstance(entry, tuple):
+            if isinstance(source_entry, tuple) and source_entry[0] == entry[0]:
+                counts["directories_skipped"] += 1
+                continue
+            if not isinstance(source_entry, tuple):
+                source_entry = None
+            yield from compare_trees(entry, source_entry, counts, entry_path + "/")
+        elif source_entry is None or isinstance(source_entry, tuple):
+            yield "added", entry_path
+        elif source_entry != entry:
+            yield "changed", entry_path
+
+
+def source_prefixes(release_paths, source_paths):
+    """Directory of the source each top-level release entry lives in
+
+    Wheels hold packages that the source may keep below src/ or another
+    directory. For each top-level name of the release, the prefix most
+    of its files are found under in the source is picked.
+    """
+    by_name = {}
+    for path in source_paths:
+        by_name.setdefault(path.rsplit("/", 1)[-1], []).append(path)
+    votes = {}
+    for path in release_paths:
+        top = path.split("/", 1)[0]
+        for candidate in by_name.get(path.rsplit("/", 1)[-1], []):
+            if candidate == path or candidate.endswith("/" + path):
+                votes.setdefault(top, Counter())[candidate[: -len(path)]] += 1
+    return {top: counter.most_common(1)[0][0] for top, counter in votes.items()}
+
+
+def compare_manifests(release_manifest, source_manifest):
+    """Report the release files that aren't in the source or differ from it
+
+    Both manifests map paths to normalized digests. Generated files are
+    left out of both. Paths in the report are the release's own.
+    """
+    release_manifest, generated = skip_generated(release_manifest)
+    source_manifest, _ = skip_generated(source_manifest)
+    prefixes = source_prefixes(release_manifest, source_manifest)
+    # Move each release file to where its source would be
+    release_paths = {
+        prefixes.get(path.split("/", 1)[0], "") + path: path
+        for path in release_manifest
+    }
+    counts = Counter()
+    differences = {"added": [], "changed": []}
+    for status, path in compare_trees(
+        merkle_tree(
+            {
+                source_path: release_manifest[path]
+                for source_path, path in release_paths.items()
+            }
+        ),
+        merkle_tree(source_manifest),
+        counts,
+    ):
+        differences[status].append(release_paths[path])
+    return {
+        "release_files": len(release_manifest),
+        "source_files": len(source_manifest),
+        "generated_skipped": generated,
+        "matched": len(release_manifest)
+        - len(differences["added"])
+        - len(differences["changed"]),
+        "directories_skipped": counts["directories_skipped"],
+        "prefixes": {top: prefix for top, prefix in prefixes.items() if prefix},
+        "added": sorted(differences["added"]),
+        "changed": sorted(differences["changed"]),
+    }
+
+
+def candidate_tags(pkg_name, pkg_version):
+    """Tag names projects commonly give the commit of a release"""
+    return [
+        "v" + pkg_version,
+        pkg_version,
+        pkg_name + "-" + pkg_version,
+        pkg_name + "-v" + pkg_version,
+        "release-" + pkg_version,
+    ]
+
+
+def github_repo_url(github_page):
+    """https://github.com/<owner>/<repo> for a github page, or None"""
+    parts = urlsplit(github_page)
+    path = [part for part in parts.path.split("/") if part]
+    if parts.hostname not in ("github.com", "www.github.com") or len(path) < 2:
+        return None
+    repo = path[1][: -len(".git")] if path[1].endswith(".git") else path[1]
+    return "https://github.com/" + path[0] + "/" + repo
+
+
+def select_source_artifact(release_files):
+    """The release's sdist, closest to the source tree, else any file"""
+    for release_file in release_files:
+        if release_file["packagetype"] == "sdist" and not release_file.get("yanked"):
+            return release_file
+    for release_file in release_files:
+        if not release_file.get("yanked"):
+            return release_file
+    return None
+
+
+def check_source_correspondence(pkg_name, pkg_version, release_files, github_page):
+    """Compare a release file with the source at the release's github tag
+
+    release_files is the release's "urls" list from the PyPI JSON.
+    Returns the compare_manifests() report with the "tag" that matched,
+    or a report whose "tag" is None if the repo has none of the
+    candidate tags. Returns None without a github repo or release file.
+    """
+    # Imported here so the module can be used without the analysis tooling
+    from static import scan_workspace  # pylint: disable=import-outside-toplevel
+
+    repo_url = github_repo_url(github_page or "")
+    artifact_file = select_source_artifact(release_files)
+    if repo_url is None or artifact_file is None:
+        return None
+    backend = get_backend()
+    with scan_workspace() as workspace:
+        # Tag tarballs are streamed to disk, never held in memory
+        tarball_path = os.path.join(workspace, "source.tar.gz")
+        for tag in candidate_tags(pkg_name, pkg_version):
+            if backend.save_github_archive(repo_url, tag, tarball_path):
+                break
+        else:
+            return {"repo": repo_url, "tag": None}
+        digest = artifact_file["digests"]["sha256"]
+        artifact_path = local_path(artifact_file["url"])
+        if artifact_path is not None:
+            check_local_artifact(artifact_path, digest)
+        else:
+            artifact_path = os.path.join(
+                workspace, os.path.basename(artifact_file["filename"])
+            )
+            download_artifact(artifact_file["url"], digest, artifact_path)
+        report = compare_manifests(
+            archive_manifest(artifact_path), archive_manifest(tarball_path)
+        )
+    report["repo"] = repo_url
+    report["tag"] = tag
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("release", help="Release file, e.g. a wheel or sdist.")
+    parser.add_argument(
+        "source", help="Source tarball, git repository or directory to compare with."
+    )
+    parser.add_argument("--ref", help="Tag or commit of a git repository.")
+    args = parser.parse_args()
+
+    if args.ref is not None and not git_ref_exists(args.source, args.ref):
+        parser.error("no such ref: " + args.ref)
+    print(
+        json.dumps(
+            compare_manifests(
+                archive_manifest(args.release), source_manifest(args.source, args.ref)
+            ),
+            indent=2,
+        )
+    )
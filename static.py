@@ -1,146 +1,508 @@
 """Functions to download package from pip and perform static analysis"""
 
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 import glob
+import multiprocessing
 import os
-import re
 import shutil
 import subprocess
 import sys
-import zipfile
+import tempfile
+import time
 
-import pandas as pd
+from packaging import tags
 
+import analysis_cache
+from analysis_cache import analyzer_fingerprint, load_results, store_results
+from ast_checks import generate_ast_dict
+from artifact import (
+    ArchiveLimitError,
+    is_archive,
+    is_python_source,
+    iter_members,
+    safe_member_path,
+)
+import backends
+import http_cache
+import http_client
+import profiling
+from remote_artifact import download_report, fetch_artifact
 
-def download_and_unzip_package(package):
-    """Download via pip the desired package and then unzip"""
+# Seconds one package may spend in pylint before partial results are used
+PYLINT_TIME_BUDGET = 300
 
-    # TODO: Will this work for all downloads? Are they all .whl files?
-    # TODO: In the future, analyze dependencies too.
+# Options for every pylint run. Reports and the score are computed from
+# the run's statistics instead of being printed.
+PYLINT_OPTIONS = ["--persistent=n", "--reports=n", "--score=n"]
 
-    if os.path.exists("pkg-source"):
-        shutil.rmtree("pkg-source")
-    os.mkdir("pkg-source")
+# RAM-backed directory for scan workspaces, when the system has one
+TMPFS_DIR = "/dev/shm"
 
-    # Download from pip and place in pkg-source directory
-    subprocess.check_call(
-        [
-            sys.executable,
-            "-m",
-            "pip",
-            "-q",
-            "download",
-            "--no-dependencies",
-            "--destination-directory",
-            "pkg-source/.",
-            package,
-        ]
-    )
+# Version of pkgscan's own analysis steps, including the ast_checks
+# detectors. Bump it whenever they change so results stored by earlier
+# versions are not reused.
+ANALYSIS_VERSION = 2
+
+# Prefix of the digests results read by range requests are stored under
+RANGE_KEY_PREFIX = "range-"
+
+# Processes one package's lint and AST passes may use, None for one per
+# CPU. analysis_pool() workers, of which one per CPU already runs, use 1.
+ANALYSIS_PROCESSES = None
+
+# Wheel tags this interpreter supports, most preferred first, as pip uses
+_supported_tags = None
 
-    # Identify and unzip any .whl files
-    file_list = glob.glob("pkg-source/*.whl")
-    for file in file_list:
-        with zipfile.ZipFile(file, "r") as zip_ref:
-            zip_ref.extractall("pkg-source")
 
+@contextmanager
+def scan_workspace():
+    """Create a private directory for one scan and always remove it after
 
-def generate_bandit_csv():
-    """Run bandit and generate csv of results"""
+    Each scan gets its own directory, so any number of scans can run at
+    the same time. It is placed on tmpfs when available.
+    """
+    parent = None
+    if os.path.isdir(TMPFS_DIR) and os.access(TMPFS_DIR, os.W_OK):
+        parent = TMPFS_DIR
+    workspace = tempfile.mkdtemp(prefix="pkgscan-", dir=parent)
     try:
+        yield workspace
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+
+
+def analyze_package(package, pypi_data=None):
+    """Run all static analysis on a package, reusing stored results
+
+    With the package's PyPI JSON, the release file pip would pick is
+    chosen up front. If that artifact's sha256 digest was already
+    analyzed by the same analyzer versions, the stored results are
+    returned without downloading anything. Otherwise the file is read
+    from its URL, and only without the JSON is pip used to find it.
+    """
+    artifact_file = select_artifact(pypi_data) if pypi_data else None
+    if artifact_file is None:
+        return run_static_analysis(package)
+
+    digest = artifact_file["digests"]["sha256"]
+    fingerprint = analyzer_fingerprint(analyzer_versions())
+    keys = [digest]
+    # A wheel would be read by range requests, so their results will do
+    if artifact_file["filename"].lower().endswith(".whl"):
+        keys.append(RANGE_KEY_PREFIX + digest)
+    with profiling.span("cache lookup", "analysis") as details:
+        for key in keys:
+            static_analysis = load_results(key, fingerprint)
+            if static_analysis is not None:
+                break
+        details["cache"] = "miss" if static_analysis is None else "hit"
+    if static_analysis is not None:
+        size = artifact_file.get("size")
+        static_analysis["download"] = download_report("cached", size, 0, 0)
+        return static_analysis
+    static_analysis = run_static_analysis(package, artifact_file)
+    if is_reusable(static_analysis):
+        # Range reads never hash the whole file, so what they read isn't
+        # known to match the digest and is stored apart from checked files
+        if static_analysis["download"]["method"] == "range":
+            digest = RANGE_KEY_PREFIX + digest
+        store_results(digest, fingerprint, static_analysis)
+    return static_analysis
+
+
+def is_reusable(static_analysis):
+    """Whether results are worth storing for later scans of the artifact
+
+    Results cut short by the pylint budget, or where bandit failed, may
+    come out differently next time, so they are not kept.
+    """
+    return (
+        static_analysis["pylint"]["complete"]
+        and static_analysis["bandit"].get("count_all") != "Error"
+    )
+
+
+def run_static_analysis(package, artifact_file=None):
+    """Fetch a package and run all static analysis in a fresh workspace
+
+    With artifact_file, the package's entry from the PyPI JSON "urls"
+    list, the release file is read from its URL. Otherwise pip downloads
+    it. static_analysis["download"] reports the bytes this fetched.
+    """
+    static_analysis = {}
+    with scan_workspace() as workspace:
+        if artifact_file is None:
+            sources, download = download_and_read_package(package, workspace)
+        else:
+            sources, download = fetch_and_read_artifact(artifact_file, workspace)
+        static_analysis["download"] = download
+        # Every file is parsed once for all of pkgscan's own detectors
+        with profiling.span("ast checks", "analysis"):
+            static_analysis["ast_checks"] = generate_ast_dict(
+                sources, ANALYSIS_PROCESSES
+            )
+        with profiling.span("bandit", "analysis"):
+            static_analysis["bandit"] = generate_bandit_dict(workspace)
+        with profiling.span("pylint", "analysis"):
+            static_analysis["pylint"] = generate_pylint_dict(workspace)
+    return static_analysis
+
+
+def analyzer_versions():
+    """Versions and settings of every analyzer that results depend on"""
+    # pylint: disable=import-outside-toplevel
+    import bandit
+    import pylint
+
+    return {
+        "analysis_version": ANALYSIS_VERSION,
+        "bandit": bandit.__version__,
+        "pylint": pylint.__version__,
+        "pylint_options": PYLINT_OPTIONS,
+    }
+
+
+def wheel_tag_rank(filename, supported_tags):
+    """Rank of a wheel's best tag for this interpreter, None if unsupported"""
+    # Wheel names end in -{python tag}-{abi tag}-{platform tag}.whl
+    tag_string = "-".join(filename[: -len(".whl")].split("-")[-3:])
+    ranks = [
+        supported_tags[str(tag)]
+        for tag in tags.parse_tag(tag_string)
+        if str(tag) in supported_tags
+    ]
+    return min(ranks) if ranks else None
+
+
+def select_artifact(pypi_data):
+    """Choose the latest release's file that pip would download here
+
+    Like pip, the compatible wheel with the most preferred tag wins and
+    an sdist is only used when no wheel fits. Returns the file's entry
+    from the PyPI JSON "urls" list, or None.
+    """
+    global _supported_tags  # pylint: disable=global-statement
+    if _supported_tags is None:
+        _supported_tags = {str(tag): rank for rank, tag in enumerate(tags.sys_tags())}
+
+    release_files = [
+        release_file
+        for release_file in pypi_data.get("urls", [])
+        if not release_file.get("yanked")
+    ]
+    best_wheel = None
+    best_rank = None
+    for release_file in release_files:
+        if release_file["packagetype"] != "bdist_wheel":
+            continue
+        rank = wheel_tag_rank(release_file["filename"], _supported_tags)
+        if rank is not None and (best_rank is None or rank < best_rank):
+            best_wheel = release_file
+            best_rank = rank
+    if best_wheel is not None:
+        return best_wheel
+    for release_file in release_files:
+        if release_file["packagetype"] == "sdist":
+            return release_file
+    return None
+
+
+@contextmanager
+def analysis_pool(max_workers=None):
+    """Run analyze_package() for many packages at once in worker processes
+
+    Yields a function taking the same arguments as analyze_package(),
+    which blocks its calling thread until a worker process returns the
+    results. Batch scans pass it to each Package, so the CPU-bound
+    analysis of many packages runs in parallel while their threads
+    fetch everything else.
+    """
+    # Spawn rather than fork, because callers have threads running
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=context,
+        initializer=init_analysis_worker,
+        initargs=(analysis_worker_settings(),),
+    ) as executor:
+
+        def analyze(package, pypi_data=None):
+            future = executor.submit(analyze_in_worker, package, pypi_data)
+            static_analysis, spans = future.result()
+            profiling.extend(spans)
+            return static_analysis
+
+        yield analyze
+
+
+def analysis_worker_settings():
+    """Settings an analysis_pool() worker must share with this process
+
+    main.py sets these from the command line, and spawned workers import
+    every module afresh, so they would otherwise have the defaults.
+    """
+    return {
+        "backend": backends.get_backend(),
+        "http_cache_enabled": http_cache.enabled,
+        "analysis_cache_enabled": analysis_cache.enabled,
+        "analysis_cache_dir": analysis_cache.ANALYSIS_CACHE_DIR,
+        "profiling_enabled": profiling.enabled,
+        "timeout": http_client.TIMEOUT,
+    }
+
+
+def init_analysis_worker(settings):
+    """Apply analysis_worker_settings() in a newly started worker"""
+    global ANALYSIS_PROCESSES  # pylint: disable=global-statement
+    backends.set_backend(settings["backend"])
+    http_cache.enabled = settings["http_cache_enabled"]
+    analysis_cache.enabled = settings["analysis_cache_enabled"]
+    analysis_cache.ANALYSIS_CACHE_DIR = settings["analysis_cache_dir"]
+    profiling.enabled = settings["profiling_enabled"]
+    http_client.TIMEOUT = settings["timeout"]
+    # The pool already runs a worker per CPU, so each analyzes its
+    # package in-process rather than starting processes of its own
+    ANALYSIS_PROCESSES = 1
+
+
+def analyze_in_worker(package, pypi_data=None):
+    """analyze_package() in a worker, returning its results and spans"""
+    static_analysis = analyze_package(package, pypi_data)
+    return static_analysis, profiling.take()
+
+
+def download_and_read_package(package, workspace):
+    """Download via pip the desired package and read its Python sources
+
+    Wheels and sdists are read in memory rather than extracted. Only the
+    .py files are written to the workspace's src directory, for tools
+    that need paths. Returns a dict mapping each source file's archive
+    path to its bytes, and a report of the bytes downloaded.
+    """
+
+    # Dependencies are not downloaded. Scanning with --deps analyzes each
+    # one as a node of its own, so shared dependencies are analyzed once.
+    # Download from pip and place in the workspace
+    with profiling.span("pip download", "subprocess") as details:
         subprocess.check_call(
             [
-                "bandit",
-                "--quiet",  # Suppress output
-                "--recursive",
-                "--format",
-                "csv",
-                "-o",
-                "pkg-source/bandit.csv",  # output file path
-                "--ignore-nosec",  # ignore the nosec designation
-                "pkg-source",
+                sys.executable,
+                "-m",
+                "pip",
+                "-q",
+                "download",
+                "--no-dependencies",
+                "--destination-directory",
+                workspace,
+                package,
             ]
         )
-    except:
-        pass
+        archive_list = [
+            path for path in glob.glob(os.path.join(workspace, "*")) if is_archive(path)
+        ]
+        details["bytes"] = sum(os.path.getsize(path) for path in archive_list)
+    with profiling.span("read sources", "analysis"):
+        sources = read_package_sources(archive_list)
+    write_python_sources(sources, os.path.join(workspace, "src"))
+    return sources, download_report("pip", details["bytes"], details["bytes"], 1)
 
 
-def generate_bandit_dict():
-    """Parse bandit csv and return count of issues"""
-    generate_bandit_csv()
-    bandit = {}
-    if os.path.exists("pkg-source/bandit.csv"):
+def fetch_and_read_artifact(artifact_file, workspace):
+    """Read a release file's Python sources from its URL, without pip
+
+    Wheels are read by range requests where the server allows it, see
+    remote_artifact. The sources are written to the workspace's src
+    directory like download_and_read_package does.
+    """
+    sources, archive_path, download = fetch_artifact(artifact_file, workspace)
+    if sources is None:
+        with profiling.span("read sources", "analysis"):
+            sources = read_package_sources([archive_path])
+    write_python_sources(sources, os.path.join(workspace, "src"))
+    return sources, download
+
+
+def read_package_sources(archive_list):
+    """Read the Python source files of archives into memory"""
+    sources = {}
+    for archive_path in archive_list:
         try:
-            df = pd.read_csv("pkg-source/bandit.csv")
-            # Count number of vulnerabilities by severity
-            bandit["count_all"] = len(df)
-            bandit["count_low"] = len(df[df.issue_severity == "LOW"])
-            bandit["count_medium"] = len(df[df.issue_severity == "MEDIUM"])
-            bandit["count_high"] = len(df[df.issue_severity == "HIGH"])
-        except:
-            bandit["count_all"] = "Error"
-    return bandit
+            for name, data in iter_members(archive_path, is_python_source):
+                sources[name] = data
+        except ArchiveLimitError as error:
+            # Analyze what was read before the limit rather than nothing
+            print("WARNING: " + archive_path + ": " + str(error), file=sys.stderr)
+    return sources
 
 
-def generate_pylint_files():
-    """Run pylint against each .py file and create folder of output files"""
+def write_python_sources(sources, directory):
+    """Write in-memory sources below directory, skipping unsafe paths"""
+    for name, data in sources.items():
+        relative_path = safe_member_path(name)
+        if relative_path is None:
+            continue
+        path = os.path.join(directory, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
 
-    # Identify all .py files recursively
-    # TODO: Why do I need both globs? Investigate glob more
-    file_list = glob.glob("pkg-source/**/*.py")
-    file_list.extend(glob.glob("pkg-source/*.py"))
-
-    # Create directory to store pylint output files
-    os.mkdir("pkg-source/pylint")
-
-    # Run pylint againt each file and store output as text files
-    for file in file_list:
-        # Extract name for storing a text file of pylint output per file
-        file_name_with_extension = os.path.basename(file)
-        file_name_no_extension = os.path.splitext(file_name_with_extension)[0]
-        results_file_path = os.path.join(
-            "pkg-source", "pylint", file_name_no_extension + ".txt"
+
+def generate_bandit_dict(workspace):
+    """Run bandit through its Python API and return count of issues"""
+    # Imported here so scans without static analysis don't load bandit
+    from bandit.core import config, manager  # pylint: disable=import-outside-toplevel
+
+    bandit = {}
+    try:
+        # ignore_nosec matches the CLI's --ignore-nosec designation
+        bandit_manager = manager.BanditManager(
+            config.BanditConfig(), "file", quiet=True, ignore_nosec=True
         )
-        try:
-            # Run pylint and pipe output to a text file for later analysis
-            output_file = open(results_file_path, "w")
-            subprocess.check_call(["pylint", file], stdout=output_file)
-        except subprocess.CalledProcessError:
-            pass
+        bandit_manager.discover_files([os.path.join(workspace, "src")], recursive=True)
+        bandit_manager.run_tests()
+        # Count number of vulnerabilities by severity straight from the
+        # issue objects, with no intermediate file
+        severities = [issue.severity for issue in bandit_manager.get_issue_list()]
+        bandit["count_all"] = len(severities)
+        bandit["count_low"] = severities.count("LOW")
+        bandit["count_medium"] = severities.count("MEDIUM")
+        bandit["count_high"] = severities.count("HIGH")
+    except Exception:  # pylint: disable=broad-except
+        bandit["count_all"] = "Error"
+    return bandit
+
+
+def lint_score(module_stats):
+    """Compute a module's pylint score from its message counts"""
+    # Modules pylint could not parse, or without code, get no score
+    if not module_stats["statement"] or module_stats["fatal"]:
+        return None
+    weighted_messages = (
+        5 * module_stats["error"]
+        + module_stats["warning"]
+        + module_stats["refactor"]
+        + module_stats["convention"]
+    )
+    # Same formula as pylint's default evaluation setting
+    score = 10.0 - (float(weighted_messages) / module_stats["statement"]) * 10
+    return round(score, 2)
 
 
-def generate_pylint_dict():
+def lint_files(file_list):
+    """Run one in-process pylint linter over files and return per-file results"""
+    # Imported here so only static analysis worker processes load pylint
+    from pylint.lint import Run  # pylint: disable=import-outside-toplevel
+    from pylint.reporters import (  # pylint: disable=import-outside-toplevel
+        CollectingReporter,
+    )
+
+    class ModulePathReporter(CollectingReporter):
+        """Reporter remembering which file each linted module came from"""
+
+        def __init__(self):
+            super().__init__()
+            self.module_paths = {}
+
+        def on_set_current_module(self, module, filepath):
+            super().on_set_current_module(module, filepath)
+            self.module_paths[module] = filepath
+
+    reporter = ModulePathReporter()
+    run = Run(file_list + PYLINT_OPTIONS, reporter=reporter, exit=False)
+    stats = run.linter.stats
+    # Older pylint releases keep statistics in a plain dict
+    by_module = getattr(stats, "by_module", None)
+    if by_module is None:
+        by_module = stats["by_module"]
+
+    results = {}
+    for module, filepath in reporter.module_paths.items():
+        module_stats = by_module.get(module)
+        if not module_stats or not filepath:
+            continue
+        results[filepath] = {
+            "score": lint_score(module_stats),
+            "message_counts": {
+                category: module_stats[category]
+                for category in ("fatal", "error", "warning", "refactor", "convention")
+            },
+        }
+    return results
+
+
+def lint_package_files(file_list, time_budget=PYLINT_TIME_BUDGET, processes=None):
+    """Lint files across worker processes within a wall-clock budget
+
+    Files are split into small chunks so that, when the budget runs out,
+    every finished chunk still contributes. Returns (results, complete).
+    """
+    results = {}
+    if not file_list:
+        return results, True
+    processes = processes or os.cpu_count() or 1
+    chunk_size = max(1, min(20, len(file_list) // (processes * 4)))
+    chunks = [
+        file_list[i : i + chunk_size] for i in range(0, len(file_list), chunk_size)
+    ]
+    deadline = time.monotonic() + time_budget
+    complete = True
+    # With one process, or in daemonic workers, as in ProcessPoolExecutor
+    # before Python 3.9, which may not start processes, lint in this
+    # process instead and check the budget between chunks.
+    if processes == 1 or multiprocessing.current_process().daemon:
+        for chunk in chunks:
+            if time.monotonic() > deadline:
+                complete = False
+                break
+            results.update(lint_files(chunk))
+        return results, complete
+    # Spawn rather than fork, because scans run static analysis from
+    # worker threads and forking a threaded process is unsafe
+    context = multiprocessing.get_context("spawn")
+    pool = context.Pool(min(processes, len(chunks)))
+    try:
+        chunk_results = pool.imap_unordered(lint_files, chunks)
+        for _ in chunks:
+            remaining = deadline - time.monotonic()
+            try:
+                results.update(chunk_results.next(timeout=max(0, remaining)))
+            except multiprocessing.TimeoutError:
+                complete = False
+                break
+            except Exception:  # pylint: disable=broad-except
+                # A chunk pylint crashed on is left out like a timeout
+                complete = False
+    finally:
+        # Stop any chunks still running once the budget is spent
+        pool.terminate()
+        pool.join()
+    return results, complete
+
+
+def generate_pylint_dict(workspace):
     """Create dict storing pylint-related data"""
 
-    # Create pylint output for all .py files
-    generate_pylint_files()
+    # Identify all .py files recursively
+    src_dir = os.path.join(workspace, "src")
+    file_list = glob.glob(os.path.join(src_dir, "**", "*.py"), recursive=True)
 
     # Dict for returning pylint data
     pylint = {}
+    results, pylint["complete"] = lint_package_files(
+        file_list, processes=ANALYSIS_PROCESSES
+    )
+    # Key results by path inside the package, not the temporary workspace
+    pylint["files"] = {
+        os.path.relpath(path, src_dir): result for path, result in results.items()
+    }
 
-    # List to store pylint code scores for each .py file
-    lint_scores = []
-
-    # Find all text files storing pylint output
-    file_list = glob.glob("pkg-source/pylint/*.txt")
-    for file in file_list:
-        # Read in file contents
-        with open(file, "r") as f:
-            try:
-                # Extract line that contains score (quirk of pylint)
-                score_line = f.readlines()[-4]
-                # Check that score line exists at all
-                if score_line:
-                    # Find first occurrence of score
-                    score_match = re.search(r"[\d]+.\d\d?", score_line)
-                    # Check that score number exists
-                    if score_match:
-                        score = score_match.group(0)
-                        lint_scores.append(float(score))
-            # TODO: Make more robust. Why do index errors occur?
-            except IndexError:
-                continue
-
-    # Take average of lint scores
-    # TODO: Why is no files found sometimes?
+    # Take average of lint scores of files that have one
+    lint_scores = [
+        result["score"]
+        for result in pylint["files"].values()
+        if result["score"] is not None
+    ]
     if len(lint_scores) == 0:
         pylint["average_lint_score"] = "No files found"
     else:
@@ -148,8 +510,3 @@ def generate_pylint_dict():
         pylint["average_lint_score"] = round(average_lint_score, 2)
 
     return pylint
-
-
-def remove_package_and_static_analysis_artifacts():
-    """Remove directory that stored static analysis objects"""
-    shutil.rmtree("pkg-source")
@@ -1,9 +1,61 @@
 """Tests for pkgscan"""
 
-from bs4 import BeautifulSoup
+import ast
+import base64
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import json
+import os
+import subprocess
+import tarfile
+import threading
+import zipfile
+import zlib
 
-from main import Package
-from pypi_pkg import sort_semantic_version
+import numpy as np
+from packaging.requirements import Requirement
+import requests as requests_lib
+
+import analysis_cache
+import artifact
+import ast_checks
+import backends
+from batch import parse_package_names, print_stored_batch, scan_packages
+import http_cache
+import http_client
+from html_extract import (
+    GithubPageRecord,
+    ProfileRecord,
+    extract_github_page,
+    extract_maintainers,
+    extract_profile,
+)
+from dependency_tree import DependencyTree, resolve_version, target_environment
+from main import DEFAULT_FIELDS, Package
+from pipeline import order_stages, run_stages, shared, shared_calls
+import profiling
+from pypi_stream import reduce_pypi_json, summarize_pypi_json
+from pypi_pkg import (
+    get_first_release_date,
+    get_last_release_date,
+    get_number_releases_past_year,
+    get_pypi_data,
+    is_pypi_pkg_signed,
+    PypiRecord,
+    sort_semantic_version,
+    split_version_pin,
+)
+import remote_artifact
+from result_store import ResultStore, scan_and_store
+import risk_score
+from snapshot_server import SnapshotServer
+import source_correspondence
+import static
+from static import generate_bandit_dict, lint_files, lint_score, scan_workspace
+import typosquat
 
 # Instantiate all packages once and only once
 awscli = Package("awscli", False)
@@ -107,13 +159,13 @@ def test_get_pypi_maintainers_list():
 def test_get_pypi_maintainers_data():
     """Test get_pypi_maintainers_data function"""
     assert len(portunus.pypi_profiles["maintainers_data"]) == 2
-    assert isinstance(portunus.pypi_profiles["maintainers_data"][0], BeautifulSoup)
-    assert isinstance(portunus.pypi_profiles["maintainers_data"][1], BeautifulSoup)
+    assert isinstance(portunus.pypi_profiles["maintainers_data"][0], ProfileRecord)
+    assert isinstance(portunus.pypi_profiles["maintainers_data"][1], ProfileRecord)
     assert len(faucet.pypi_profiles["maintainers_data"]) == 1
-    assert isinstance(faucet.pypi_profiles["maintainers_data"][0], BeautifulSoup)
+    assert isinstance(faucet.pypi_profiles["maintainers_data"][0], ProfileRecord)
     assert len(ryu.pypi_profiles["maintainers_data"]) == 2
-    assert isinstance(ryu.pypi_profiles["maintainers_data"][0], BeautifulSoup)
-    assert isinstance(ryu.pypi_profiles["maintainers_data"][1], BeautifulSoup)
+    assert isinstance(ryu.pypi_profiles["maintainers_data"][0], ProfileRecord)
+    assert isinstance(ryu.pypi_profiles["maintainers_data"][1], ProfileRecord)
 
 
 def test_get_maintainers_account_creation_date():
@@ -164,12 +216,9 @@ def test_get_github_page():
 
 def test_get_github_data():
     """Test get_github_data function"""
-    if pcap2map.github_page_data["github_data_source"] == "API":
-        assert pcap2map.github_page_data["github_data"]["id"] == 254624727
-    else:
-        assert isinstance(pcap2map.github_page_data["github_data"], BeautifulSoup)
-    if scapy.github_page_data["github_data_source"] == "API":
-        assert scapy.github_page_data["github_data"]["id"] == 254624727
+    assert isinstance(pcap2map.github_page_data["github_data"], GithubPageRecord)
+    assert pcap2map.github_page_data["github_data"].raw is None
+    assert isinstance(scapy.github_page_data["github_data"], GithubPageRecord)
 
 
 def test_get_github_stars():
@@ -208,4 +257,1215 @@ def test_bandit_static_analysis():
 def test_pylint_static_analysis():
     """Test pylint static analysis results"""
     assert six.static_analysis["pylint"]["average_lint_score"] in [4.73, "No files found"]
-    assert pcap2map.static_analysis["pylint"]["average_lint_score"] in [6.84, "No files found"]
\ No newline at end of file
+    assert pcap2map.static_analysis["pylint"]["average_lint_score"] in [6.84, "No files found"]
+
+
+def test_run_stages():
+    """Test run_stages runs dependencies first in both modes"""
+    stages = {
+        "total": (lambda first, second: first + second, ["first", "second"]),
+        "second": (lambda first: first + 1, ["first"]),
+        "first": (lambda: 1, []),
+    }
+    assert run_stages(stages) == {"first": 1, "second": 2, "total": 3}
+    assert run_stages(stages, concurrent=False) == run_stages(stages)
+
+
+def test_order_stages_cycle():
+    """Test order_stages rejects a dependency cycle"""
+    try:
+        order_stages({"a": (None, ["b"]), "b": (None, ["a"])})
+    except ValueError:
+        pass
+    else:
+        assert False, "cycle not detected"
+
+
+def test_parse_package_names():
+    """Test parse_package_names on requirements.txt-style lines"""
+    lines = [
+        "# comment",
+        "",
+        "-r other.txt",
+        "requests==2.24.0 \\",
+        "    --hash=sha256:abc",
+        "Django>=3.0; python_version >= '3.6'",
+        "django",
+        "six",
+    ]
+    assert parse_package_names(lines) == ["requests==2.24.0", "Django", "six"]
+    assert parse_package_names(["six==1.15.0", "six", "Six==1.15.0"]) == [
+        "six==1.15.0",
+        "six",
+    ]
+
+
+def test_shared_calls():
+    """Test shared runs identical calls once only inside shared_calls"""
+    calls = []
+
+    @shared
+    def fetch(name):
+        calls.append(name)
+        return name.upper()
+
+    with shared_calls():
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(fetch, ["a", "b", "a", "a"]))
+    assert results == ["A", "B", "A", "A"]
+    assert sorted(calls) == ["a", "b"]
+    fetch("a")
+    assert len(calls) == 3
+
+
+def test_parse_retry_after():
+    """Test parse_retry_after for both header formats"""
+    assert http_client.parse_retry_after("3") == 3.0
+    assert http_client.parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+    assert http_client.parse_retry_after(None) is None
+
+
+def test_http_client_retries(monkeypatch):
+    """Test http_client.send retries 503 responses and counts requests"""
+    statuses = [503, 503, 200]
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):  # pylint: disable=invalid-name
+            self.send_response(statuses.pop(0))
+            self.send_header("Retry-After", "0")
+            self.end_headers()
+
+        def log_message(self, *args):  # pylint: disable=arguments-differ
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        url = "http://127.0.0.1:" + str(server.server_port) + "/"
+        before = http_client.request_counts["127.0.0.1"]
+        assert http_client.send(url).status_code == 200
+        assert http_client.request_counts["127.0.0.1"] - before == 3
+        # A streamed response holds its host's only slot until closed
+        limiter = http_client.HostLimiter(1, 100, 100)
+        monkeypatch.setitem(http_client._limiters, "127.0.0.1", limiter)
+        statuses.append(200)
+        with http_client.send(url, stream=True):
+            assert not limiter.semaphore.acquire(blocking=False)
+        assert limiter.semaphore.acquire(blocking=False)
+        limiter.semaphore.release()
+    finally:
+        server.shutdown()
+        server.server_close()
+    # Connection errors are retried too, with the same backoff
+    monkeypatch.setattr(http_client, "BACKOFF", 0)
+    before = http_client.request_counts["127.0.0.1"]
+    try:
+        http_client.send(url)
+        assert False, "the closed server answered"
+    except requests_lib.ConnectionError:
+        pass
+    assert http_client.request_counts["127.0.0.1"] - before == http_client.RETRIES + 1
+
+
+def test_github_token_scope(monkeypatch):
+    """Test GITHUB_TOKEN is sent to the github API and nowhere else"""
+    monkeypatch.setenv("GITHUB_TOKEN", "secret")
+    received = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):  # pylint: disable=invalid-name
+            received.append(self.headers.get("Authorization"))
+            self.send_response(200)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):  # pylint: disable=arguments-differ
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        http_client.send("http://127.0.0.1:" + str(server.server_port) + "/")
+    finally:
+        server.shutdown()
+    assert received == [None]
+    assert "Authorization" not in http_client.get_session().headers
+    assert http_client.auth_headers("api.github.com") == {
+        "Authorization": "token secret"
+    }
+    assert http_client.auth_headers("pypi.org", {"Range": "bytes=0-1"}) == {
+        "Range": "bytes=0-1"
+    }
+
+
+def test_http_cache_revalidation(tmp_path, monkeypatch):
+    """Test cached_get stores, serves fresh hits and reuses bodies on 304"""
+    monkeypatch.setattr(http_cache, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(http_cache, "_index", None)
+    url = "https://pypi.org/pypi/example/json"
+    sent_headers = []
+
+    def fetch(headers):
+        sent_headers.append(headers)
+        response = requests_lib.Response()
+        response.status_code = 304 if headers else 200
+        response.headers["ETag"] = '"v1"'
+        response._content = b"" if headers else b'{"ok": 1}'
+        response._content_consumed = True
+        return response
+
+    # The JSON endpoint has a TTL of 0, so it is revalidated every time
+    assert http_cache.cached_get(url, fetch).json() == {"ok": 1}
+    assert http_cache.cached_get(url, fetch).json() == {"ok": 1}
+    assert sent_headers == [{}, {"If-None-Match": '"v1"'}]
+    # Profiles are fresh for a week, so no request is sent at all
+    profile_url = "https://pypi.org/user/example/"
+    http_cache.cached_get(profile_url, fetch)
+    http_cache.cached_get(profile_url, fetch)
+    assert len(sent_headers) == 3
+    # Streamed reads revalidate the same entry and read it from disk
+    with http_cache.cached_stream(url, fetch) as (status_code, body, cache_status):
+        assert (status_code, body.read(), cache_status) == (
+            200,
+            b'{"ok": 1}',
+            "revalidated",
+        )
+    new_url = "https://pypi.org/pypi/other/json"
+    with http_cache.cached_stream(new_url, fetch, chunk_size=2) as (_, body, _):
+        assert body.read() == b'{"ok": 1}'
+    assert http_cache.read_entry(new_url)[1] == b'{"ok": 1}'
+
+    # A body failing part way through leaves no temporary file behind
+    def failing_chunks():
+        yield b"{"
+        raise requests_lib.ConnectionError("reset")
+
+    body_path = http_cache.entry_paths(new_url)[1]
+    try:
+        http_cache.atomic_write_chunks(body_path, failing_chunks())
+        assert False, "the failed write succeeded"
+    except requests_lib.ConnectionError:
+        pass
+    assert all(
+        name.endswith((".json", ".body"))
+        for name in os.listdir(os.path.dirname(body_path))
+    )
+
+
+def test_release_index():
+    """Test release metrics answered from the release index"""
+    recent = (datetime.now(timezone.utc) - timedelta(days=30)).isoformat()[:19]
+    releases = {
+        "1.10": [{"upload_time": recent, "has_sig": True}],
+        "0.9": [],
+        "1.2": [{"upload_time": "2019-05-01T10:00:00", "yanked": True}],
+        "1.0-legacy-build": [{"upload_time": "2018-01-01T00:00:00"}],
+        "1.9.1": [{"upload_time": recent}],
+        "2.0rc1": [],
+    }
+    pypi_pkg = {"pypi_record": PypiRecord({"info": {}, "releases": releases})}
+    assert get_first_release_date(pypi_pkg) == "2018-01-01"
+    assert get_last_release_date(pypi_pkg) == recent[:10]
+    assert get_number_releases_past_year(pypi_pkg) == 2
+    assert is_pypi_pkg_signed(pypi_pkg)
+    release_index = pypi_pkg["pypi_record"].release_index
+    assert release_index.versions[0] == "1.0-legacy-build"
+    assert release_index.versions[-1] == "2.0rc1"
+    assert list(release_index.yanked) == [0, 0, 1, 0, 0, 0]
+    # Packages whose releases all lack files have no release dates
+    pypi_pkg = {"pypi_record": PypiRecord({"info": {}, "releases": {"0.1": []}})}
+    assert get_first_release_date(pypi_pkg) == "No release files found"
+    assert get_last_release_date(pypi_pkg) == "No release files found"
+    assert not is_pypi_pkg_signed(pypi_pkg)
+
+
+def test_html_extract():
+    """Test targeted extraction of PyPI and github page elements"""
+    project_page = (
+        '<div><span class="sidebar-section__user-gravatar-text">\n  alice\n'
+        '</span><span class="other">x</span>'
+        '<span class="sidebar-section__user-gravatar-text">bob</span></div>'
+    )
+    assert extract_maintainers(project_page) == ["alice", "bob"]
+
+    profile_page = (
+        '<div class="author-profile__metadiv"><div><time>Jan 3, 2014</time>'
+        "</div><time>later</time></div>"
+        '<div class="left-layout__main"><div><h2>12 projects</h2></div>'
+        "<h2>ignored</h2></div>"
+    )
+    assert extract_profile(profile_page.encode("utf-8")) == ProfileRecord(
+        ["Jan 3, 2014"], ["12"]
+    )
+    assert extract_profile("<html></html>") == ProfileRecord([], [])
+
+    github_page = (
+        '<a class="btn social-count js-social-count" href="#"> 1,234 </a>'
+        '<a class="social-count js-social-count">9</a>'
+    )
+    assert extract_github_page(github_page) == GithubPageRecord("1,234")
+    assert extract_github_page("<html></html>") == GithubPageRecord(None)
+
+
+def test_lazy_package_fields():
+    """Test Package computes only the fields that are read"""
+    package = Package("example", False)
+    assert package.stage_results == {}
+    package.stage_results["pypi_record"] = PypiRecord({"info": {"author": "A. Author"}})
+    assert package.pypi_pkg["author_name"] == "A. Author"
+    package.load(["author_name"])
+    assert list(package.stage_results) == ["pypi_record"]
+    assert "home_page" not in package.pypi_pkg
+
+
+def test_pypi_record():
+    """Test PypiRecord keeps derived fields and drops the raw JSON"""
+    pypi_data = {
+        "info": {
+            "author": "A. Author",
+            "author_email": "a@example.com",
+            "home_page": "https://github.com/example/example",
+            "project_urls": None,
+            "description": "x" * 100000,
+        },
+        "releases": {"1.0": [{"upload_time": "2020-01-01T00:00:00"}]},
+        "urls": [
+            {
+                "filename": "example-1.0.tar.gz",
+                "url": "https://files.example/example-1.0.tar.gz",
+                "packagetype": "sdist",
+                "digests": {"md5": "0" * 32, "sha256": "1" * 64},
+                "size": 1000,
+                "upload_time": "2020-01-01T00:00:00",
+            }
+        ],
+    }
+    record = PypiRecord(pypi_data)
+    assert record.raw is None
+    assert not hasattr(record, "__dict__")
+    assert record.project_urls == {}
+    assert record.urls == [
+        {
+            "filename": "example-1.0.tar.gz",
+            "url": "https://files.example/example-1.0.tar.gz",
+            "packagetype": "sdist",
+            "size": 1000,
+            "digests": {"sha256": "1" * 64},
+        }
+    ]
+    package = Package("example", False)
+    package.stage_results["pypi_record"] = record
+    assert package.pypi_pkg["number_versions"] == 1
+    assert package.pypi_pkg["pypi_data"] is None
+    assert package.github_page_data["github_page"] == pypi_data["info"]["home_page"]
+    assert PypiRecord(pypi_data, keep_raw=True).raw is pypi_data
+
+
+def test_typosquat_index(tmp_path):
+    """Test look-alike names are found in a rebuilt, memory-mapped index"""
+    snapshot = tmp_path / "popular.txt"
+    snapshot.write_text("requests\nnumpy\npython-dateutil\nsix\ntqdm\n")
+    index_path = str(tmp_path / "typosquat.idx")
+    index = typosquat.load_index(str(snapshot), index_path)
+    assert index.similar_names("reqeusts") == ["requests"]
+    assert index.similar_names("numpyy") == ["numpy"]
+    assert index.similar_names("nurnpy") == ["numpy"]
+    assert index.similar_names("pythondateutil") == ["python-dateutil"]
+    assert index.similar_names("r\u0435quests") == ["requests"]
+    assert index.similar_names("tqmd") == ["tqdm"]
+    # The package itself and unrelated or short names are not reported
+    assert index.similar_names("Python_Dateutil") == []
+    assert index.similar_names("six") == []
+    assert index.similar_names("sixx") == []
+    index.close()
+
+    snapshot.write_text("numpy\n")
+    index = typosquat.load_index(str(snapshot), index_path)
+    assert index.similar_names("reqeusts") == []
+    index.close()
+
+
+def write_snapshot(directory):
+    """Save the documents a scan of one package reads to a snapshot"""
+    documents = {
+        "pypi.org/pypi/example/json": json.dumps(
+            {
+                "info": {
+                    "author": "A. Author",
+                    "author_email": "a@example.com",
+                    "home_page": "https://github.com/example/example",
+                    "project_urls": {},
+                },
+                "releases": {"1.0": [{"upload_time": "2020-01-01T00:00:00"}]},
+                "urls": [],
+            }
+        ),
+        "pypi.org/project/example": (
+            '<span class="sidebar-section__user-gravatar-text">alice</span>'
+        ),
+        "pypi.org/user/alice": (
+            '<div class="author-profile__metadiv"><time>Jan 3, 2014</time></div>'
+            '<div class="left-layout__main"><h2>3 projects</h2></div>'
+        ),
+        "pypistats.org/api/packages/example/recent": json.dumps(
+            {"data": {"last_month": 42}}
+        ),
+        "api.github.com/repos/example/example": json.dumps({"stargazers_count": 7}),
+    }
+    for path, document in documents.items():
+        backends.save_document(directory, "https://" + path, document)
+
+
+def test_snapshot_backend(tmp_path, monkeypatch, capsys):
+    """Test a whole scan reads only from a snapshot directory"""
+    write_snapshot(str(tmp_path / "snapshot"))
+    recorded = str(tmp_path / "recorded")
+    monkeypatch.setattr(
+        backends,
+        "_backend",
+        backends.RecordingBackend(
+            backends.SnapshotBackend(str(tmp_path / "snapshot")), recorded
+        ),
+    )
+    package = Package("example", False)
+    package.print(0)
+    output = capsys.readouterr().out
+    assert "First release date: 2020-01-01" in output
+    assert "Maintainer usernames: alice" in output
+    assert "Maintainer accounts creation dates: Jan 3, 2014" in output
+    assert "Github stars: 7" in output
+    assert "Number of PyPI downloads in past month: 42" in output
+
+    # The recorded snapshot holds everything needed to scan again
+    monkeypatch.setattr(backends, "_backend", backends.SnapshotBackend(recorded))
+    package = Package("example", False)
+    package.load(DEFAULT_FIELDS)
+    assert package.github_page_data["github_stars"] == 7
+    assert not backends.get_backend().pypi_json("missing").ok
+    assert backends.snapshot_path(recorded, "https://pypi.org/../../etc") is None
+
+
+def test_snapshot_server(tmp_path, monkeypatch):
+    """Test a scan over HTTP from a local server of a snapshot"""
+    snapshot = str(tmp_path / "snapshot")
+    write_snapshot(snapshot)
+    monkeypatch.setattr(http_cache, "enabled", False)
+    with SnapshotServer(snapshot, latency=0.01) as server:
+        monkeypatch.setattr(
+            backends, "_backend", backends.SnapshotServerBackend(server.url)
+        )
+        package = Package("example", False)
+        package.load(DEFAULT_FIELDS)
+        assert package.github_page_data["github_stars"] == 7
+        assert package.downloads["data"]["last_month"] == 42
+        assert not backends.get_backend().pypi_json("missing").ok
+        assert server.counts["not_found"] == 1
+        # Summaries are parsed as they are downloaded, with or without
+        # the response cache
+        summary = get_pypi_data("example", summary=True)
+        assert summary["info"]["author"] == "A. Author"
+        monkeypatch.setattr(http_cache, "enabled", True)
+        monkeypatch.setattr(http_cache, "CACHE_DIR", str(tmp_path / "cache"))
+        monkeypatch.setattr(http_cache, "_index", None)
+        assert get_pypi_data("example", summary=True) == summary
+        assert get_pypi_data("example", summary=True) == summary
+    # Every request fails, and each is retried before giving up
+    with SnapshotServer(snapshot, error_rate=1.0) as server:
+        response = backends.SnapshotServerBackend(server.url).pypi_json("example")
+        assert response.status_code == 503
+        assert server.counts["errors_injected"] == http_client.RETRIES + 1
+
+
+def test_profiling(tmp_path, monkeypatch):
+    """Test a profiled scan records stages and fetches as spans"""
+    snapshot = str(tmp_path / "snapshot")
+    write_snapshot(snapshot)
+    monkeypatch.setattr(backends, "_backend", backends.SnapshotBackend(snapshot))
+    monkeypatch.setattr(profiling, "enabled", True)
+    monkeypatch.setattr(profiling, "spans", [])
+    Package("example", False).load(DEFAULT_FIELDS)
+    summary = profiling.summarize()
+    assert summary[("stage", "maintainers_data")]["count"] == 1
+    assert summary[("http", "snapshot read")]["count"] == 5
+    assert summary[("http", "snapshot read")]["bytes"] > 0
+    assert set(profiling.summarize("stage")) == {
+        ("stage", name)
+        for name in (
+            "pypi_record",
+            "maintainers_list",
+            "maintainers_data",
+            "github_page",
+            "github_data",
+            "downloads",
+        )
+    }
+    assert "stage:pypi_record" in profiling.format_summary()
+    trace_path = str(tmp_path / "trace.json")
+    profiling.write_chrome_trace(trace_path)
+    with open(trace_path) as f:
+        events = json.load(f)["traceEvents"]
+    assert len(events) == len(profiling.spans)
+    assert all(event["ph"] == "X" and event["dur"] >= 0 for event in events)
+
+
+def test_pinned_scan(tmp_path, monkeypatch):
+    """Test a pinned scan reads one release and the simple index only"""
+    snapshot = str(tmp_path / "snapshot")
+    write_snapshot(snapshot)
+    # Without the full JSON, any use of it would fail the scan
+    os.remove(backends.snapshot_path(snapshot, "https://pypi.org/pypi/example/json"))
+    documents = {
+        "pypi.org/pypi/example/0.9/json": {
+            "info": {"author": "Old Author", "home_page": "", "project_urls": {}},
+            "urls": [
+                {
+                    "filename": "example-0.9.tar.gz",
+                    "url": "https://files.example/example-0.9.tar.gz",
+                    "packagetype": "sdist",
+                    "digests": {"sha256": "1" * 64},
+                    "has_sig": True,
+                }
+            ],
+        },
+        "pypi.org/simple/example": {
+            "versions": ["0.9", "1.0", "1.1"],
+            "files": [
+                {
+                    "filename": "example-1.0-py3-none-any.whl",
+                    "upload-time": "2020-01-01T00:00:00.000000Z",
+                },
+                {"filename": "example-0.9.tar.gz", "upload-time": "2019-06-01T00:00Z"},
+                {"filename": "example-1.0.tar.gz", "upload-time": "2020-01-02T00:00Z"},
+            ],
+        },
+    }
+    for path, document in documents.items():
+        backends.save_document(snapshot, "https://" + path, json.dumps(document))
+    monkeypatch.setattr(backends, "_backend", backends.SnapshotBackend(snapshot))
+
+    package = Package("example", False, version="0.9")
+    assert package.pypi_pkg["author_name"] == "Old Author"
+    assert package.pypi_pkg["pypi_pkg_signed"]
+    assert package.pypi_pkg["first_release_date"] == "2019-06-01"
+    assert package.pypi_pkg["last_release_date"] == "2020-01-01"
+    assert package.pypi_pkg["number_versions"] == 3
+    assert package.pypi_pkg["pypi_record"].urls[0]["filename"] == "example-0.9.tar.gz"
+    assert split_version_pin("example==0.9") == ("example", "0.9")
+    assert split_version_pin("example>=0.9") == ("example", None)
+    assert split_version_pin("example==0.*") == ("example", None)
+
+
+def test_result_store(tmp_path, monkeypatch, capsys):
+    """Test rescans only scan changed packages and record maintainer changes"""
+    snapshot = str(tmp_path / "snapshot")
+    write_snapshot(snapshot)
+    simple_index = "https://pypi.org/simple/example"
+    backends.save_document(
+        snapshot,
+        simple_index,
+        json.dumps({"meta": {"_last-serial": 1}, "versions": ["1.0"], "files": []}),
+    )
+    monkeypatch.setattr(backends, "_backend", backends.SnapshotBackend(snapshot))
+
+    with ResultStore(str(tmp_path / "results.db")) as store:
+        results = list(scan_and_store(store, ["example"], 0))
+        assert [(name, error, reason) for name, _, error, reason in results] == [
+            ("example", None, "new")
+        ]
+        first = store.latest("example")
+        assert first["state"] == "serial:1"
+        assert first["maintainers"] == ["alice"]
+        assert first["fields"]["maintainers_account_creation_date"] == ["Jan 3, 2014"]
+        assert first["fields"]["release_index"]["versions"] == ["1.0"]
+
+        # Nothing changed upstream, so nothing is scanned
+        results = list(scan_and_store(store, ["example"], 0, rescan=True))
+        assert results == [("example", None, None, "unchanged")]
+        results = list(scan_and_store(store, ["example"], 0, rescan=True, max_age=0))
+        assert results[0][3] == "stale"
+
+        # bob replaces alice and PyPI bumps the serial
+        backends.save_document(
+            snapshot,
+            "https://pypi.org/project/example",
+            '<span class="sidebar-section__user-gravatar-text">bob</span>',
+        )
+        backends.save_document(
+            snapshot,
+            "https://pypi.org/user/bob",
+            '<div class="author-profile__metadiv"><time>May 1, 2024</time>',
+        )
+        backends.save_document(
+            snapshot,
+            simple_index,
+            json.dumps({"meta": {"_last-serial": 2}, "versions": ["1.0"]}),
+        )
+        results = list(scan_and_store(store, ["example"], 0, rescan=True))
+        assert results[0][2] is None and results[0][3] == "changed"
+
+        history = store.history("example", with_fields=False)
+        assert [snapshot["state"] for snapshot in history] == [
+            "serial:1",
+            "serial:1",
+            "serial:2",
+        ]
+        changes = store.maintainer_changes("example")
+        assert [(change["maintainer"], change["change"]) for change in changes] == [
+            ("alice", "removed"),
+            ("bob", "added"),
+        ]
+        assert store.maintainer_changes(maintainer="bob")[0]["package"] == "example"
+        assert not store.maintainer_changes(since=history[-1]["scanned_at"] + 1)
+        assert store.history("missing") == [] and store.latest("missing") is None
+
+        # Stored scans keep raw documents and score risk like other batches
+        results = list(scan_and_store(store, ["example"], 0, keep_raw=True))
+        assert results[0][1].pypi_pkg["pypi_record"].raw is not None
+        capsys.readouterr()
+        print_stored_batch(store, ["example"], 0, risk_model=risk_score.RiskModel())
+        output = capsys.readouterr().out
+        assert "Risk scores, riskiest first:" in output
+        assert "Stored in " in output and "Requests per host: " in output
+
+
+def test_dependency_tree(tmp_path, monkeypatch, capsys):
+    """Test each release in a dependency graph is scanned once"""
+    graph = {
+        "app": {
+            "1.0": [
+                "lib>=1",
+                "extra-dep; extra == 'cli'",
+                "py2-dep; python_version < '3'",
+            ]
+        },
+        "lib": {"1.0": ["core[fast]"], "2.0": ["core[fast]"], "3.0rc1": []},
+        "core": {"1.0": ["lib", "speedups; extra == 'fast'"]},
+        "speedups": {"1.0": []},
+    }
+    snapshot = str(tmp_path / "snapshot")
+    documents = {}
+    for name, releases in graph.items():
+        documents["pypi.org/simple/" + name] = {
+            "versions": list(releases),
+            "files": [
+                {
+                    "filename": "{}-{}.tar.gz".format(name, pkg_version),
+                    "upload-time": "2020-01-01T00:00:00Z",
+                }
+                for pkg_version in releases
+            ],
+        }
+        for pkg_version, requires_dist in releases.items():
+            documents["pypi.org/pypi/{}/{}/json".format(name, pkg_version)] = {
+                "info": {"requires_dist": requires_dist},
+                "urls": [],
+            }
+    for path, document in documents.items():
+        backends.save_document(snapshot, "https://" + path, json.dumps(document))
+    monkeypatch.setattr(backends, "_backend", backends.SnapshotBackend(snapshot))
+
+    scanned = []
+    scan_node = DependencyTree.scan_node
+
+    def record_scan(self, key, extras):
+        scanned.append(key)
+        return scan_node(self, key, extras)
+
+    monkeypatch.setattr(DependencyTree, "scan_node", record_scan)
+    environment = target_environment("3.8", "linux")
+    tree = DependencyTree("app", fields=["number_versions"], environment=environment)
+    report = tree.scan().report()
+    assert report["root"] == ("app", "1.0")
+    # lib and core require each other, and both are scanned once
+    assert sorted(scanned) == [
+        ("app", "1.0"),
+        ("core", "1.0"),
+        ("lib", "2.0"),
+        ("speedups", "1.0"),
+    ]
+    assert report["nodes"][("core", "1.0")]["requires"] == {
+        ("lib", "2.0"),
+        ("speedups", "1.0"),
+    }
+    assert report["nodes"][("speedups", "1.0")]["depth"] == 3
+    assert report["counts"]["packages"] == 4
+    assert report["counts"]["unsigned_releases"] == 4
+    assert report["counts"]["failed"] == 0
+    tree.print()
+    output = capsys.readouterr().out
+    assert "Requires: lib==2.0 speedups==1.0" in output
+    assert "Unsigned releases: 4" in output
+
+    # Without download stats every scan fails part way, and printing the
+    # tree doesn't fetch them again
+    tree = DependencyTree(
+        "app", fields=["number_versions", "downloads"], environment=environment
+    )
+    assert tree.scan().counts()["failed"] == 4
+    tree.print()
+    output = capsys.readouterr().out
+    assert output.count("ERROR: Scan failed") == 4
+    assert "Failed: 4" in output
+    # Unresolved requirements sort beside resolved releases of the name
+    tree = DependencyTree("app", fields=[], environment=environment)
+    tree.nodes = {
+        key: {"depth": 1, "requires": requires, "package": None, "error": "x"}
+        for key, requires in (
+            (("lib", "1.0"), [("dep", "2.0"), ("dep", None)]),
+            (("lib", None), []),
+        )
+    }
+    tree.print()
+    assert "lib (depth 1)\n" in capsys.readouterr().out
+    assert (
+        DependencyTree("app", max_depth=1, fields=[]).scan().counts()["packages"] == 2
+    )
+    releases = {"1.0": [{}], "1.1": [{"yanked": True}], "2.0b1": [{}], "3.0": []}
+    assert resolve_version(releases, Requirement("x").specifier) == "1.0"
+    # Yanked releases only match when nothing else does
+    assert resolve_version(releases, Requirement("x>1.0").specifier) == "2.0b1"
+    assert resolve_version(releases, Requirement("x==1.1").specifier) == "1.1"
+    assert resolve_version(releases, Requirement("x>3").specifier) is None
+
+
+def test_risk_score(tmp_path):
+    """Test scoring packages from their fields, with missing values masked"""
+    now = datetime(2021, 1, 1, tzinfo=timezone.utc).timestamp()
+    results = [
+        (
+            "popular",
+            {
+                "number_releases_past_year": 4,
+                "pypi_pkg_signed": True,
+                "maintainers_list": ["a", "b"],
+                "similar_names": [],
+                "maintainers_account_creation_date": ["Feb 12, 2017", "Dec 1, 2020"],
+                "number_of_packages_maintained_by_maintainers": ["23", "1"],
+                "github_stars": "1.2k",
+                "downloads": {"last_month": 100000},
+                "bandit": {"count_high": "Error"},
+            },
+        ),
+        (
+            "suspicious",
+            {
+                "similar_names": ["requests"],
+                "github_stars": "No github found",
+                "downloads": {"data": "error"},
+            },
+        ),
+    ]
+    matrix = risk_score.feature_matrix(results, now)
+    column = matrix.features.index
+    assert matrix.values[0, column("github_stars")] == 1200
+    assert matrix.values[0, column("newest_account_days")] == 31
+    assert matrix.values[0, column("max_maintainer_packages")] == 23
+    assert matrix.missing[0, column("bandit_high")]
+    assert matrix.missing[1, column("github_stars")]
+    assert matrix.missing[1, column("downloads_last_month")]
+    assert not matrix.missing[1, column("similar_names")]
+
+    model = risk_score.RiskModel(
+        {
+            "weights": {
+                "github_stars": {"weight": -1.0, "transform": "log1p", "missing": 10}
+            },
+            "rules": [
+                {"feature": "similar_names", "above": 0, "points": 20},
+                {"feature": "newest_account_days", "below": 90, "points": 5},
+            ],
+        }
+    )
+    scores, contributions = model.score(matrix)
+    assert contributions.shape == (2, 3)
+    assert list(contributions[1]) == [10, 20, 0]
+    assert abs(scores[0] - (5 - np.log1p(1200))) < 1e-9
+    assert risk_score.explain(model, contributions[1]) == [
+        ("similar_names above 0", 20.0),
+        ("github_stars", 10.0),
+    ]
+    assert risk_score.format_scores(matrix, model).startswith("suspicious")
+
+    path = str(tmp_path / "features.npz")
+    risk_score.save_matrix(path, matrix)
+    loaded = risk_score.load_matrix(path)
+    assert loaded.names == ["popular", "suspicious"]
+    assert (model.score(loaded)[0] == scores).all()
+    # The default model scores every feature the matrix has
+    default_scores = risk_score.RiskModel().score(loaded)[0]
+    assert default_scores[1] > default_scores[0]
+
+
+def test_summarize_pypi_json():
+    """Test the incremental parse keeps what the full parse would"""
+    release_file = {
+        "filename": "example-1.0.tar.gz",
+        "url": "https://files.example/example-1.0.tar.gz",
+        "packagetype": "sdist",
+        "upload_time": "2020-01-01T00:00:00",
+        "digests": {"md5": "0" * 32, "sha256": "1" * 64},
+        "has_sig": True,
+        "yanked": False,
+        "comment_text": "x" * 1000,
+    }
+    pypi_data = {
+        "info": {"author": "A. Author", "version": "1.0", "project_urls": None},
+        "last_serial": 1,
+        "releases": {
+            "0.1": [],
+            "0.9": [dict(release_file, yanked=True), dict(release_file, yanked=True)],
+            "1.0": [release_file, dict(release_file, yanked=True)],
+        },
+        "urls": [release_file, dict(release_file, yanked=True)],
+    }
+    data = json.dumps(pypi_data).encode("utf-8")
+    summary = summarize_pypi_json(data)
+    assert summary == reduce_pypi_json(pypi_data)
+    assert summary["info"] == {
+        "author": "A. Author",
+        "version": "1.0",
+        "project_urls": None,
+    }
+    assert summary["releases"]["0.1"] == []
+    assert summary["releases"]["0.9"][0]["yanked"]
+    assert summary["releases"]["1.0"] == [
+        {"upload_time": "2020-01-01T00:00:00", "has_sig": True, "yanked": False}
+    ]
+    assert summary["urls"][1]["digests"] == {"sha256": "1" * 64}
+    try:
+        summarize_pypi_json(b"<html>Not Found</html>")
+        assert False, "invalid JSON was accepted"
+    except ValueError:
+        pass
+
+
+def test_lint_score():
+    """Test lint_score matches pylint's evaluation formula"""
+    stats = {"statement": 10, "fatal": 0, "error": 1, "warning": 1}
+    stats.update({"refactor": 0, "convention": 2})
+    assert lint_score(stats) == 2.0
+    assert lint_score(dict(stats, statement=0)) is None
+    # Like pylint, badly linted modules score below 0
+    assert lint_score(dict(stats, error=3)) == -8.0
+
+
+def test_lint_files(tmp_path):
+    """Test lint_files returns structured per-file results in memory"""
+    module = tmp_path / "example.py"
+    module.write_text('"""Example module"""\n\nVALUE = 1\n')
+    results = lint_files([str(module)])
+    assert results[str(module)]["score"] == 10.0
+    assert results[str(module)]["message_counts"]["error"] == 0
+    # Analysis pool workers lint in-process, with no pool of their own
+    assert static.lint_package_files([str(module)], processes=1) == (results, True)
+
+
+def test_artifact_iter_members(tmp_path, monkeypatch):
+    """Test reading wheel and sdist members in memory with limits"""
+    wheel_path = str(tmp_path / "example-1.0-py3-none-any.whl")
+    with zipfile.ZipFile(wheel_path, "w") as wheel:
+        wheel.writestr("example/__init__.py", "VALUE = 1\n")
+        wheel.writestr("example-1.0.dist-info/METADATA", "Name: example\n")
+    sdist_path = str(tmp_path / "example-1.0.tar.gz")
+    with tarfile.open(sdist_path, "w:gz") as sdist:
+        data = b"print('setup')\n"
+        info = tarfile.TarInfo("example-1.0/setup.py")
+        info.size = len(data)
+        sdist.addfile(info, io.BytesIO(data))
+
+    assert list(artifact.iter_members(wheel_path, artifact.is_python_source)) == [
+        ("example/__init__.py", b"VALUE = 1\n")
+    ]
+    assert len(list(artifact.iter_members(wheel_path))) == 2
+    assert list(artifact.iter_members(sdist_path)) == [("example-1.0/setup.py", data)]
+    assert artifact.safe_member_path("../../etc/passwd") is None
+
+    monkeypatch.setattr(artifact, "MAX_TOTAL_BYTES", 12)
+    try:
+        list(artifact.iter_members(wheel_path))
+    except artifact.ArchiveLimitError:
+        pass
+    else:
+        assert False, "byte limit not enforced"
+
+    # Members that aren't read count too, as a stream must decompress them
+    bomb_path = str(tmp_path / "bomb-1.0.tar.gz")
+    with tarfile.open(bomb_path, "w:gz") as bomb:
+        for name, size in (("bomb-1.0/data.bin", 1024), ("bomb-1.0/setup.py", 1)):
+            info = tarfile.TarInfo(name)
+            info.size = size
+            bomb.addfile(info, io.BytesIO(b"\0" * size))
+    monkeypatch.setattr(artifact, "MAX_TOTAL_BYTES", 512)
+    try:
+        list(artifact.iter_members(bomb_path, artifact.is_python_source))
+    except artifact.ArchiveLimitError:
+        pass
+    else:
+        assert False, "skipped members not counted"
+
+
+def test_remote_artifact(tmp_path, monkeypatch):
+    """Test reading a wheel's sources by range requests, or whole"""
+    monkeypatch.setattr(http_cache, "enabled", False)
+    sources = {
+        "example/__init__.py": b"VALUE = 1\n",
+        "example/util.py": b"def double(x):\n    return 2 * x\n",
+    }
+    record = "".join(
+        "{},sha256={},{}\n".format(
+            name,
+            base64.urlsafe_b64encode(hashlib.sha256(data).digest())
+            .rstrip(b"=")
+            .decode(),
+            len(data),
+        )
+        for name, data in sources.items()
+    )
+    wheel_name = "example-1.0-py3-none-any.whl"
+    wheel_path = tmp_path / "example.whl"
+    with zipfile.ZipFile(str(wheel_path), "w") as wheel:
+        wheel.writestr("example/__init__.py", sources["example/__init__.py"])
+        # Incompressible data stands in for a compiled extension
+        wheel.writestr("example/_speedups.so", os.urandom(512 * 1024))
+        wheel.writestr("example/util.py", sources["example/util.py"])
+        wheel.writestr("example-1.0.dist-info/RECORD", record)
+    wheel_bytes = wheel_path.read_bytes()
+    artifact_file = {
+        "filename": wheel_name,
+        "digests": {"sha256": hashlib.sha256(wheel_bytes).hexdigest()},
+        "size": len(wheel_bytes),
+    }
+    backends.save_document(
+        str(tmp_path / "snapshot"), "https://files.example/" + wheel_name, wheel_bytes
+    )
+
+    with SnapshotServer(str(tmp_path / "snapshot")) as server:
+        artifact_file["url"] = server.url + "/files.example/" + wheel_name
+        read, archive_path, download = remote_artifact.fetch_artifact(
+            artifact_file, str(tmp_path)
+        )
+        assert read == sources and archive_path is None
+        assert download["method"] == "range"
+        assert download["artifact_bytes"] == len(wheel_bytes)
+        assert download["bytes_saved"] > 400 * 1024 and download["requests"] == 2
+        assert server.counts["bytes_sent"] == download["bytes_fetched"]
+
+    # Files already on disk are read in place, saving no download
+    artifact_file["url"] = "file://" + str(wheel_path)
+    read, archive_path, download = remote_artifact.fetch_artifact(
+        artifact_file, str(tmp_path)
+    )
+    assert read is None and archive_path == str(wheel_path)
+    assert download["method"] == "local" and download["bytes_saved"] == 0
+
+    # Servers that ignore ranges send the whole wheel, which is kept
+    workspace = tmp_path / "workspace"
+    workspace.mkdir()
+    with SnapshotServer(str(tmp_path / "snapshot"), ranges=False) as server:
+        artifact_file["url"] = server.url + "/files.example/" + wheel_name
+        read, archive_path, download = remote_artifact.fetch_artifact(
+            artifact_file, str(workspace)
+        )
+        assert read is None and os.path.basename(archive_path) == wheel_name
+        assert dict(artifact.iter_members(archive_path, artifact.is_python_source)) == (
+            sources
+        )
+        assert download["method"] == "download" and download["bytes_saved"] == 0
+        assert server.counts["requests"] == 1
+
+        artifact_file["digests"]["sha256"] = "0" * 64
+        try:
+            remote_artifact.fetch_artifact(artifact_file, str(workspace))
+        except remote_artifact.ArtifactIntegrityError:
+            pass
+        else:
+            assert False, "digest not checked"
+
+    try:
+        remote_artifact.check_record({"example/util.py": b"changed"}, record.encode())
+    except remote_artifact.ArtifactIntegrityError:
+        pass
+    else:
+        assert False, "RECORD not checked"
+
+
+def test_source_correspondence(tmp_path, monkeypatch):
+    """Test comparing a release with its source in git, a checkout or a tarball"""
+    digest = source_correspondence.normalized_digest
+    assert digest([b"a\r", b"\nb\r"]) == digest([b"a\nb\n"])
+    assert digest([b"\0\r\n"]) != digest([b"\0\n"])
+
+    source_files = {
+        "setup.py": b"from setuptools import setup\r\nsetup()\r\n",
+        "src/example/__init__.py": b"from .util import double\r\n",
+        "src/example/util.py": b"def double(x):\n    return 2 * x\n",
+        "src/example/sub/a.py": b"A = 1\n",
+        "src/example/sub/b.py": b"B = 2\n",
+        "tests/test_util.py": b"def test_double():\n    pass\n",
+    }
+    repository = tmp_path / "repository"
+    for name, data in source_files.items():
+        path = repository / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+    git = ["git", "-C", str(repository), "-c", "user.name=a", "-c", "user.email=a@a"]
+    subprocess.run(git + ["init", "-q"], check=True)
+    subprocess.run(git + ["add", "."], check=True)
+    subprocess.run(git + ["commit", "-q", "-m", "1.0"], check=True)
+    subprocess.run(git + ["tag", "v1.0"], check=True)
+    tarball_path = str(tmp_path / "example-1.0.tar.gz")
+    with tarfile.open(tarball_path, "w:gz") as tarball:
+        tarball.add(str(repository / "src"), "example-1.0/src")
+        tarball.add(str(repository / "setup.py"), "example-1.0/setup.py")
+
+    # The wheel has LF line endings, one changed and one injected module
+    wheel_path = str(tmp_path / "example-1.0-py3-none-any.whl")
+    with zipfile.ZipFile(wheel_path, "w") as wheel:
+        wheel.writestr("example/__init__.py", b"from .util import double\n")
+        wheel.writestr("example/util.py", b"import os\ndef double(x):\n    pass\n")
+        wheel.writestr("example/sub/a.py", b"A = 1\n")
+        wheel.writestr("example/sub/b.py", b"B = 2\n")
+        wheel.writestr("example/_backdoor.py", b"import socket\n")
+        wheel.writestr("example-1.0.dist-info/RECORD", b"")
+
+    release = source_correspondence.archive_manifest(wheel_path)
+    for source in (
+        source_correspondence.source_manifest(str(repository), "v1.0"),
+        source_correspondence.source_manifest(str(repository)),
+        source_correspondence.source_manifest(tarball_path),
+    ):
+        report = source_correspondence.compare_manifests(release, source)
+        assert report["added"] == ["example/_backdoor.py"]
+        assert report["changed"] == ["example/util.py"]
+        assert report["matched"] == 3 and report["generated_skipped"] == 1
+        assert report["directories_skipped"] == 1
+        assert report["prefixes"] == {"example": "src/"}
+
+    # A scan fetches the tarball of the first tag that exists. Recording
+    # the repo's page and then its tarball saves both to one snapshot.
+    snapshot = str(tmp_path / "snapshot")
+    repo_url = "https://github.com/example/example"
+    backends.save_document(snapshot, repo_url, "<html></html>")
+    with open(tarball_path, "rb") as f:
+        backends.save_document(
+            snapshot, repo_url + "/archive/refs/tags/v1.0.tar.gz", f.read()
+        )
+    recorded = str(tmp_path / "recorded")
+    recording = backends.RecordingBackend(backends.SnapshotBackend(snapshot), recorded)
+    monkeypatch.setattr(backends, "_backend", recording)
+    assert recording.github_page(repo_url).ok
+    wheel_bytes = open(wheel_path, "rb").read()
+    release_files = [
+        {
+            "packagetype": "bdist_wheel",
+            "filename": os.path.basename(wheel_path),
+            "url": "file://" + wheel_path,
+            "digests": {"sha256": hashlib.sha256(wheel_bytes).hexdigest()},
+        }
+    ]
+    report = source_correspondence.check_source_correspondence(
+        "example", "1.0", release_files, "https://github.com/example/example/issues"
+    )
+    assert report["tag"] == "v1.0" and report["added"] == ["example/_backdoor.py"]
+    # Replaying the recording gives the same report
+    monkeypatch.setattr(backends, "_backend", backends.SnapshotBackend(recorded))
+    assert backends.get_backend().github_page(repo_url).ok
+    replayed = source_correspondence.check_source_correspondence(
+        "example", "1.0", release_files, repo_url
+    )
+    assert replayed["added"] == report["added"]
+    assert replayed["changed"] == report["changed"]
+    # Over HTTP the tarball is streamed to a file
+    with SnapshotServer(recorded) as server:
+        server_backend = backends.SnapshotServerBackend(server.url)
+        saved_path = str(tmp_path / "saved.tar.gz")
+        assert server_backend.save_github_archive(repo_url, "v1.0", saved_path)
+        assert open(saved_path, "rb").read() == open(tarball_path, "rb").read()
+        assert not server_backend.save_github_archive(repo_url, "v9", saved_path)
+    report = source_correspondence.check_source_correspondence(
+        "example", "2.0", release_files, "https://github.com/example/example"
+    )
+    assert report == {"repo": "https://github.com/example/example", "tag": None}
+
+
+def test_scan_workspace():
+    """Test each scan gets its own workspace, removed afterwards"""
+    with scan_workspace() as first, scan_workspace() as second:
+        assert first != second
+        with open(os.path.join(first, "bandit.csv"), "w") as f:
+            f.write("issue_severity\n")
+    assert not os.path.exists(first)
+    assert not os.path.exists(second)
+
+
+def test_generate_bandit_dict():
+    """Test bandit issues are counted by severity without a csv"""
+    with scan_workspace() as workspace:
+        os.mkdir(os.path.join(workspace, "src"))
+        with open(os.path.join(workspace, "src", "risky.py"), "w") as f:
+            f.write("import subprocess\nexec(input())  # nosec\n")
+        bandit = generate_bandit_dict(workspace)
+    assert bandit["count_medium"] == 1
+    assert bandit["count_low"] == 1
+    assert bandit["count_all"] == 2
+
+
+def test_ast_checks():
+    """Test one pass over each file finds risky code and complexity"""
+    payload = base64.b64encode(zlib.compress(os.urandom(200))).decode()
+    sources = {
+        "pkg/__init__.py": (
+            "import base64 as b, zlib\n"
+            "from subprocess import call\n"
+            "exec(zlib.decompress(b.b64decode('{}')))\n"
+            "call(['id'])\n"
+            "if __name__ == '__main__':\n"
+            "    call(['id'])\n"
+        ).format(payload),
+        "setup.py": "import urllib.request\nurllib.request.urlopen('http://x')\n",
+        "pkg/branchy.py": (
+            "def branchy(x):\n"
+            '    """Docstring with {}"""\n'
+            "    for y in x:\n"
+            "        if y:\n"
+            "            continue\n"
+            "        while y:\n"
+            "            try:\n"
+            "                pass\n"
+            "            except ValueError:\n"
+            "                pass\n"
+            "    return [z for z in x if z]\n"
+        ).format(payload),
+        "pkg/py2.py": "print 'hello'\n",
+    }
+    results = ast_checks.generate_ast_dict(sources, processes=1)
+    assert results["files_unparsed"] == 1
+    assert results["by_detector"] == {
+        "exec_decoded": 1,
+        "encoded_payload": 1,
+        "high_entropy_string": 1,
+        "setup_py_risk": 1,
+        "import_time_side_effect": 2,
+    }
+    assert results["count_high"] == 2
+    assert results["findings"][0]["file"] == "pkg/__init__.py"
+    assert results["findings"][0]["line"] == 3
+    assert results["mccabe"]["functions"] == 1
+    assert results["mccabe"]["max"] == 5
+    assert results["mccabe"]["complex_functions"] == []
+    # Literals are read the same whatever node types this Python emits
+    literals = ast.parse("'s', b'b', 1, x").body[0].value.elts
+    assert [ast_checks.literal_value(node) for node in literals] == [
+        "s",
+        b"b",
+        None,
+        None,
+    ]
+
+    # The process pool gives the same results
+    many_sources = {
+        "pkg/module{}.py".format(number): sources["pkg/__init__.py"]
+        for number in range(ast_checks.MIN_POOL_FILES)
+    }
+    pooled = ast_checks.generate_ast_dict(many_sources, processes=2)
+    assert pooled["count_all"] == 5 * ast_checks.MIN_POOL_FILES
+
+
+def test_select_artifact():
+    """Test select_artifact prefers a compatible wheel over the sdist"""
+    pypi_data = {
+        "urls": [
+            {"packagetype": "sdist", "filename": "example-1.0.tar.gz"},
+            {
+                "packagetype": "bdist_wheel",
+                "filename": "example-1.0-cp27-cp27mu-manylinux1_i686.whl",
+            },
+            {
+                "packagetype": "bdist_wheel",
+                "filename": "example-1.0-py2.py3-none-any.whl",
+            },
+        ]
+    }
+    selected = static.select_artifact(pypi_data)
+    assert selected["filename"] == "example-1.0-py2.py3-none-any.whl"
+    pypi_data["urls"] = pypi_data["urls"][:2]
+    assert static.select_artifact(pypi_data)["filename"] == "example-1.0.tar.gz"
+
+
+def test_analysis_cache_reuse(tmp_path, monkeypatch):
+    """Test stored results are reused without downloading the artifact"""
+    monkeypatch.setattr(analysis_cache, "ANALYSIS_CACHE_DIR", str(tmp_path))
+    digest = "ab" * 32
+    pypi_data = {
+        "urls": [
+            {
+                "packagetype": "sdist",
+                "filename": "example-1.0.tar.gz",
+                "url": "https://files.example/example-1.0.tar.gz",
+                "digests": {"sha256": digest},
+            }
+        ]
+    }
+    fingerprint = analysis_cache.analyzer_fingerprint(static.analyzer_versions())
+    stored = {"bandit": {"count_all": 0}, "pylint": {"complete": True}}
+    analysis_cache.store_results(digest, fingerprint, stored)
+
+    def fail(requirement):
+        raise AssertionError("downloaded " + requirement)
+
+    monkeypatch.setattr(static, "run_static_analysis", fail)
+    static_analysis = static.analyze_package("example", pypi_data)
+    assert static_analysis.pop("download")["bytes_fetched"] == 0
+    assert static_analysis == stored
+
+    # Batch scans analyze in worker processes, which are given the same
+    # settings, so find the same results and hand back their spans
+    monkeypatch.setattr(profiling, "enabled", True)
+    monkeypatch.setattr(profiling, "spans", [])
+    snapshot = str(tmp_path / "snapshot")
+    write_snapshot(snapshot)
+    backends.save_document(
+        snapshot,
+        "https://pypi.org/pypi/example/json",
+        json.dumps(
+            {
+                "info": {"home_page": "", "project_urls": {}, "version": "1.0"},
+                "releases": {
+                    "1.0": [
+                        dict(release_file, upload_time="2020-01-01T00:00:00")
+                        for release_file in pypi_data["urls"]
+                    ]
+                },
+                "urls": pypi_data["urls"],
+            }
+        ),
+    )
+    monkeypatch.setattr(backends, "_backend", backends.SnapshotBackend(snapshot))
+    results = list(scan_packages(["example"], 1, 2, ["bandit", "download"]))
+    assert results[0][2] is None and results[0][1].static_analyzer is not None
+    assert results[0][1].static_analysis["bandit"] == stored["bandit"]
+    assert results[0][1].static_analysis["download"]["method"] == "cached"
+    assert profiling.summarize("analysis")[("analysis", "cache lookup")]["count"] == 1
+
+    # A bandit failure may not happen again, so it is not stored
+    failed = {"bandit": {"count_all": "Error"}, "pylint": {"complete": True}}
+    monkeypatch.setattr(
+        static, "run_static_analysis", lambda package, artifact_file: dict(failed)
+    )
+    other_file = dict(pypi_data["urls"][0], digests={"sha256": "cd" * 32})
+    assert static.analyze_package("example", {"urls": [other_file]}) == failed
+    assert analysis_cache.load_results("cd" * 32, fingerprint) is None
+
+    # Range reads never check the PyPI digest, so their results are kept
+    # apart from those of scans that hash the whole file
+    read = {
+        "bandit": {"count_all": 0},
+        "pylint": {"complete": True},
+        "download": remote_artifact.download_report("range", 100, 10, 2),
+    }
+    monkeypatch.setattr(
+        static, "run_static_analysis", lambda package, artifact_file: dict(read)
+    )
+    static.analyze_package("example", {"urls": [other_file]})
+    assert analysis_cache.load_results("cd" * 32, fingerprint) is None
+    assert analysis_cache.load_results("range-" + "cd" * 32, fingerprint) == read
@@ -0,0 +1,295 @@
+"""Find popular package names that a scanned name closely imitates
+
+Popular names are read once from a snapshot file into an index that is
+written to disk and memory-mapped on later runs, so a query costs a few
+binary searches instead of a comparison with every popular name.
+
+Names are compared by their skeleton: the PEP 503 name with homoglyphs
+folded to one letter and separators removed. The index stores a hash of
+every skeleton with up to one character deleted. Two skeletons within
+one edit of each other (insertion, deletion, substitution or swap of
+neighbours) always share one of those, so looking up the deletions of a
+queried skeleton finds every candidate, and each is then checked with
+an exact comparison.
+
+    $ python typosquat.py build popular_packages.txt
+    $ python typosquat.py query reqeusts
+"""
+
+import argparse
+from array import array
+from bisect import bisect_left
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import unicodedata
+import zlib
+
+from packaging.utils import canonicalize_name
+
+# Snapshot of popular names, one per line or a top-pypi-packages JSON dump
+SNAPSHOT_PATH = os.environ.get(
+    "PKGSCAN_POPULAR_NAMES",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "popular_packages.txt"),
+)
+# Index built from the snapshot, rebuilt whenever the snapshot changes
+INDEX_PATH = os.environ.get(
+    "PKGSCAN_TYPOSQUAT_INDEX",
+    os.path.join(os.path.expanduser("~"), ".cache", "pkgscan-typosquat.idx"),
+)
+
+# Shorter skeletons are only matched when equal, since one edit turns
+# most short names into another real one
+MIN_EDIT_LENGTH = 4
+
+# Characters that look alike, folded to the letter they imitate. Digraphs
+# are replaced before single characters.
+DIGRAPHS = {"rn": "m", "vv": "w", "cl": "d"}
+HOMOGLYPHS = str.maketrans(
+    {
+        "0": "o",
+        "1": "l",
+        "i": "l",
+        "3": "e",
+        "5": "s",
+        "@": "a",
+        # Cyrillic and Greek letters drawn like Latin ones
+        "а": "a",
+        "е": "e",
+        "о": "o",
+        "р": "p",
+        "с": "c",
+        "у": "y",
+        "х": "x",
+        "і": "l",
+        "ο": "o",
+        "α": "a",
+        # Separators are dropped entirely
+        "-": None,
+        "_": None,
+        ".": None,
+    }
+)
+
+# File layout: header, name offsets, "name\nskeleton" strings, then
+# sorted entries. Each entry is (hash of a deletion << 32) | name id, so
+# one sorted array of unsigned 64-bit ints holds keys and postings.
+MAGIC = b"PKGSQT01"
+HEADER = struct.Struct("<8s32sII")
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def skeleton(name):
+    """Fold a name to the form typosquats of it are compared in"""
+    name = unicodedata.normalize("NFKD", name)
+    # Drop accents left as combining marks by the decomposition
+    name = "".join(char for char in name if not unicodedata.combining(char))
+    name = canonicalize_name(name)
+    for digraph, letter in DIGRAPHS.items():
+        name = name.replace(digraph, letter)
+    return name.translate(HOMOGLYPHS)
+
+
+def deletions(word):
+    """The word and every string made by deleting one character of it"""
+    variants = {word}
+    for position in range(len(word)):
+        variants.add(word[:position] + word[position + 1 :])
+    return variants
+
+
+def key_hash(word):
+    """Hash of a deletion that is stable between runs, unlike hash()"""
+    return zlib.crc32(word.encode("utf-8"))
+
+
+def within_one_edit(first, second):
+    """Check whether two different words are one edit apart
+
+    An edit is inserting, deleting or substituting one character, or
+    swapping two neighbouring ones.
+    """
+    if len(first) > len(second):
+        first, second = second, first
+    if len(second) - len(first) > 1:
+        return False
+    # Skip the common prefix, then compare what follows the first change
+    position = 0
+    while position < len(first) and first[position] == second[position]:
+        position += 1
+    if len(first) < len(second):
+        return first[position:] == second[position + 1 :]
+    # Same length: one substitution, or a swap of neighbours
+    return first[position + 1 :] == second[position + 1 :] or (
+        first[position + 2 :] == second[position + 2 :]
+        and first[position : position + 2] == second[position : position + 2][::-1]
+    )
+
+
+def read_snapshot(path):
+    """Read popular names from a text file or top-pypi-packages JSON"""
+    with open(path, "rb") as f:
+        data = f.read()
+    if data.lstrip().startswith(b"{"):
+        return [row["project"] for row in json.loads(data)["rows"]]
+    names = []
+    for line in data.decode("utf-8").splitlines():
+        line = line.split("#", 1)[0].strip()
+        if line:
+            names.append(line)
+    return names
+
+
+def snapshot_digest(path):
+    """sha256 of a snapshot file, recorded in the index built from it"""
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).digest()
+
+
+def build_index(names, path, digest=b"\0" * 32):
+    """Write the index of names to path"""
+    # One entry per PEP 503 name, keeping the first spelling seen
+    unique_names = {}
+    for name in names:
+        unique_names.setdefault(canonicalize_name(name), name)
+    names = list(unique_names.values())
+
+    offsets = array("I", [0])
+    blob = bytearray()
+    entries = array("Q")
+    for name_id, name in enumerate(names):
+        word = skeleton(name)
+        blob += (name + "\n" + word).encode("utf-8")
+        offsets.append(len(blob))
+        for word in deletions(word):
+            entries.append(key_hash(word) << 32 | name_id)
+    entries = array("Q", sorted(entries))
+    # Pad so the entries start on an 8-byte boundary
+    blob += b"\0" * (-(HEADER.size + len(offsets) * 4 + len(blob)) % 8)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, digest, len(names), len(entries)))
+        offsets.tofile(f)
+        f.write(blob)
+        entries.tofile(f)
+    os.replace(tmp_path, path)
+
+
+class TyposquatIndex:
+    """A memory-mapped index of popular names, as written by build_index"""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.digest, name_count, entry_count = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            raise ValueError("not a typosquat index: " + path)
+        view = memoryview(self.map)
+        start = HEADER.size
+        end = start + (name_count + 1) * 4
+        self.offsets = view[start:end].cast("I")
+        self.names = view[end : end + self.offsets[-1]]
+        entries_start = len(self.map) - entry_count * 8
+        self.entries = view[entries_start:].cast("Q")
+
+    def name(self, name_id):
+        """Popular name and its skeleton stored under an id"""
+        start, end = self.offsets[name_id], self.offsets[name_id + 1]
+        return bytes(self.names[start:end]).decode("utf-8").split("\n")
+
+    def candidates(self, word):
+        """Ids of names sharing a deletion with a skeleton"""
+        name_ids = set()
+        for variant in deletions(word):
+            key = key_hash(variant)
+            position = bisect_left(self.entries, key << 32)
+            while position < len(self.entries):
+                entry = self.entries[position]
+                if entry >> 32 != key:
+                    break
+                name_ids.add(entry & 0xFFFFFFFF)
+                position += 1
+        return name_ids
+
+    def similar_names(self, pkg_name):
+        """Popular names pkg_name imitates, look-alikes before typos
+
+        The package itself, under any spelling PEP 503 treats as the same
+        name, is never reported.
+        """
+        word = skeleton(pkg_name)
+        matches = []
+        for name_id in self.candidates(word):
+            name, other_word = self.name(name_id)
+            if word == other_word:
+                # Same skeleton: a homoglyph or separator look-alike
+                distance = 0
+            elif min(len(word), len(other_word)) < MIN_EDIT_LENGTH:
+                continue
+            elif within_one_edit(word, other_word):
+                distance = 1
+            else:
+                continue
+            if canonicalize_name(name) != canonicalize_name(pkg_name):
+                matches.append((distance, name))
+        return [name for _, name in sorted(matches)]
+
+    def close(self):
+        """Release the memory map"""
+        self.offsets.release()
+        self.names.release()
+        self.entries.release()
+        self.map.close()
+
+
+def load_index(snapshot_path=None, index_path=None):
+    """Open the index, building it first if missing or out of date"""
+    snapshot_path = snapshot_path or SNAPSHOT_PATH
+    index_path = index_path or INDEX_PATH
+    digest = snapshot_digest(snapshot_path)
+    try:
+        index = TyposquatIndex(index_path)
+        if index.digest == digest:
+            return index
+        index.close()
+    except (OSError, ValueError, struct.error):
+        pass
+    build_index(read_snapshot(snapshot_path), index_path, digest)
+    return TyposquatIndex(index_path)
+
+
+def get_similar_names(pkg_name):
+    """Popular package names that pkg_name is suspiciously close to"""
+    global _index  # pylint: disable=global-statement
+    with _index_lock:
+        if _index is None:
+            _index = load_index()
+    return _index.similar_names(pkg_name)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="Build the index.")
+    build_parser.add_argument("snapshot", nargs="?", default=SNAPSHOT_PATH)
+    build_parser.add_argument("-o", "--output", default=INDEX_PATH)
+    query_parser = subparsers.add_parser("query", help="Look up names.")
+    query_parser.add_argument("names", nargs="+")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build_index(
+            read_snapshot(args.snapshot), args.output, snapshot_digest(args.snapshot)
+        )
+        print("Wrote " + args.output, file=sys.stderr)
+    else:
+        for query_name in args.names:
+            print(query_name + ": " + " ".join(get_similar_names(query_name)))